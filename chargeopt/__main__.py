@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+
+import gurobipy as gp
+import numpy as np
+import pandas as pd
+
+# Headless ChargeOpt, for scripts, CI and reproducing a dashboard run without streamlit:
+#   python -m chargeopt solve --buses buses.csv --blocks blocks.json --chargers chargers.csv \
+#       --start 2024-05-01T20:00 --backend highs --time-limit 60 --dump dumps/
+#   python -m chargeopt replay dumps/chargeopt_<date> --backend highs
+#   python -m chargeopt replay dumps/chargeopt_<date> --rerun
+# Inputs are csv or json (a list of rows) with the columns of the dashboard's tables:
+#   buses     vehicle, soc (e.g. 85%), status
+#   blocks    block_id, block_startTime, block_endTime (e.g. 06:30 AM), Mileage
+#   chargers  stationName
+#   assignments  vehicle, block_id (for --run-type Assigned, the block each bus runs on the covered day)
+# --tariff is a csv (first column) or json list of $/kWh per 15 minutes, one day or the whole horizon.
+# The gurobi license comes from GUROBI_ACCESSID, GUROBI_SECRET and GUROBI_LICENSE (see session.py),
+# CHARGEOPT_CONFIG and CHARGEOPT_DATA move config.yml and the cache/outputs (see helpers.py).
+# --start is an ISO date and time, or a time like 08:00 PM for today.
+# The summary of the run is the only thing printed to stdout, as json (and written to --out as summary.json),
+# the solver log and status messages go to stderr.
+
+
+def read_table(path, numeric=()):
+    # csv or json rows as strings like the dashboard's tables, numeric columns as floats
+    if path.endswith('.json'):
+        with open(path) as f:
+            table = pd.DataFrame(json.load(f)).astype(str)
+    else:
+        table = pd.read_csv(path, dtype=str)
+    for column in numeric:
+        table[column] = table[column].astype(float)
+    return table
+
+
+def read_tariff(path):
+    if path.endswith('.json'):
+        with open(path) as f:
+            return np.asarray(json.load(f), dtype=float)
+    return pd.read_csv(path).iloc[:, 0].to_numpy(dtype=float)
+
+
+def notify(message):
+    print(message, file=sys.stderr)
+
+
+def parse_start(text):
+    # the plan start: an ISO date and time, or a clock time like the dashboard's for today
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        clock = datetime.strptime(text, '%I:%M %p')
+        return datetime.combine(datetime.now().date(), clock.time())
+
+
+@contextmanager
+def log_to_stderr():
+    # gurobi writes its log (and the license banner) straight to file descriptor 1,
+    # point it at stderr while the solver runs so stdout is only the json summary
+    sys.stdout.flush()
+    saved = os.dup(1)
+    os.dup2(2, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+def solve(args):
+    from chargeopt.optimization import ChargeOpt
+
+    buses = read_table(args.buses)
+    blocks = read_table(args.blocks, numeric=['Mileage'])
+    chargers = read_table(args.chargers)
+    opt = ChargeOpt(buses, blocks, chargers)
+    opt.startTime = parse_start(args.start)
+    opt.notify = notify
+    opt.dump = args.dump
+    if args.tariff:
+        opt.tariff = read_tariff(args.tariff)
+    if args.assignments:
+        assignments = read_table(args.assignments)
+        opt.assigned = dict(zip(assignments['vehicle'], assignments['block_id']))
+    if args.backend:
+        opt.overrides['solverBackend'] = args.backend
+    if args.time_limit is not None:
+        opt.overrides['timeLimit'] = args.time_limit
+    with log_to_stderr():
+        result = opt.solve(args.run_type)
+    return report(opt, result, args.out)
+
+
+def rerun(path, args):
+    # the dumped inputs solved again with the current code and config, same start time and run type
+    from chargeopt.optimization import ChargeOpt
+    from chargeopt.replay import load_inputs
+
+    buses, blocks, chargers, run = load_inputs(path)
+    opt = ChargeOpt(buses, blocks, chargers)
+    opt.startTime = datetime.fromisoformat(run['startTime'])
+    opt.notify = notify
+    opt.tariff = run['tariff']
+    opt.assigned = run.get('assigned') or {}
+    if args.backend:
+        opt.overrides['solverBackend'] = args.backend
+    if args.time_limit is not None:
+        opt.overrides['timeLimit'] = args.time_limit
+    with log_to_stderr():
+        result = opt.solve(run['runType'])
+    return report(opt, result, args.out)
+
+
+def report(opt, result, out):
+    # prints the summary, writes the schedule and assignments to out, exit code 1 without a plan
+    summary = {'status': result.status, 'runType': result.runType, 'objVal': result.objVal,
+               'solTime': result.solTime, 'buildTime': result.buildTime, 'runId': result.runId,
+               'diagnosis': result.diagnosis, 'telemetry': result.telemetry}
+    print(json.dumps(summary, indent=1, default=str))
+    if out:
+        os.makedirs(out, exist_ok=True)
+        with open(os.path.join(out, 'summary.json'), 'w') as f:
+            json.dump(summary, f, indent=1, default=str)
+        if result.solved:
+            result.export(out)
+    return 0 if result.solved else 1
+
+
+def replay_model(args):
+    from chargeopt.replay import replay
+
+    if args.rerun:
+        return rerun(args.path, args)
+    backend = args.backend or 'gurobi'
+    with log_to_stderr():
+        solved = replay(args.path, backend, args.time_limit)
+    print(json.dumps({'backend': backend, **solved}, indent=1, default=str))
+    return 0 if solved['status'] == gp.GRB.OPTIMAL else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m chargeopt', description="Headless ChargeOpt runs")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('solve', help="plan charging for buses, blocks and chargers")
+    run.add_argument('--buses', required=True, help="csv or json")
+    run.add_argument('--blocks', required=True, help="csv or json")
+    run.add_argument('--chargers', required=True, help="csv or json")
+    run.add_argument('--tariff', default=None, help="csv or json of $/kWh per 15 minutes, default: init_grid_pricing")
+    run.add_argument('--start', default=datetime.now().isoformat(timespec='minutes'),
+                     help="plan start, e.g. 2024-05-01T20:00, or '08:00 PM' for today")
+    run.add_argument('--run-type', choices=['Optimal', 'Assigned', 'Decomposed', 'Heuristic'], default='Optimal')
+    run.add_argument('--assignments', default=None, help="csv or json of vehicle, block_id for Assigned runs")
+    run.add_argument('--dump', default=None, help="write the model and inputs of an Optimal solve under this directory")
+    run.set_defaults(handler=solve)
+
+    again = commands.add_parser('replay', help="re-solve a dump written by solve --dump")
+    again.add_argument('path', help="dump directory, e.g. dumps/chargeopt_<date>")
+    again.add_argument('--rerun', action='store_true', help="solve the dumped inputs with the current code instead of the dumped model")
+    again.set_defaults(handler=replay_model)
+
+    for command in [run, again]:
+        command.add_argument('--backend', choices=['gurobi', 'highs', 'auto'], default=None, help="default: config.yml")
+        command.add_argument('--time-limit', type=float, default=None, help="seconds, default: config.yml")
+        command.add_argument('--config', default=None, help="config.yml to use instead of chargeopt/config.yml")
+        command.add_argument('--data-dir', default=None, help="where the cache and outputs go instead of ~/.local/share/chargeopt")
+        command.add_argument('--out', default=None, help="directory for the schedule and assignments")
+
+    args = parser.parse_args()
+    if args.config:
+        os.environ['CHARGEOPT_CONFIG'] = os.path.abspath(args.config)
+    if args.data_dir:
+        os.environ['CHARGEOPT_DATA'] = os.path.abspath(args.data_dir)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import multiprocessing
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from types import SimpleNamespace
+import gurobipy as gp
+import numpy as np
+from scipy.optimize import Bounds, LinearConstraint, milp
+
+from chargeopt.session import EnvPool, SESSION_LOCK
+
+# Open-source backend for the ChargeOpt models.
+# The model builders stay the one description of the model: they build a gurobipy model, which
+# standard_form reads once into sparse matrices (the size limit of gurobipy's bundled license only
+# applies to optimize, not to building). HiGHS, through scipy.optimize.milp, then solves those
+# without any gurobi license, e.g. on CI or dev machines without the WLS secrets.
+# solverBackend in config.yml picks the backend: gurobi, highs, or auto (gurobi when its license
+# can be had, HiGHS otherwise).
+# HiGHS takes no MIP starts or callbacks, so a HiGHS solve can't show progress. A background solve
+# (see jobs.py) runs it on a process of its own instead, which Cancel terminates.
+
+# scipy.optimize.milp status -> the gurobi status ChargeOpt.solve checks
+HIGHS_STATUS = {0: gp.GRB.OPTIMAL, 1: gp.GRB.TIME_LIMIT, 2: gp.GRB.INFEASIBLE, 3: gp.GRB.UNBOUNDED}
+
+
+class HighsSession:
+    # stands in for session.SolverSession when the model is solved with HiGHS
+    backend = 'highs'
+
+    def __init__(self):
+        # the bundled license is enough to build models of any size, an Env per concurrent solve
+        # like SolverSession, Envs aren't thread-safe
+        self.envs = EnvPool({'OutputFlag': 0})
+
+    @contextmanager
+    def model(self, opt, config, reuse=True):
+        # (model, handles) like SolverSession.model, always a model of its own
+        with self.envs.slot() as slot:
+            m = gp.Model("Charge opt", env=slot['env'])
+            if config.get('builder', 'matrix') == 'loop':
+                handles = opt._build_loop(m)
+            else:
+                handles = opt._build_matrix(m)
+            try:
+                yield m, handles
+            finally:
+                m.dispose()
+
+
+def standard_form(m):
+    # min c @ x + offset  s.t.  lhs <= A @ x <= rhs,  lb <= x <= ub,  x integer where integrality is 1
+    m.update()
+    if m.NumQConstrs > 0 or m.NumGenConstrs > 0 or m.IsQP:
+        # HiGHS would solve the model without them and call that optimal
+        raise ValueError(f"HiGHS only solves linear models, this one has {m.NumQConstrs} quadratic "
+                         f"and {m.NumGenConstrs} general constraints")
+    constrs = m.getConstrs()
+    variables = m.getVars()
+    sense = np.array(m.getAttr('Sense', constrs))
+    rhs = np.array(m.getAttr('RHS', constrs), dtype=float)
+    vtype = np.array(m.getAttr('VType', variables))
+    return {
+        'c': np.array(m.getAttr('Obj', variables), dtype=float) * m.ModelSense,
+        'offset': m.ObjCon,
+        'A': m.getA().tocsr(),
+        'lhs': np.where(sense == '<', -np.inf, rhs),
+        'rhs': np.where(sense == '>', np.inf, rhs),
+        'lb': np.array(m.getAttr('LB', variables), dtype=float),
+        'ub': np.array(m.getAttr('UB', variables), dtype=float),
+        'integrality': np.isin(vtype, ['B', 'I']).astype(int),
+    }
+
+
+def solve_highs(m, form=None, cancelled=None):
+    # solves the gurobi model m with HiGHS, with m's MIPGap and TimeLimit
+    # returns status (a gurobi status), x (in the order of m.getVars()), objVal, runtime, gap and nodes
+    # cancelled (a function, e.g. of a job) runs HiGHS on a process of its own that is stopped once it returns True
+    if form is None:
+        form = standard_form(m)
+    options = {'disp': False, 'mip_rel_gap': m.Params.MIPGap}
+    if m.Params.TimeLimit < gp.GRB.INFINITY:
+        options['time_limit'] = m.Params.TimeLimit
+
+    start = time.perf_counter()
+    res = _milp(form, options) if cancelled is None else _killable_milp(form, options, cancelled)
+    runtime = time.perf_counter() - start
+    if res is None:
+        return SimpleNamespace(status=gp.GRB.INTERRUPTED, x=None, objVal=None, runtime=runtime, gap=None, nodes=None)
+
+    found = res['x'] is not None
+    return SimpleNamespace(
+        status=HIGHS_STATUS.get(res['status'], gp.GRB.NUMERIC),
+        x=res['x'],
+        objVal=res['fun'] * m.ModelSense + form['offset'] if found else None,
+        runtime=runtime,
+        gap=res['gap'] if found else None,
+        nodes=res['nodes'],
+    )
+
+
+def _milp(form, options):
+    res = milp(form['c'], integrality=form['integrality'], bounds=Bounds(form['lb'], form['ub']),
+               constraints=LinearConstraint(form['A'], form['lhs'], form['rhs']), options=options)
+    return {'status': res.status, 'x': res.x, 'fun': res.fun,
+            'gap': getattr(res, 'mip_gap', None), 'nodes': getattr(res, 'mip_node_count', None)}
+
+
+def _milp_process(form, options, conn):
+    conn.send(_milp(form, options))
+    conn.close()
+
+
+def _killable_milp(form, options, cancelled):
+    # _milp on a spawned process (a fork of a server with solve threads can deadlock), None once cancelled
+    context = multiprocessing.get_context('spawn')
+    receive, send = context.Pipe(duplex=False)
+    process = context.Process(target=_milp_process, args=(form, options, send), daemon=True)
+    process.start()
+    send.close()
+    try:
+        while not receive.poll(0.2):
+            if cancelled():
+                return None
+            if not process.is_alive() and not receive.poll():
+                raise RuntimeError(f"HiGHS process ended without a result (exit code {process.exitcode})")
+        return receive.recv()
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+
+@lru_cache(maxsize=None)
+def _highs_session():
+    return HighsSession()
+
+
+def highs_session():
+    # one per process, like session.solver_session
+    with SESSION_LOCK:
+        return _highs_session()
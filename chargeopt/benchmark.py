@@ -0,0 +1,270 @@
+import argparse
+import time
+from datetime import datetime
+
+import gurobipy as gp
+import pandas as pd
+
+from chargeopt.backends import solve_highs
+from chargeopt.decomposition import decomposed_plan
+from chargeopt.helpers import load_config
+from chargeopt.optimization import ChargeOpt
+from chargeopt.screening import screen
+from chargeopt.session import gurobi_params
+from chargeopt.symmetry import add_symmetry_breaking
+from helper import convert_block_time
+
+# compares the full and lean formulations and the decomposed solve on fleets built from the approved blocks
+# run from the repo root:
+#   python -m chargeopt.benchmark --time-limit 300 --out bench.csv
+# or gurobi against HiGHS (see backends.py) on the same models:
+#   python -m chargeopt.benchmark --backends --time-limit 300
+# or with and without symmetry breaking (see symmetry.py) on fleets with several fully charged buses:
+#   python -m chargeopt.benchmark --symmetry --time-limit 300 [--backend highs]
+# or horizons of 1 to 7 days, every day from the covered one on but the last covered, joint against daily linking (see horizon.py):
+#   python -m chargeopt.benchmark --horizons --fleet 5,5 --time-limit 300 [--backend highs]
+
+# (buses, blocks) per case, every bus gets a block like opt_form preselects
+CASES = [(3, 3), (5, 5), (8, 8), (10, 10)]
+# (buses, blocks, fully charged buses) for the symmetry comparison
+SYMMETRY_CASES = [(4, 2, 3), (6, 3, 4), (8, 4, 6), (10, 5, 8)]
+# horizon lengths in days for the horizon comparison
+HORIZONS = range(1, 8)
+
+
+def load_blocks(numBlocks):
+    # same block set and formatting as opt_form, shortest blocks first
+    # blocks that pull in after midnight are left out, the model treats them as same-day blocks
+    df = pd.read_csv('data_files/block_miles.csv', header=1, delimiter=';')
+    df = df[['BLOCK', 'TOTAL MILES', 'PULL OUT', 'PULL IN']]
+    df = df[df['TOTAL MILES'] > 0]
+    df = df.loc[50:79].sort_values('TOTAL MILES')
+    start = df['PULL OUT'].apply(convert_block_time)
+    end = df['PULL IN'].apply(convert_block_time)
+    df = df[end > start].head(numBlocks)
+    blocks = pd.DataFrame({
+        'block_id': df['BLOCK'].astype(str),
+        'block_startTime': start[df.index].apply(lambda x: x.strftime("%I:%M %p")),
+        'block_endTime': end[df.index].apply(lambda x: x.strftime("%I:%M %p")),
+        'Mileage': df['TOTAL MILES'],
+    })
+    return blocks.reset_index(drop=True)
+
+
+def make_fleet(numBuses, numBlocks, numChargers=5):
+    # buses between 92% and 100% state of charge, enough for any of the first 10 blocks
+    # without charging before they leave
+    soc = [f'{92 + (8 * b) // max(numBuses - 1, 1)}%' for b in range(numBuses)]
+    buses = pd.DataFrame({'vehicle': [str(7500 + b) for b in range(numBuses)],
+                          'soc': soc,
+                          'status': ['Idle'] * numBuses})
+    chargers = pd.DataFrame({'stationName': [f'Station {c + 1}' for c in range(numChargers)]})
+    return buses, load_blocks(numBlocks), chargers
+
+
+def run_case(env, buses, blocks, chargers, config, startTime, timeLimit, seed=0, backend='gurobi'):
+    # builds and solves one instance with gurobi or highs, returns timings and model size
+    opt = ChargeOpt(buses, blocks.copy(), chargers)
+    opt.startTime = startTime
+    opt._prepare(config)
+    diagnosis = screen(opt)
+    if not diagnosis.feasible:
+        return {'status': f'screened out: {diagnosis.status}', 'screen_time': diagnosis.seconds}
+
+    m = gp.Model("Charge opt", env=env)
+    m.setParam('MIPGap', 0.03)
+    m.setParam('TimeLimit', timeLimit)
+    m.setParam('Seed', seed)
+    m.setParam('OutputFlag', 0)
+
+    start = time.perf_counter()
+    handles = opt._build_matrix(m)
+    if config.get('symmetryBreaking', True):
+        add_symmetry_breaking(opt, m, handles)
+    m.update()
+    buildTime = time.perf_counter() - start
+
+    size = {'numVars': m.NumVars, 'numBinVars': m.NumBinVars, 'numConstrs': m.NumConstrs + m.NumQConstrs}
+    if backend == 'highs':
+        highs = solve_highs(m)
+        return {'status': highs.status, 'build_time': buildTime, 'solve_time': highs.runtime,
+                'obj_val': highs.objVal, 'gap': highs.gap, 'nodes': highs.nodes, **size, 'numNZs': m.NumNZs}
+
+    try:
+        m.optimize()
+    except gp.GurobiError as e:
+        return {'status': f'solver error: {e}', 'build_time': buildTime, **size}
+    return {
+        'status': m.Status,
+        'build_time': buildTime,
+        'solve_time': m.Runtime,
+        'obj_val': m.ObjVal if m.SolCount > 0 else None,
+        'gap': m.MIPGap if m.SolCount > 0 else None,
+        'nodes': m.NodeCount,
+        **size,
+        'numNZs': m.NumNZs,
+    }
+
+
+def run_decomposed(buses, blocks, chargers, config, startTime, workers):
+    # times the decomposition on one instance
+    opt = ChargeOpt(buses, blocks.copy(), chargers)
+    opt.startTime = startTime
+    opt._prepare(config)
+    diagnosis = screen(opt)
+    if not diagnosis.feasible:
+        return {'status': f'screened out: {diagnosis.status}'}
+
+    start = time.perf_counter()
+    plan = decomposed_plan(opt, workers)
+    return {
+        'status': 'no plan' if plan is None else 'plan',
+        'solve_time': time.perf_counter() - start,
+        'obj_val': None if plan is None else plan['cost'],
+    }
+
+
+def compare_backends(env, startTime, timeLimit, out=None):
+    # the same model of every case solved by gurobi and by highs
+    rows = []
+    for numBuses, numBlocks in CASES:
+        buses, blocks, chargers = make_fleet(numBuses, numBlocks)
+        for backend in ['gurobi', 'highs']:
+            result = run_case(env, buses, blocks, chargers, load_config(), startTime, timeLimit, backend=backend)
+            rows.append({'buses': numBuses, 'blocks': numBlocks, 'method': backend, **result})
+            print(rows[-1])
+
+    # objective and time of highs against gurobi on the same case
+    report = pd.DataFrame(rows)
+    gurobi = report[report['method'] == 'gurobi'].set_index(['buses', 'blocks'])
+    case = report.set_index(['buses', 'blocks']).index
+    report['obj_vs_gurobi'] = report['obj_val'] / case.map(gurobi['obj_val']) - 1
+    report['time_vs_gurobi'] = report['solve_time'] / case.map(gurobi['solve_time'])
+    print(report.to_string(index=False))
+    if out:
+        report.to_csv(out, index=False)
+
+
+def compare_symmetry(env, startTime, timeLimit, out=None, backend='gurobi'):
+    # nodes and solve time with and without symmetry breaking on the same models
+    rows = []
+    for numBuses, numBlocks, full in SYMMETRY_CASES:
+        buses, blocks, chargers = make_fleet(numBuses, numBlocks)
+        buses.loc[:full - 1, 'soc'] = '100%'
+        for symmetry in [False, True]:
+            config = load_config()
+            config['symmetryBreaking'] = symmetry
+            result = run_case(env, buses, blocks, chargers, config, startTime, timeLimit, backend=backend)
+            rows.append({'buses': numBuses, 'blocks': numBlocks, 'full': full, 'symmetry': symmetry, **result})
+            print(rows[-1])
+
+    # nodes and time with symmetry breaking against without on the same case
+    report = pd.DataFrame(rows)
+    without = report[~report['symmetry']].set_index(['buses', 'blocks', 'full'])
+    case = report.set_index(['buses', 'blocks', 'full']).index
+    for column in ['nodes', 'solve_time']:
+        if column in report:
+            report[f'{column}_vs_without'] = report[column] / case.map(without[column])
+    print(report.to_string(index=False))
+    if out:
+        report.to_csv(out, index=False)
+
+
+def run_horizon(buses, blocks, chargers, overrides, startTime):
+    # one solve through ChargeOpt.solve, which daily linking needs, returns timings and cost
+    opt = ChargeOpt(buses, blocks.copy(), chargers)
+    opt.startTime = startTime
+    opt.notify = print
+    opt.record = False
+    opt.overrides = {'cache': False, 'exportFormat': 'none', **overrides}
+    start = time.perf_counter()
+    result = opt.solve('Optimal')
+    return {
+        'status': result.status,
+        'build_time': result.buildTime,
+        'seconds': time.perf_counter() - start,
+        'obj_val': result.objVal,
+        'variables': result.telemetry.get('counts', {}).get('variables'),
+    }
+
+
+def compare_horizons(fleet, startTime, timeLimit, out=None, backend='gurobi'):
+    # build and solve time of horizons of 1 to 7 days, joint and daily-linked, on the same fleet
+    buses, blocks, chargers = make_fleet(*fleet)
+    rows = []
+    for days in HORIZONS:
+        # every day from the covered one (tomorrow, today on one day) on, but the last, the buses need
+        # a day without blocks at the end to charge back to where they started
+        coverDays = max(days - 2, 1)
+        for linking in ['joint', 'daily']:
+            overrides = {'horizonDays': days, 'coverDays': coverDays, 'horizonLinking': linking,
+                         'solverBackend': backend, 'timeLimit': timeLimit}
+            result = run_horizon(buses, blocks, chargers, overrides, startTime)
+            rows.append({'days': days, 'linking': linking, **result})
+            print(rows[-1])
+
+    # time of every horizon against one day, and daily against joint
+    report = pd.DataFrame(rows)
+    oneDay = report[report['days'] == 1].set_index('linking')['seconds']
+    report['seconds_vs_one_day'] = report['seconds'] / report['linking'].map(oneDay)
+    joint = report[report['linking'] == 'joint'].set_index('days')
+    report['obj_vs_joint'] = report['obj_val'] / report['days'].map(joint['obj_val']) - 1
+    print(report.to_string(index=False))
+    if out:
+        report.to_csv(out, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ChargeOpt formulations")
+    parser.add_argument('--time-limit', type=float, default=300)
+    parser.add_argument('--start', default='08:00 PM', help="plan start time, e.g. '08:00 PM'")
+    parser.add_argument('--workers', type=int, default=4, help="processes for the decomposed solve")
+    parser.add_argument('--out', default=None, help="optional csv for the results")
+    parser.add_argument('--backends', action='store_true', help="compare gurobi and highs instead of the formulations")
+    parser.add_argument('--symmetry', action='store_true', help="compare with and without symmetry breaking instead")
+    parser.add_argument('--horizons', action='store_true', help="compare horizon lengths and day linking instead")
+    parser.add_argument('--fleet', default='5,5', help="buses,blocks for --horizons")
+    parser.add_argument('--backend', choices=['gurobi', 'highs'], default='gurobi', help="solver for --symmetry and --horizons")
+    args = parser.parse_args()
+
+    # the license the app solves with (WLS secrets or GUROBI_* variables, see session.py)
+    env = gp.Env(params=gurobi_params())
+    startTime = datetime.strptime(args.start, '%I:%M %p')
+
+    if args.backends:
+        compare_backends(env, startTime, args.time_limit, args.out)
+        return
+    if args.symmetry:
+        compare_symmetry(env, startTime, args.time_limit, args.out, args.backend)
+        return
+    if args.horizons:
+        fleet = tuple(int(n) for n in args.fleet.split(','))
+        compare_horizons(fleet, startTime, args.time_limit, args.out, args.backend)
+        return
+
+    rows = []
+    for numBuses, numBlocks in CASES:
+        buses, blocks, chargers = make_fleet(numBuses, numBlocks)
+        for formulation in ['full', 'lean']:
+            config = load_config()
+            config['formulation'] = formulation
+            result = run_case(env, buses, blocks, chargers, config, startTime, args.time_limit)
+            rows.append({'buses': numBuses, 'blocks': numBlocks, 'method': formulation, **result})
+            print(rows[-1])
+
+        result = run_decomposed(buses, blocks, chargers, load_config(), startTime, args.workers)
+        rows.append({'buses': numBuses, 'blocks': numBlocks, 'method': 'decomposed', **result})
+        print(rows[-1])
+
+    # gap of every method against the best monolithic objective of its case
+    report = pd.DataFrame(rows)
+    monolithic = report[report['method'] != 'decomposed'].groupby(['buses', 'blocks'])['obj_val'].min()
+    best = report.set_index(['buses', 'blocks']).index.map(monolithic)
+    report['gap_vs_monolithic'] = (report['obj_val'] - best) / best
+    print(report.to_string(index=False))
+    if args.out:
+        report.to_csv(args.out, index=False)
+
+
+if __name__ == "__main__":
+    main()
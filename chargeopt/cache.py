@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # no file locks on windows, the thread lock still covers the solve threads of one process
+    fcntl = None
+
+# Solution cache for ChargeOpt, kept on local disk.
+# A solve is keyed by a hash of everything that decides its answer: the prepared buses, blocks
+# and chargers, the start quarter-hour, config.yml and the tariff. Every entry also keeps a second
+# hash without the state of charge, so a run that differs only by a small SOC change can start
+# from the cached plan instead of from scratch.
+# Entries are .npz files with the plan arrays, index.json keeps their size and last use,
+# the least recently used ones go first once the cache is over its size limit.
+# Solve threads (solveSlots) and other processes share the cache, so every change to the index is a
+# read-modify-write under a lock (a thread lock, and a lock file for other processes), and eviction
+# also removes .npz files the index doesn't know about.
+
+ARRAYS = ['assignment', 'powerCB', 'chargerUse', 'eB']
+
+_lock = threading.Lock()
+
+
+class SolutionCache:
+    def __init__(self, path, maxBytes, socTolerance):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.socTolerance = socTolerance
+        os.makedirs(path, exist_ok=True)
+        self.indexFile = os.path.join(path, 'index.json')
+
+    def get(self, key):
+        # cached entry for key or None
+        if key not in self._index():
+            return None
+        entry = self._load(key)
+        if entry is not None:
+            with self._locked():
+                index = self._index()
+                if key in index:
+                    index[key]['used'] = time.time()
+                    self._save_index(index)
+        return entry
+
+    def near(self, shape, soc):
+        # the cached entry with the same inputs and the closest SOC within socTolerance, or None
+        best = None
+        for key, info in self._index().items():
+            if info['shape'] != shape or len(info['soc']) != len(soc):
+                continue
+            delta = np.abs(np.array(info['soc']) - soc).max()
+            if delta <= self.socTolerance and (best is None or delta < best[1]):
+                best = (key, delta)
+        return None if best is None else self._load(best[0])
+
+    def put(self, key, shape, soc, result):
+        # stores the plan arrays of a solved run's ChargeResult, then evicts down to maxBytes
+        # the file is written under the lock too, so the sweep below never sees one without its entry
+        with self._locked():
+            file = os.path.join(self.path, f'{key}.npz')
+            np.savez_compressed(file, objVal=result.objVal, status=result.status,
+                                **{name: getattr(result, name) for name in ARRAYS})
+
+            index = self._index()
+            index[key] = {'shape': shape, 'soc': np.round(soc, 6).tolist(), 'size': os.path.getsize(file),
+                          'used': time.time()}
+            total = sum(info['size'] for info in index.values())
+            for old in sorted(index, key=lambda k: index[k]['used']):
+                if total <= self.maxBytes or old == key:
+                    break
+                total -= index.pop(old)['size']
+                self._remove(old)
+            # entries lost from the index (e.g. by a crash) would otherwise never be evicted
+            for name in os.listdir(self.path):
+                if name.endswith('.npz') and name[:-4] not in index:
+                    self._remove(name[:-4])
+            self._save_index(index)
+
+    @contextmanager
+    def _locked(self):
+        with _lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.path, 'index.lock'), 'w') as lockFile:
+                fcntl.flock(lockFile, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+    def _remove(self, key):
+        try:
+            os.remove(os.path.join(self.path, f'{key}.npz'))
+        except FileNotFoundError:
+            pass
+
+    def _load(self, key):
+        try:
+            with np.load(os.path.join(self.path, f'{key}.npz')) as data:
+                entry = {name: data[name] for name in ARRAYS}
+                entry['objVal'] = float(data['objVal'])
+                entry['status'] = str(data['status'])
+        except FileNotFoundError:
+            return None
+        return entry
+
+    def _index(self):
+        try:
+            with open(self.indexFile) as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_index(self, index):
+        # write then rename so a crash can't leave half an index behind
+        tmp = f'{self.indexFile}.tmp'
+        with open(tmp, 'w') as file:
+            json.dump(index, file)
+        os.replace(tmp, self.indexFile)
+
+
+def input_keys(opt, config, runType):
+    # (key, key without the state of charge) for a ChargeOpt after _prepare
+    # the key is also the run's input hash in the run store (see runs.py)
+    inputs = {
+        'runType': runType,
+        'config': config,
+        'vehicles': opt.buses.iloc[:, 0].astype(str).tolist(),
+        'blocks': opt.routes.iloc[:, 0].astype(str).tolist(),
+        'tDep': opt.tDep.tolist(),
+        'tRet': opt.tRet.tolist(),
+        'eRoute': np.round(opt.eRouteLeft, 6).tolist(),
+        'numChargers': opt.numChargers,
+        'startTimeNum': opt.startTimeNum,
+        'D': opt.D,
+        'tariff': np.round(opt.gridPowPrice, 6).tolist(),
+        # dispatch's assignment in Assigned runs
+        'fixed': None if opt.fixed is None else np.argwhere(opt.fixed).tolist(),
+    }
+    if opt.endSoc is not None:
+        # the windows of a daily-linked run (see horizon.py)
+        inputs['socEnd'] = np.round(opt.socEnd, 6).tolist()
+    shape = _digest(inputs)
+    inputs['soc'] = np.round(opt.soc, 6).tolist()
+    return _digest(inputs), shape
+
+
+def entry_values(entry):
+    # {VarName: value} of a cached plan
+    values = {}
+    for name in ['powerCB', 'chargerUse', 'eB']:
+        for (b, t), value in np.ndenumerate(entry[name]):
+            values[f'{name}[{b},{t}]'] = value
+    for (b, d, r), value in np.ndenumerate(entry['assignment']):
+        values[f'assignment[{b},{d},{r}]'] = value
+    return values
+
+
+def entry_start(entry):
+    # MIP start from a cached plan, the binaries only so gurobi works out the energy for the new SOC
+    values = entry_values(entry)
+    return {name: value for name, value in values.items() if name.startswith(('chargerUse', 'assignment'))}
+
+
+def _digest(inputs):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
@@ -0,0 +1,76 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import maximum_bipartite_matching
+
+# Block chaining: a bus may run several blocks, one after another, when the next one pulls out
+# after the last one pulled in (blockChaining in config.yml).
+# In the matrix model every bus is one unit of flow through a time-space network of the horizon:
+#   - nodes are the pull-out and pull-in times of the blocks (every day of the horizon), plus its start and end
+#   - a block arc runs from the pull-out node of a block to the node after its pull-in, its flow is assignment[b, d, r]
+#   - wait arcs (continuous) join consecutive nodes, the bus is at the depot and may charge
+# Flow conservation replaces "at most one block a day", so a bus runs any set of blocks that don't
+# overlap, across days too; whether it has the energy for them is up to the battery constraints.
+# chargerUse <= the wait arc of its slot replaces the pairwise chargerUse + assignment <= 1 rows.
+# The network has O(R * D) arcs per bus rather than an arc for every pair of blocks, and its
+# constraint matrix is a network matrix, so the LP relaxation of each bus's routing is integral.
+# Screening uses the block-to-block view instead: blocks of the covered day are nodes, an arc joins
+# two blocks one bus can run back to back (time, and the energy it can charge in between), and the
+# fewest buses that cover every block is a min-cost flow, solved as a bipartite matching.
+
+
+def block_arcs(opt, day=None):
+    # (i, j) pairs of covered-day blocks one bus can run back to back: j pulls out after i pulled in,
+    # and a full battery less both blocks, plus what it can charge in between, stays above eB_min
+    day = opt.coverDay if day is None else day
+    tDep, tRet = opt.tDep[:, day], opt.tRet[:, day]
+    eRoute = opt.eRouteLeft[:, day]
+    # energy charged in a slot lands in the next one, so j can use the slots between the two blocks
+    gap = tDep[None, :] - tRet[:, None] - 1
+    charge = opt.pCB_ub * opt.dt * np.maximum(gap, 0)
+    fits = eRoute[:, None] + eRoute[None, :] - charge <= opt.eB_max - opt.eB_min
+    i, j = np.nonzero((gap >= 0) & fits & (tDep <= tRet)[:, None])
+    return i, j
+
+
+def min_fleet(opt, day=None):
+    # fewest buses that run every block of the day when blocks are chained, and the chains
+    # (lists of block indices in running order)
+    R = opt.R
+    i, j = block_arcs(opt, day)
+    # min path cover of the block graph: every matched arc saves a bus
+    graph = sp.csr_matrix((np.ones(len(i)), (i, j)), shape=(R, R))
+    nxt = maximum_bipartite_matching(graph, perm_type='column')
+    following = set(nxt[nxt >= 0])
+    chains = []
+    for first in range(R):
+        if first in following:
+            continue
+        chain = [first]
+        while nxt[chain[-1]] >= 0:
+            chain.append(int(nxt[chain[-1]]))
+        chains.append(chain)
+    return len(chains), chains
+
+
+def flow_network(tDep, tRet, T):
+    # the time-space network shared by every bus
+    # returns the (N, D*R) incidence of the block arcs, the (N, N-1) incidence of the wait arcs
+    # and the supply of every node (+1 at the start of the horizon, -1 at its end),
+    # and for every slot the wait arc that spans it
+    # column d*R + r belongs to assignment[b, d, r], like route_event_matrix
+    R, D = tDep.shape
+    pullOut = np.clip(tDep.T.ravel(), 0, T)
+    # blocks pulling in after midnight (screening warns about them) only occupy the slot they leave in
+    pullIn = np.clip(np.maximum(tRet, tDep).T.ravel() + 1, 0, T)
+    times = np.unique(np.concatenate([[0, T], pullOut, pullIn]))
+    N = len(times)
+
+    arcs = np.arange(D * R)
+    blocks = sp.csr_matrix((np.concatenate([np.ones(D * R), -np.ones(D * R)]),
+                            (np.concatenate([np.searchsorted(times, pullOut), np.searchsorted(times, pullIn)]),
+                             np.concatenate([arcs, arcs]))), shape=(N, D * R))
+    wait = sp.diags([np.ones(N - 1), -np.ones(N - 1)], [0, -1], shape=(N, N - 1), format='csr')
+    supply = np.zeros(N)
+    supply[0], supply[-1] = 1, -1
+    waitOf = np.searchsorted(times, np.arange(T), side='right') - 1
+    return blocks, wait, supply, waitOf
@@ -0,0 +1,177 @@
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from scipy.optimize import linear_sum_assignment
+
+from chargeopt.heuristic import cheapest_session, plan_from_sessions
+
+# Two-stage decomposition of the ChargeOpt model for large fleets.
+#   1. pricing: every bus prices every block of the covered day on its own, i.e. the cost of its cheapest
+#      charging session if it ran that block (one process per chunk of buses)
+#   2. master: an assignment problem picks the bus for each block at the lowest total price
+#   3. coordination: sessions that together break numChargers or gridMaxPower are moved,
+#      one bus at a time, to the cheapest spot left by the others
+# With one charging session per bus, the per-bus subproblem is solved exactly by
+# cheapest_session, so all the solver time goes into the (B x R) assignment.
+# Assigned runs (assigned_plan) skip the master, dispatch has already picked the bus for each block.
+
+# price used for pairs that can't work, keeps the assignment matrix finite
+INFEASIBLE = 1e9
+
+
+def decomposed_plan(opt, workers=1):
+    # opt is a ChargeOpt after _prepare
+    # returns the same plan dict as heuristic.greedy_plan, or None if no plan was found
+    B = opt.B
+    eB_init = opt.eB_max * opt.soc
+    if opt.startTimeNum > 0 and (eB_init < opt.eB_min).any():
+        return None
+    day = opt.coverDay
+    if (opt.tDep[:, day] > opt.tRet[:, day]).any() or opt.R > B:
+        return None
+
+    inputs = _session_inputs(opt)
+
+    #####################################
+    # Pricing
+    #####################################
+    chunks = np.array_split(np.arange(B), max(min(workers, B), 1))
+    tasks = [(inputs, eB_init[chunk]) for chunk in chunks]
+    if workers > 1:
+        # fresh processes, forking a server process with solve threads and a live gurobi Env can deadlock
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            priced = list(pool.map(_price_buses, tasks))
+    else:
+        priced = [_price_buses(task) for task in tasks]
+    prices = np.vstack([p for p, _ in priced])
+    options = [s for _, chunkSessions in priced for s in chunkSessions]
+
+    #####################################
+    # Master
+    #####################################
+    # rows are buses, columns blocks; every block gets a bus, buses left over run nothing
+    buses, blocks = linear_sum_assignment(prices)
+    if (prices[buses, blocks] >= INFEASIBLE).any():
+        return None
+    routeOf = np.full(B, -1)
+    routeOf[buses] = blocks
+    sessions = {b: options[b][r] for b, r in zip(buses, blocks)}
+
+    #####################################
+    # Coordination
+    #####################################
+    sessions = _repair(inputs, eB_init, routeOf, sessions)
+    if sessions is None:
+        return None
+    return plan_from_sessions(opt, routeOf, sessions)
+
+
+def assigned_plan(opt):
+    # the plan for the assignment of an Assigned run (opt.fixed, see ChargeOpt.assigned): only the
+    # pricing of each bus's own block and the coordination are left
+    eB_init = opt.eB_max * opt.soc
+    if opt.startTimeNum > 0 and (eB_init < opt.eB_min).any():
+        return None
+    day = opt.coverDay
+    fixed = opt.fixed[:, day, :]
+    routeOf = np.where(fixed.any(axis=1), fixed.argmax(axis=1), -1)
+
+    inputs = _session_inputs(opt)
+    chargersUsed = np.zeros(inputs.T, dtype=int)
+    gridUsed = np.zeros(inputs.T)
+    sessions = {}
+    for b in np.flatnonzero(routeOf >= 0):
+        r = routeOf[b]
+        sessions[b] = cheapest_session(inputs, eB_init[b], inputs.eRoute[r], inputs.tDep[r], inputs.tRet[r],
+                                       chargersUsed, gridUsed)
+        if sessions[b] is None:
+            return None
+
+    sessions = _repair(inputs, eB_init, routeOf, sessions)
+    if sessions is None:
+        return None
+    return plan_from_sessions(opt, routeOf, sessions)
+
+
+def _session_inputs(opt):
+    # the part of ChargeOpt that cheapest_session reads, light enough to send to workers
+    return SimpleNamespace(
+        T=opt.T, dt=opt.dt, startTimeNum=opt.startTimeNum,
+        eB_max=opt.eB_max, eB_min=opt.eB_min, pCB_ub=opt.pCB_ub,
+        numChargers=opt.numChargers, gridKWH=opt.gridKWH,
+        gridPowPrice=np.asarray(opt.gridPowPrice),
+        tDep=opt.tDep[:, opt.coverDay], tRet=opt.tRet[:, opt.coverDay], eRoute=np.asarray(opt.eRoute),
+    )
+
+
+def _price_buses(task):
+    # prices every block for a chunk of buses with the chargers and grid all to themselves
+    inputs, e0 = task
+    chargersUsed = np.zeros(inputs.T, dtype=int)
+    gridUsed = np.zeros(inputs.T)
+    R = len(inputs.eRoute)
+
+    prices = np.full((len(e0), R), INFEASIBLE)
+    sessions = []
+    for i in range(len(e0)):
+        busSessions = []
+        for r in range(R):
+            session = cheapest_session(inputs, e0[i], inputs.eRoute[r], inputs.tDep[r], inputs.tRet[r],
+                                       chargersUsed, gridUsed)
+            if session is not None:
+                prices[i, r] = session[2]
+            busSessions.append(session)
+        sessions.append(busSessions)
+    return prices, sessions
+
+
+def _usage(inputs, sessions, skip=None):
+    # chargers in use and grid power per slot over all sessions but `skip`
+    chargersUsed = np.zeros(inputs.T, dtype=int)
+    gridUsed = np.zeros(inputs.T)
+    for b, (start, energy, _) in sessions.items():
+        if b != skip:
+            chargersUsed[start:start + len(energy)] += 1
+            gridUsed[start:start + len(energy)] += energy / inputs.dt
+    return chargersUsed, gridUsed
+
+
+def _repair(inputs, eB_init, routeOf, sessions):
+    # moves sessions until the shared limits hold, cheapest move at the first overloaded slot first
+    # every move fits under the limits left by the others, so the overload only goes down
+    sessions = dict(sessions)
+    for _ in range(len(sessions) * inputs.T + 1):
+        chargersUsed, gridUsed = _usage(inputs, sessions)
+        over = np.flatnonzero((chargersUsed > inputs.numChargers) | (gridUsed > inputs.gridKWH + 1e-9))
+        if len(over) == 0:
+            return sessions
+
+        t = over[0]
+        best = None
+        for b, (start, energy, cost) in sessions.items():
+            if not start <= t < start + len(energy):
+                continue
+            r = routeOf[b]
+            others = _usage(inputs, sessions, skip=b)
+            moved = cheapest_session(inputs, eB_init[b], inputs.eRoute[r], inputs.tDep[r], inputs.tRet[r], *others)
+            if moved is not None and (best is None or moved[2] - cost < best[1][2] - best[2]):
+                best = (b, moved, cost)
+        if best is None:
+            # no single move fits next to the others, place the sessions again one by one
+            return _place(inputs, eB_init, routeOf, sessions)
+        sessions[best[0]] = best[1]
+    return None
+
+
+def _place(inputs, eB_init, routeOf, sessions):
+    # re-places every session against the ones placed before it, longest sessions first
+    placed = {}
+    for b in sorted(sessions, key=lambda b: -len(sessions[b][1])):
+        r = routeOf[b]
+        session = cheapest_session(inputs, eB_init[b], inputs.eRoute[r], inputs.tDep[r], inputs.tRet[r],
+                                   *_usage(inputs, placed))
+        if session is None:
+            return None
+        placed[b] = session
+    return placed
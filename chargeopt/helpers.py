@@ -1,11 +1,33 @@
 #!/usr/bin/env python3
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
 from datetime import datetime
 import math
+import os
+import yaml
 
 
 
+# the chargeopt package, where config.yml and the tuned parameters are
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_config():
+    # chargeopt/config.yml, or the file CHARGEOPT_CONFIG points to
+    config_path = os.environ.get('CHARGEOPT_CONFIG', os.path.join(PACKAGE_DIR, "config.yml"))
+    with open(config_path, "r") as file:
+        config = yaml.safe_load(file)
+    return config
+
+
+def data_dir(*parts):
+    # where ChargeOpt keeps its cache, corpus and outputs: CHARGEOPT_DATA, or chargeopt in the user's
+    # data directory (XDG_DATA_HOME, ~/.local/share by default) so nothing is written into the package
+    default = os.path.join(os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share'), 'chargeopt')
+    return os.path.join(os.environ.get('CHARGEOPT_DATA', default), *parts)
+
+
 def time_to_quarter(datetime_str):
     dt = datetime.strptime(datetime_str, '%I:%M %p')
     total_minutes = dt.hour * 60 + dt.minute
@@ -46,14 +68,10 @@ def init_grid_pricing(numDays):
 
 def init_routes(routeDF, eB_range, pCB_max):
 
-    # Determine the number of busses
-    numRoutes = len(routeDF)
-
     kwhPerMile = 2.5
     
     routeDF['block_startTime'] = routeDF['block_startTime'].apply(time_to_quarter)
     routeDF['block_endTime'] = routeDF['block_endTime'].apply(time_to_quarter)
-    print(routeDF[['block_startTime', 'block_endTime']])
     # make column int type
     routeDF['block_startTime'] = routeDF['block_startTime'].astype(int)
     routeDF['block_endTime'] = routeDF['block_endTime'].astype(int)
@@ -65,26 +83,68 @@ def init_routes(routeDF, eB_range, pCB_max):
     eRoute = routeDF['Mileage'].to_numpy() * kwhPerMile
 
     # Check for route energy out of bounds, route returning too late
-    routeOutOfRange = False
-    routeLateReturn = False
-    for i in range(numRoutes):
-        if eRoute[i] >= eB_range:
-            routeOutOfRange = True
-        timeToCharge = (1 / .94) * 60 * eRoute[i] / pCB_max
-        indicesToCharge = int(timeToCharge / 15 + 0.5)
-        if indicesToCharge >= (arrival[i] + 96 - departure[i]):
-            routeLateReturn = True
+    # (chargeopt/screening.py checks these and more before a model is built)
+    routeOutOfRange = (eRoute >= eB_range).any()
+    indicesToCharge = ((1 / .94) * 60 * eRoute / pCB_max / 15 + 0.5).astype(int)
+    routeLateReturn = (indicesToCharge >= arrival + 96 - departure).any()
 
     # Return report on infeasible route
     report = 'All Clear'
     if routeLateReturn and routeOutOfRange:
         report = 'Multiple Route Issues'
-        print('Multiple Route Issues')
     elif routeLateReturn:
         report = 'Route Returns Too Late'
-        print('Route Returns Too Late')
     elif routeOutOfRange:
         report = 'Route Out Of Range'
-        print('Route Out Of Range')
 
     return departure, arrival, eRoute, report
+
+
+def route_event_matrix(tEvent, eRoute, T):
+    # (T, D*R) matrix with the route energy at the slot a route departs/returns
+    # column d*R + r belongs to assignment[b, d, r]; events outside their own day are dropped
+    # eRoute is per route (R,) or per route and day (R, D)
+    R, D = tEvent.shape
+    dayStart = np.arange(D) * 96
+    inDay = (tEvent >= dayStart) & (tEvent < dayStart + 96)
+    r_idx, d_idx = np.nonzero(inDay)
+    rows = tEvent[r_idx, d_idx]
+    cols = d_idx * R + r_idx
+    vals = np.broadcast_to(np.asarray(eRoute, dtype=float).reshape(R, -1), (R, D))[r_idx, d_idx]
+    return sp.csr_matrix((vals, (rows, cols)), shape=(T, D * R))
+
+
+def route_coverage_matrices(tDep, tRet, T):
+    # one row per (day, route, on-route slot)
+    # returns the (K, T) slot incidence and the (K, D*R) assignment incidence
+    R, D = tDep.shape
+    slots = []
+    cols = []
+    for d in range(D):
+        for r in range(R):
+            t = np.arange(max(tDep[r, d], 0), min(tRet[r, d], T - 1) + 1)
+            slots.append(t)
+            cols.append(np.full(len(t), d * R + r))
+    slots = np.concatenate(slots).astype(int)
+    cols = np.concatenate(cols).astype(int)
+    K = len(slots)
+    ones = np.ones(K)
+    coverT = sp.csr_matrix((ones, (np.arange(K), slots)), shape=(K, T))
+    coverA = sp.csr_matrix((ones, (np.arange(K), cols)), shape=(K, D * R))
+    return coverT, coverA
+
+
+def depot_slots(tDep, tRet, T, numBuses, startTimeNum, coverDay=1):
+    # slots where a bus may still be at the depot: from startTimeNum on,
+    # except when the blocks that must be covered (coverDay) keep every bus out at once
+    R, D = tDep.shape
+    coverT, coverA = route_coverage_matrices(tDep, tRet, T)
+    required = (coverA.indices // R) == coverDay
+    busy = np.bincount(coverT.indices[required], minlength=T)
+    usable = (np.arange(T) >= startTimeNum) & (busy < numBuses)
+    return np.flatnonzero(usable)
+
+
+def slot_names(varName, numBuses, slots):
+    # gurobi names for a (bus, slot) variable that only exists at the given slots
+    return np.array([[f'{varName}[{b},{t}]' for t in slots] for b in range(numBuses)])
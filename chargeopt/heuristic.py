@@ -0,0 +1,165 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Greedy bus-block assignment and charging schedule for ChargeOpt.
+# Follows the rules of the optimization model so the plan can be used as a MIP start:
+#   - every block of the covered day (opt.coverDay) gets exactly one bus, a bus runs at most one block a day
+#   - one contiguous charging session per bus, at full power until the battery can be
+#     topped off within a single step, and at least 4 slots on every day it charges
+#   - no more buses charging than chargers, total power under gridMaxPower
+#   - every bus ends the horizon with at least the energy it started with
+# A block no bus can take within these rules is left without one (plan['unassigned']), the solver
+# fills it in from the rest of the plan.
+# Only numpy is needed, so it also works when the solver is unavailable.
+
+
+def greedy_plan(opt):
+    # opt is a ChargeOpt after _prepare
+    # returns a dict of (bus, ...) arrays and the plan cost, or None if no plan was found
+    # plan['unassigned'] are the blocks it found no bus for
+    B, T = opt.B, opt.T
+    dt = opt.dt
+    startTimeNum = opt.startTimeNum
+    eB_init = opt.eB_max * opt.soc
+    if startTimeNum > 0 and (eB_init < opt.eB_min).any():
+        return None
+
+    chargersUsed = np.zeros(T, dtype=int)
+    gridUsed = np.zeros(T)
+    routeOf = np.full(B, -1)
+    sessions = {}
+
+    # the blocks with the most energy have the fewest buses that can take them, go first
+    for r in np.argsort(-opt.eRoute, kind='stable'):
+        dep, ret = opt.tDep[r, opt.coverDay], opt.tRet[r, opt.coverDay]
+        if dep > ret:
+            continue
+
+        best = None
+        for b in np.flatnonzero(routeOf < 0):
+            session = cheapest_session(opt, eB_init[b], opt.eRoute[r], dep, ret, chargersUsed, gridUsed)
+            if session is not None and (best is None or session[2] < best[1][2]):
+                best = (b, session)
+        if best is None:
+            continue
+
+        b, session = best
+        routeOf[b] = r
+        sessions[b] = session
+        start, energy, _ = session
+        chargersUsed[start:start + len(energy)] += 1
+        gridUsed[start:start + len(energy)] += energy / dt
+
+    return plan_from_sessions(opt, routeOf, sessions)
+
+
+def plan_from_sessions(opt, routeOf, sessions):
+    # routeOf[b] is the covered-day block of bus b (-1 for none), sessions[b] = (start, energy per slot, cost)
+    # returns the plan arrays every solve mode shares, and the covered-day blocks no bus runs
+    B, D, R, T = opt.B, opt.D, opt.R, opt.T
+    dt = opt.dt
+    eB_init = opt.eB_max * opt.soc
+
+    assignment = np.zeros((B, D, R))
+    chargerUse = np.zeros((B, T))
+    powerCB = np.zeros((B, T))
+    depletion = np.zeros((B, T))
+    for b in np.flatnonzero(routeOf >= 0):
+        assignment[b, opt.coverDay, routeOf[b]] = 1
+        depletion[b, opt.tRet[routeOf[b], opt.coverDay]] += opt.eRoute[routeOf[b]]
+    for b, (start, energy, _) in sessions.items():
+        slots = np.arange(start, start + len(energy))
+        chargerUse[b, slots] = 1
+        powerCB[b, slots] = energy / dt
+
+    # energy lands one slot after it is charged
+    charged = np.zeros((B, T))
+    charged[:, 1:] = powerCB[:, :-1] * dt
+    eB = eB_init[:, None] + np.cumsum(charged - depletion, axis=1)
+    eB[:, :opt.startTimeNum] = eB_init[:, None]
+
+    return {
+        'assignment': assignment,
+        'chargerUse': chargerUse,
+        'powerCB': powerCB,
+        'eB': eB,
+        'cost': dt * (powerCB.sum(axis=0) @ opt.gridPowPrice),
+        'unassigned': np.setdiff1d(np.arange(R), routeOf),
+    }
+
+
+def cheapest_session(opt, e0, need, dep, ret, chargersUsed, gridUsed):
+    # cheapest charging session that lets a bus starting at e0 run a block of `need` kWh
+    # leaving at dep and returning at ret, and still end the horizon at e0 or above
+    # returns (start slot, energy per slot, cost) or None
+    if need <= 0:
+        return 0, np.zeros(0), 0.0
+
+    step = opt.pCB_ub * opt.dt
+    T = opt.T
+    # the session can't span the block, so it's either all before or all after it
+    # (energy at session start, first slot, slot the energy has to have landed by)
+    options = []
+    if e0 >= opt.eB_min + need:
+        options.append((e0 - need, ret + 1, T - 1))
+    if opt.eB_max - e0 >= need:
+        options.append((e0, opt.startTimeNum, dep))
+
+    length = max(int(np.ceil(need / step)), 4)
+    # full steps until the last one tops the battery off, nothing once it is full
+    best = None
+    for eStart, first, last in options:
+        room = opt.eB_max - eStart
+        energy = np.clip(room - step * np.arange(length), 0, step)
+        starts = np.arange(first, last - length + 1)
+        if len(starts) == 0:
+            continue
+
+        # every day the session touches needs at least 4 charging slots
+        tail = (starts + length) % 96
+        crosses = (starts // 96) != ((starts + length - 1) // 96)
+        valid = ~crosses | ((tail >= 4) & (length - tail >= 4))
+
+        window = np.arange(length)
+        chargers = sliding_window_view(chargersUsed, length)[starts]
+        grid = sliding_window_view(gridUsed, length)[starts] + energy / opt.dt
+        valid &= (chargers < opt.numChargers).all(axis=1) & (grid <= opt.gridKWH + 1e-9).all(axis=1)
+        if not valid.any():
+            continue
+
+        cost = opt.gridPowPrice[starts[:, None] + window] @ energy
+        cost = np.where(valid, cost, np.inf)
+        i = np.argmin(cost)
+        if best is None or cost[i] < best[2]:
+            best = (starts[i], energy, cost[i])
+    return best
+
+
+def plan_values(opt, plan):
+    # {VarName: value} for every model variable the plan determines, used for MIP starts and export
+    B, D, R, T = opt.B, opt.D, opt.R, opt.T
+    chargerUse = plan['chargerUse']
+    powerCB = plan['powerCB']
+    eB = plan['eB']
+
+    # tracker marks the slots where the battery is within one full-power step of full
+    tracker = (opt.eB_max - eB <= opt.pCB_ub * opt.dt + 1e-9).astype(float)
+    up = np.zeros((B, T))
+    down = np.zeros((B, T))
+    up[:, 1:] = np.maximum(chargerUse[:, 1:] - chargerUse[:, :-1], 0)
+    down[:, 1:] = np.maximum(chargerUse[:, :-1] - chargerUse[:, 1:], 0)
+    charging = (chargerUse.reshape(B, D, 96).sum(axis=2) > 0).astype(float)
+
+    values = {}
+    for name, arr in [('powerCB', powerCB), ('gridPowToB', powerCB), ('eB', eB), ('chargerUse', chargerUse),
+                      ('tracker', tracker), ('tracker_b', 1 - tracker),
+                      ('T1', up), ('T2', down), ('change', up + down)]:
+        for b in range(B):
+            for t in range(T):
+                values[f'{name}[{b},{t}]'] = arr[b, t]
+    for b in range(B):
+        for d in range(D):
+            values[f'charging[{b},{d}]'] = charging[b, d]
+            for r in range(R):
+                values[f'assignment[{b},{d},{r}]'] = plan['assignment'][b, d, r]
+    return values
@@ -0,0 +1,98 @@
+import time
+from datetime import datetime, timedelta
+import numpy as np
+
+# Long horizons solved one day at a time (horizonLinking: daily in config.yml).
+# The joint model has a copy of every constraint family per day and gets harder to solve faster than
+# it grows. Every day plans the same blocks, so daily linking rolls a short window over the horizon:
+#   - the first window is the joint model's first days: today, the covered day and the day after
+#   - every later covered day is a window of its own from midnight, with the day after it as look-ahead
+#   - a window only keeps the days up to its covered day (the last one keeps its look-ahead too),
+#     the next window starts from the state of charge they ended with
+#   - days after the covered ones (coverDays) have no blocks to cover and are left idle
+# Every window ends at least at the SOC the horizon started with, like the joint model's horizon does.
+# The windows from midnight all have the same model structure, so the solver session builds that
+# model once and only puts each day's SOC and tariff into it (see session.py), and a day that starts
+# from the SOC of an earlier one comes straight from the solution cache (see cache.py).
+
+
+def day_run(opt, first, days, coverDay, soc, overrides):
+    # a ChargeOpt for days [first, first + days) of opt's horizon, buses starting at soc,
+    # covering the blocks of its day coverDay
+    from chargeopt.optimization import ChargeOpt
+
+    buses, routes, chargers = opt.inputs
+    buses = buses.copy()
+    buses.iloc[:, 1] = [f'{100 * s:.6f}%' for s in soc]
+    run = ChargeOpt(buses, routes.copy(), chargers)
+    if first == 0:
+        run.startTime = opt.startTime
+    else:
+        run.startTime = datetime.combine(opt.startTime.date() + timedelta(days=first), datetime.min.time())
+    run.notify = opt.notify
+    run.record = False
+    # every window ends with what the horizon started with, like the joint model, so the days
+    # can't run the fleet down one after the other
+    run.endSoc = opt.socEnd
+    # the prices of these days, already scaled
+    run.tariff = opt.gridPowPrice[first * 96:(first + days) * 96]
+    run.overrides = {**opt.overrides, **overrides, 'horizonDays': days, 'coverDay': coverDay, 'coverDays': 1,
+                     'horizonLinking': 'joint', 'tariffScale': 1.0, 'exportFormat': 'none'}
+    return run
+
+
+def daily_plan(opt, config, runType='Optimal', job=None, began=None):
+    # opt is a ChargeOpt after _prepare, returns (plan arrays, objVal, status, buildTime)
+    # began is the perf_counter the solve started at, timeLimit is the budget of all days together
+    # the arrays are None when a day couldn't be planned, status says which day and why
+    began = time.perf_counter() if began is None else began
+    B, D, R, T = opt.B, opt.D, opt.R, opt.T
+    coverDay = opt.coverDay
+    lastCovered = min(coverDay + config.get('coverDays', 1), D) - 1
+    arrays = {
+        'powerCB': np.zeros((B, T)),
+        'chargerUse': np.zeros((B, T)),
+        'eB': np.zeros((B, T)),
+        'assignment': np.zeros((B, D, R)),
+    }
+    objVal, buildTime = 0.0, 0.0
+    statuses = []
+
+    # (first day, days, covered day in the window, days kept)
+    windows = [(0, min(coverDay + 2, D), coverDay, coverDay + 1)]
+    windows += [(day, min(2, D - day), 0, 1) for day in range(coverDay + 1, lastCovered + 1)]
+    first, days, _, _ = windows[-1]
+    windows[-1] = (first, days, windows[-1][2], days)
+
+    soc = opt.soc
+    for i, (first, days, covered, kept) in enumerate(windows):
+        if job is not None and job.cancelled:
+            return None, None, "Solve cancelled", buildTime
+
+        overrides = {}
+        if config.get('timeLimit'):
+            # an even share of what is left of the budget of the whole solve
+            left = config['timeLimit'] - (time.perf_counter() - began)
+            overrides['timeLimit'] = max(left / (len(windows) - i), 1)
+        result = day_run(opt, first, days, covered, soc, overrides).solve(runType)
+        if not result.solved:
+            return None, None, f"Day {first + covered + 1}: {result.status}", buildTime
+
+        span = slice(first * 96, (first + kept) * 96)
+        for name in ['powerCB', 'chargerUse', 'eB']:
+            arrays[name][:, span] = getattr(result, name)[:, :kept * 96]
+        arrays['assignment'][:, first:first + kept] = result.assignment[:, :kept]
+        # the cost of the days kept, the look-ahead day is planned again by the next window
+        objVal += opt.dt * float(result.powerCB[:, :kept * 96].sum(axis=0) @ opt.gridPowPrice[span])
+        buildTime += result.buildTime or 0.0
+        statuses.append(result.status)
+        # energy at the midnight after the days kept
+        soc = np.clip(result.eB[:, min(kept * 96, days * 96 - 1)] / opt.eB_max, 0, 1)
+
+    # days after the last window, nothing to cover, the buses wait with what they have
+    last = (first + kept) * 96
+    arrays['eB'][:, last:] = opt.eB_max * soc[:, None]
+
+    # the first window that wasn't solved to optimality, e.g. cut short by the time limit
+    status = next((s for s in statuses if s != "Optimal solution found"), "Optimal solution found")
+    return arrays, objVal, status, buildTime
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import deque
+import gurobipy as gp
+from chargeopt.helpers import load_config, time_to_quarter
+from chargeopt.result import ChargeResult
+
+# Background ChargeOpt solves.
+# Jobs go into one queue per server process and run ChargeOpt.solve on a fixed number of worker
+# threads (solveSlots in config.yml), so the Streamlit script thread only keeps the job id
+# (see components/optimization.py) and a busy shift start can't oversubscribe the CPU or the license.
+# A job submitted while an identical one (same inputs, see job_key) is queued or running joins it,
+# every waiter gets the same result. Jobs stay in a process-wide registry, a page refresh can pick
+# its job up again by id. While the MIP runs, the job's gurobi callback records the incumbent and
+# the bound and stops the solve once every waiter has cancelled, and every better plan found on the
+# way is published to the job (latest) so the page can show it before the solve is done, like the
+# solve's status messages (messages).
+
+# finished jobs are dropped from the registry after this many seconds
+KEEP_FINISHED = 3600
+
+_jobs = {}
+_queue = deque()
+_workers = []
+_lock = threading.Lock()
+_ready = threading.Condition(_lock)
+
+
+class SolveJob:
+    def __init__(self, opt, runType, previous=None, key=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.opt = opt
+        self.runType = runType
+        self.previous = previous
+        # the inputs as they were selected, solve converts the block times in place
+        self.inputs = (opt.buses.copy(), opt.routes.copy(), opt.chargers.copy())
+
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.waiters = 1
+        self.incumbent = None
+        self.bound = None
+        # ChargeResult of the best plan found so far, replaced as better ones come in
+        self.latest = None
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        # status messages of the solve (ChargeOpt.notify), st.write from a worker thread shows nothing,
+        # the page shows them with the job's progress instead
+        self.messages = []
+        opt.notify = self.note
+
+    def _run(self):
+        self.started = time.time()
+        try:
+            self.result = self.opt.solve(self.runType, self.previous, job=self)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+        finally:
+            self.finished = time.time()
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    @property
+    def elapsed(self):
+        # time spent solving so far
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def waited(self):
+        # time spent in the queue
+        return (self.started or time.time()) - self.submitted
+
+    @property
+    def position(self):
+        # place in the queue, 1 is next, 0 once a worker has it
+        with _lock:
+            return _queue.index(self) + 1 if self in _queue else 0
+
+    @property
+    def gap(self):
+        if self.incumbent is None or self.bound is None or self.incumbent == 0:
+            return None
+        return abs(self.incumbent - self.bound) / abs(self.incumbent)
+
+    def cancel(self):
+        # drops one waiter, the job only stops when nobody is waiting for it anymore
+        with _lock:
+            self.waiters -= 1
+            if self.waiters > 0:
+                return
+            self.cancelled = True
+            if self in _queue:
+                _queue.remove(self)
+                self.result = ChargeResult("Solve cancelled", self.runType)
+                self.finished = time.time()
+
+    def note(self, message):
+        # called from the solve's thread
+        self.messages.append(str(message))
+
+    def publish(self, result):
+        # called from the solve's thread, readers only ever see a whole ChargeResult
+        if self.latest is None or result.objVal <= self.latest.objVal:
+            self.latest = result
+
+    def callback(self, model, where):
+        # gurobi callback, passed to optimize by ChargeOpt.solve
+        if where == gp.GRB.Callback.MIP:
+            incumbent = model.cbGet(gp.GRB.Callback.MIP_OBJBST)
+            self.incumbent = incumbent if incumbent < gp.GRB.INFINITY else None
+            self.bound = model.cbGet(gp.GRB.Callback.MIP_OBJBND)
+        if self.cancelled:
+            model.terminate()
+
+
+def start_job(opt, runType, previous=None):
+    # queues opt for solving and returns its job, or the identical job already queued or running
+    slots = load_config().get('solveSlots', 1)
+    key = job_key(opt, runType, previous)
+    with _lock:
+        now = time.time()
+        for old in [k for k, j in _jobs.items() if j.done and now - j.finished > KEEP_FINISHED]:
+            del _jobs[old]
+
+        for job in _jobs.values():
+            if job.key == key and not job.done and not job.cancelled:
+                job.waiters += 1
+                return job
+
+        job = SolveJob(opt, runType, previous, key)
+        _jobs[job.id] = job
+        _queue.append(job)
+        # slots only grow, a lower solveSlots takes a restart
+        while len(_workers) < slots:
+            worker = threading.Thread(target=_work, daemon=True)
+            worker.start()
+            _workers.append(worker)
+        _ready.notify()
+    return job
+
+
+def job_key(opt, runType, previous=None):
+    # hash of everything a solve depends on: the selected inputs, start slot, run type (and the
+    # assignment of Assigned runs), config and the plan it re-plans from
+    inputs = {
+        'buses': opt.buses.astype(str).to_dict('split'),
+        'routes': opt.routes.astype(str).to_dict('split'),
+        'chargers': opt.chargers.astype(str).to_dict('split'),
+        'date': opt.startTime.strftime('%Y-%m-%d'),
+        'start': time_to_quarter(opt.startTime.strftime('%I:%M %p')),
+        'runType': runType,
+        'assigned': opt.assigned if runType == 'Assigned' else None,
+        'config': {**load_config(), **opt.overrides},
+        'previous': None if previous is None else
+        {name: hashlib.sha256(value.tobytes()).hexdigest() if hasattr(value, 'tobytes') else str(value)
+         for name, value in previous.items()},
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _work():
+    # worker thread, solves queued jobs one after the other
+    while True:
+        with _ready:
+            while not _queue:
+                _ready.wait()
+            job = _queue.popleft()
+        job._run()
+
+
+def get_job(jobId):
+    # the job with this id, None once it is unknown or dropped
+    with _lock:
+        return _jobs.get(jobId)
@@ -1,23 +1,76 @@
 import gurobipy as gp
 import numpy as np
+import scipy.sparse as sp
 import pandas as pd
 from datetime import datetime
 import yaml
-from chargeopt.helpers import init_grid_pricing, init_routes, time_to_quarter
+from chargeopt.helpers import load_config, data_dir, init_grid_pricing, init_routes, time_to_quarter, route_event_matrix, route_coverage_matrices, depot_slots, slot_names
+from chargeopt.heuristic import greedy_plan, plan_values
+from chargeopt.decomposition import decomposed_plan, assigned_plan
+from chargeopt.rolling import snapshot, carry_over, commit, fix_values
+from chargeopt.cache import SolutionCache, input_keys, entry_start
+from chargeopt.result import ChargeResult
+from chargeopt.screening import screen
+from chargeopt.runs import run_store
+from chargeopt.telemetry import Telemetry
+from chargeopt.session import solver_session
+from chargeopt.backends import highs_session, solve_highs
+from chargeopt.replay import dump_run
+from chargeopt.symmetry import bus_classes, add_symmetry_breaking, order_plan
+from chargeopt.tuning import tuned_params
+from chargeopt.chaining import flow_network
+from chargeopt.timegrid import time_grid, balance_matrices, expand
+from chargeopt.horizon import daily_plan
 import os
+import time
 import warnings
 import streamlit as st
 import sys
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
+
+def set_start(m, values, number=0):
+    # MIP start from {VarName: value}, variables not in values are left for gurobi to fill in
+    # number picks which of the model's MIP starts to set
+    m.update()
+    if number >= m.NumStart:
+        m.NumStart = number + 1
+    m.params.StartNumber = number
+    variables = m.getVars()
+    m.setAttr('Start', variables, [values.get(v.VarName, gp.GRB.UNDEFINED) for v in variables])
+
+
 class ChargeOpt:
     def __init__(self, buses, routes, chargers):
         self.buses = buses
         self.routes = routes
         self.chargers = chargers
         self.startTime = datetime.now()
-
-    def solve(self):
+        # snapshot of the last plan found by solve, pass it back in to re-plan (see rolling.py)
+        self.plan = None
+        # timings and model size of the last solve (see telemetry.py)
+        self.telemetry = Telemetry()
+        # config.yml values this instance solves with instead, e.g. a scenario's (see sweep.py)
+        self.overrides = {}
+        # $/kWh per 15 minutes, repeated over the horizon, instead of the prices of init_grid_pricing
+        self.tariff = None
+        # directory an Optimal solve writes its model and inputs to before solving (see replay.py)
+        self.dump = None
+        # status messages, print when there is no streamlit page to write to (see __main__.py)
+        self.notify = st.write
+        # {vehicle: block_id} dispatch already decided on for the covered day, solved with runType 'Assigned'
+        self.assigned = {}
+        # (B, D, R) assignment of an Assigned run, constants instead of model variables (see _build_matrix)
+        self.fixed = None
+        # whether runs are recorded in the run store, not for the days of a daily-linked run (see horizon.py)
+        self.record = True
+        # SOC (0-1) every bus ends the horizon with at least, the SOC it starts with when None
+        self.endSoc = None
+
+    def solve(self, runType='Optimal', previous=None, job=None):
+        # returns a ChargeResult (see result.py)
+        # job is the chargeopt.jobs.SolveJob running this solve in the background, if any
+        # Assigned runs only plan the charging of the buses in self.assigned, on a much smaller model
 
         #####################################
         # Init self variables
@@ -28,94 +81,747 @@ class ChargeOpt:
         try:
             assert B > 0
         except AssertionError:
-            st.write("No buses selected")
-            return None
+            self.notify("No buses selected")
+            return ChargeResult("No buses selected", runType)
 
         routes = self.routes
         R = len(routes)
         try:
             assert R > 0
         except AssertionError:
-            st.write("No routes selected")
-            return None
+            self.notify("No routes selected")
+            return ChargeResult("No routes selected", runType)
 
 
         #####################################
         # Config 
         #####################################
         # load config file
-        config_path = os.path.join(os.getcwd(), "chargeopt/config.yml")
-        with open(config_path, "r") as file:
-            config = yaml.safe_load(file)
+        began = time.perf_counter()
+        self.telemetry = Telemetry()
+        config = {**load_config(), **self.overrides}
+        self.telemetry.lap('config load')
 
         # make filename based on date
         current_datetime = datetime.now().strftime("%m-%d-%Y_%H-%M-%S")
         filename = f'chargeopt_{current_datetime}'
 
-        eB_max = config["ebMaxKwh"]
-        eB_min = int(eB_max * .2)
-        eB_range = eB_max - eB_min
+        # the inputs as they came in, _prepare turns the block times into slots
+        self.inputs = inputs = (self.buses.copy(), self.routes.copy(), self.chargers.copy())
+
+        self._prepare(config)
+
+        # rolling re-plan: keep what the previous plan already committed to
+        carried = carry_over(self, previous) if previous is not None else None
+        if carried is not None:
+            self.eRouteLeft = carried['eRouteLeft']
+            self.telemetry.lap('carry over')
+        self.fixed = self._fixed_assignment() if runType == 'Assigned' else None
+
+        # requests that can't be served never get to the solver
+        self.diagnosis = screen(self)
+        self.telemetry.lap('screening')
+        if not self.diagnosis.feasible:
+            self.notify(self.diagnosis.status)
+            return ChargeResult(self.diagnosis.status, runType, self.startTimeNum, diagnosis=self.diagnosis.as_list())
+
+        # the input hash keys the cache and is recorded with the run
+        key, shape = input_keys(self, config, runType)
+
+        # identical runs come straight from the cache, runs a small SOC change away get the cached
+        # plan as a MIP start (see cache.py); re-plans also depend on the previous plan and skip it
+        cache = None
+        if config.get('cache', True) and carried is None:
+            cache = SolutionCache(data_dir('cache'),
+                                  config.get('cacheMaxMB', 50) * 2**20, config.get('cacheSocTolerance', 0.05))
+            start = time.perf_counter()
+            hit = cache.get(key)
+            self.telemetry.lap('cache lookup')
+            if hit is not None:
+                return self._result(hit, hit['objVal'], time.perf_counter() - start, filename, runType, hit['status'], config, key)
+
+        # long horizons one day at a time, linked by the SOC each day ends with (see horizon.py)
+        if runType == 'Optimal' and config.get('horizonLinking', 'joint') == 'daily' and carried is None \
+                and self.D > self.coverDay + 1:
+            arrays, objVal, status, buildTime = daily_plan(self, config, runType, job, began)
+            if arrays is None:
+                return ChargeResult(status, runType, self.startTimeNum, telemetry=self.telemetry.as_dict())
+            self.telemetry.lap('days')
+            result = self._result(arrays, objVal, time.perf_counter() - began, filename, runType, status, config, key,
+                                  buildTime=buildTime)
+            if cache is not None and status == "Optimal solution found":
+                cache.put(key, shape, self.soc, result)
+            return result
+
+        eB_max = self.eB_max
+        numChargers = self.numChargers
+        pCB_ub = self.pCB_ub
+        gridKWH = self.gridKWH
+        D = self.D
+        T = self.T
+        startTimeNum = self.startTimeNum
+
+        # the greedy plan is the answer for Heuristic runs and the MIP start otherwise,
+        # Decomposed runs use the assignment/charging decomposition instead of the MIP
+        start = time.perf_counter()
+        if runType == 'Decomposed':
+            plan = decomposed_plan(self, config.get('decompositionWorkers', 1))
+        elif len(self.coverDays) > 1 and runType in ['Optimal', 'Assigned']:
+            # the greedy and assigned plans only cover the first covered day, they're neither a start nor an answer here
+            plan = None
+        elif runType == 'Assigned':
+            plan = assigned_plan(self)
+        else:
+            plan = greedy_plan(self)
+        if runType == 'Optimal' and plan is not None and (plan['eB'][:, -1] < self.eB_max * self.socEnd - 1e-6).any():
+            # short of the SOC a daily-linked window has to end with (see horizon.py)
+            plan = None
+        # a greedy plan that found no bus for some blocks is only a start for the solver
+        partial = plan is not None and len(plan['unassigned']) > 0
+        if partial:
+            blockIds = self.routes.iloc[:, 0].astype(str).to_numpy()
+            self.notify(f"The greedy plan found no bus for block(s) {', '.join(blockIds[plan['unassigned']])}")
+        planTime = time.perf_counter() - start
+        self.telemetry.lap('plan')
+
+        if job is not None and job.cancelled:
+            return ChargeResult("Solve cancelled", runType, startTimeNum)
+
+        if runType in ['Optimal', 'Assigned']:
+            # gurobi, or HiGHS without a gurobi license (solverBackend, see backends.py)
+            # one Env per server process, the license handshake only happens on the first run
+            backend = config.get('solverBackend', 'auto')
+            if backend == 'highs':
+                session = highs_session()
+            else:
+                try:
+                    session = solver_session()
+                except gp.GurobiError as e:
+                    if backend == 'auto':
+                        self.notify(f"Gurobi unavailable ({e}), solving with HiGHS")
+                        session = highs_session()
+                    else:
+                        self.notify(f"Solver unavailable ({e}), using the heuristic plan")
+                        runType = 'Heuristic'
+                        # the fallback plan isn't the answer to an Optimal run
+                        cache = None
+
+        if runType not in ['Optimal', 'Assigned']:
+            if plan is None or partial:
+                return ChargeResult("No plan found", runType, startTimeNum)
+            result = self._result(plan, plan['cost'], planTime, filename, runType, f"{runType} solution found", config, key, carried)
+            if cache is not None:
+                cache.put(key, shape, self.soc, result)
+            return result
+
+        # a run with the same model structure as an earlier one reuses its model with the new data,
+        # re-plans fix variables and Assigned runs have no assignment variables, both get a model of their own
+        start = time.perf_counter()
+        with session.model(self, config, reuse=carried is None and self.fixed is None) as (m, handles):
+            # building the model, or putting this run's data into a reused one
+            buildTime = time.perf_counter() - start
+            self.telemetry.model_counts(m)
+            self.telemetry.mark()
+
+            # cancelled while waiting for another solve
+            if job is not None and job.cancelled:
+                return ChargeResult("Solve cancelled", runType, startTimeNum)
+
+            # buses with the same SOC and status are interchangeable, only one order of them is searched
+            # (the constraints are dropped again after the solve, the next run on this model may have other SOCs)
+            symmetry = []
+            if config.get('symmetryBreaking', True) and carried is None and self.fixed is None:
+                classes = bus_classes(self)
+                symmetry = add_symmetry_breaking(self, m, handles, classes)
+                if plan is not None:
+                    plan = order_plan(self, plan, classes)
+                self.telemetry.lap('symmetry')
+
+            # the symmetry constraints come off the session model again however the solve ends
+            try:
+                # parameters tuned on the recorded corpus (gurobiParams, see tuning.py)
+                if session.backend == 'gurobi':
+                    for name, value in tuned_params(config.get('gurobiParams', 'latest')).items():
+                        m.setParam(name, value)
+
+                # MIP Gap
+                m.setParam('MIPGap', config.get('mipGap', 0.03))
+                # timeLimit is the budget of the whole solve, the solver gets what is left of it
+                # and the run ends with the best plan found by then
+                if config.get('timeLimit'):
+                    m.setParam('TimeLimit', max(config['timeLimit'] - (time.perf_counter() - began), 1))
+
+                # start from the greedy plan so the solver has an incumbent right away,
+                # and from what is left of the previous plan when re-planning
+                starts = []
+                if partial:
+                    # only the buses of the blocks it placed, gurobi fills in the rest
+                    starts.append({name: value for name, value in plan_values(self, plan).items()
+                                   if name.startswith('assignment') and value == 1})
+                elif plan is not None:
+                    starts.append(plan_values(self, plan))
+                if carried is not None:
+                    fix_values(m, carried['fixed'])
+                    starts.append(carried['start'])
+                if cache is not None:
+                    near = cache.near(shape, self.soc)
+                    if near is not None:
+                        starts.append(entry_start(near))
+                if self.adaptive:
+                    # plans on the 15 minute grid don't line up with the cells, the solver fills in the charging
+                    starts = [{name: value for name, value in values.items() if name.startswith('assignment')}
+                              for values in starts]
+                if config.get('warmStart', True) and session.backend == 'gurobi':
+                    for number, values in enumerate(starts):
+                        set_start(m, values, number)
+                self.telemetry.lap('mip starts')
+
+                if self.dump is not None:
+                    dump_run(os.path.join(self.dump, filename), m, inputs, self.startTime, runType, config,
+                             self.tariff, self.assigned)
+                    self.telemetry.lap('dump')
+                elif config.get('recordCorpus', False) and not os.path.exists(data_dir('corpus', key[:16])):
+                    # a production instance for tuning (see tuning.py), one per distinct input
+                    dump_run(data_dir('corpus', key[:16]), m, inputs, self.startTime, runType, config,
+                             self.tariff, self.assigned)
+                    self.telemetry.lap('dump')
+
+                # a background job shows the greedy plan until the solver finds a better one
+                if job is not None and plan is not None and not partial:
+                    job.publish(self._incumbent(plan, plan['cost'], time.perf_counter() - began, filename, runType, carried))
+
+                # Solve the model, a background job gets progress and every better plan through its callback
+                # and can stop it
+                # auto also falls back to HiGHS when gurobi can't solve it, e.g. over the size limit of its license
+                solution = None
+                useHighs = session.backend == 'highs'
+                if not useHighs:
+                    then = None
+                    if job is not None:
+                        then = self._publisher(m, handles, job, began, filename, runType, carried)
+                    try:
+                        m.optimize(self.telemetry.callback(then))
+                    except gp.GurobiError as e:
+                        if backend != 'auto':
+                            raise
+                        self.notify(f"Gurobi can't solve this model ({e}), solving with HiGHS")
+                        useHighs = True
+                if useHighs:
+                    # a background job can cancel it (see backends.py)
+                    highs = solve_highs(m, cancelled=None if job is None else lambda: job.cancelled)
+                    self.telemetry.mark()
+                    self.telemetry.phases['highs'] = highs.runtime
+                    self.telemetry.counts['nodes'] = highs.nodes
+                    code = highs.status
+                    if highs.x is not None:
+                        solution = self._solution(m, handles, highs.x)
+                        objVal, runtime = highs.objVal, highs.runtime
+                else:
+                    self.telemetry.mark()
+                    self.telemetry.solve_counts(m)
+                    code = m.status
+                    if m.SolCount > 0:
+                        solution = self._solution(m, handles)
+                        objVal, runtime = m.objVal, m.Runtime
+                # out of time before the solver found anything, the greedy plan is the best there is
+                if code == gp.GRB.TIME_LIMIT and solution is None and plan is not None and not partial:
+                    solution, objVal, runtime = plan, plan['cost'], time.perf_counter() - began
+                self.telemetry.lap('extraction')
+
+                if code == gp.GRB.INFEASIBLE:
+                   status = "Model is infeasible"
+                elif code == gp.GRB.OPTIMAL:
+                    status = "Optimal solution found"
+                elif code == gp.GRB.INTERRUPTED:
+                    status = "Solve cancelled"
+                elif code == gp.GRB.TIME_LIMIT and solution is not None:
+                    status = "Time limit reached, best plan found"
+                elif code == gp.GRB.TIME_LIMIT:
+                    status = "Time limit reached"
+                else:
+                    status = "Model Error"
+            finally:
+                if symmetry:
+                    m.remove(symmetry)
+
+        #####################################
+        # Exporting Results
+        #####################################
+
+        # Checking if it is feasible
+        if status not in ["Optimal solution found", "Time limit reached, best plan found"]:
+            return ChargeResult(status, runType, startTimeNum, telemetry=self.telemetry.as_dict())
+
+        result = self._result(solution, objVal, runtime, filename, runType, status, config, key, carried, buildTime)
+        # a plan cut short by the time limit isn't the answer to the next identical run
+        if cache is not None and status == "Optimal solution found":
+            cache.put(key, shape, self.soc, result)
+        return result
+
+    def _publisher(self, m, handles, job, began, filename, runType, carried=None):
+        # gurobi callback handing every new incumbent to the job as a plan, then the job's own callback
+        variables = m.getVars()
+
+        def publish(model, where):
+            if where == gp.GRB.Callback.MIPSOL:
+                x = np.array(model.cbGetSolution(variables))
+                job.publish(self._incumbent(self._solution(m, handles, x), model.cbGet(gp.GRB.Callback.MIPSOL_OBJ),
+                                            time.perf_counter() - began, filename, runType, carried))
+            job.callback(model, where)
+        return publish
+
+    def _incumbent(self, arrays, obj_val, sol_time, filename, runType, carried=None):
+        # a plan found while the solve is still running, not recorded anywhere
+        arrays = {name: np.asarray(arrays[name], dtype=float).copy() for name in ['powerCB', 'eB', 'chargerUse', 'assignment']}
+        if carried is not None:
+            commit(carried, arrays)
+        return ChargeResult("Best plan so far", runType, self.startTimeNum, filename, obj_val, sol_time, **arrays)
+
+    def _result(self, arrays, obj_val, sol_time, filename, runType, status, config, inputHash, carried=None, buildTime=None):
+        # the ChargeResult of a run with a plan: adds what a re-plan keeps from the previous plan,
+        # keeps the plan for the next re-plan and records the run in the run store (see runs.py)
+        # the schedule and assignments are only written out with exportFormat csv or parquet
+        arrays = {name: np.asarray(arrays[name], dtype=float).copy() for name in ['powerCB', 'eB', 'chargerUse', 'assignment']}
+        if carried is not None:
+            commit(carried, arrays)
+        result = ChargeResult(status, runType, self.startTimeNum, filename, obj_val, sol_time, buildTime=buildTime, **arrays)
+        result.telemetry = self.telemetry.as_dict()
+        result.diagnosis = self.diagnosis.as_list()
+
+        path = data_dir("outputs")
+
+        exportFormat = config.get('exportFormat', 'none')
+        if exportFormat != 'none':
+            result.export(path, exportFormat)
+
+        result.summary = {
+            "case_name": filename,
+            "numBuses": self.B,
+            "ebMaxKwh": self.eB_max,
+            "numChargers": self.numChargers,
+            "chargerPower": self.pCB_ub,
+            "routes": str(self.routes),
+            "gridMaxPower": self.gridKWH,
+            "obj_val": obj_val,
+            "build_time": buildTime,
+            "sol_time": sol_time,
+            "date": datetime.now().strftime("%m/%d/%Y"),
+            "type": runType,
+        }
+
+        # one indexed row per run instead of rewriting results.csv every time
+        if self.record:
+            result.runId = run_store().record(result, inputHash, config)
+            result.summary["run_id"] = result.runId
+
+        # keep the plan around for the next re-plan
+        self.plan = snapshot(self, result)
+        return result
+
+    def _solution(self, m, handles, x=None):
+        # plan arrays of a solved model, read in bulk from the variables the builder returned
+        # slots without a variable (see _build_matrix) stay 0, or the starting energy for eB
+        # x is a solution found by another backend, in the order of m.getVars() (see backends.py)
+        B, D, R, T = self.B, self.D, self.R, self.T
+        eB = np.repeat(self.eB_max * self.soc[:, None], T, axis=1)
+        powerCB = np.zeros((B, T))
+        chargerUse = np.zeros((B, T))
+        if 'slots' in handles:
+            def value(mvar):
+                if isinstance(mvar, np.ndarray):
+                    return mvar
+                if x is None:
+                    return mvar.X
+                return x[[v.index for v in mvar.reshape(-1).tolist()]].reshape(mvar.shape)
+            assignment = value(handles['assignment'])
+            if (handles['width'] > 1).any():
+                # cells of the adaptive grid back onto the 15 minute grid
+                powerCB, chargerUse, eB = expand(self, handles['slots'], handles['width'], handles['states'],
+                                                 value(handles['powerCB']), value(handles['chargerUse']),
+                                                 value(handles['eB']), assignment)
+            else:
+                powerCB[:, handles['slots']] = value(handles['powerCB'])
+                chargerUse[:, handles['slots']] = value(handles['chargerUse'])
+                eB[:, handles['states']] = value(handles['eB'])
+        else:
+            def fill(arr, variables):
+                if x is None:
+                    values = m.getAttr('X', variables)
+                else:
+                    values = {k: x[v.index] for k, v in variables.items()}
+                arr[tuple(np.array(list(values.keys())).T)] = list(values.values())
+                return arr
+            fill(powerCB, handles['powerCB'])
+            fill(chargerUse, handles['chargerUse'])
+            fill(eB, handles['eB'])
+            assignment = fill(np.zeros((B, D, R)), handles['assignment'])
+        return {'powerCB': powerCB, 'eB': eB, 'chargerUse': chargerUse, 'assignment': assignment}
+
+    def _fixed_assignment(self):
+        # self.assigned as a (B, D, R) array, buses or blocks it names that aren't selected are left out
+        # (screening.assignment_issues reports them)
+        # every covered day (coverDays) runs the same blocks, so a bus runs its block on each of them
+        busIndex = {bus: b for b, bus in enumerate(self.buses.iloc[:, 0].astype(str))}
+        blockIndex = {block: r for r, block in enumerate(self.routes.iloc[:, 0].astype(str))}
+        fixed = np.zeros((self.B, self.D, self.R))
+        for bus, block in self.assigned.items():
+            if str(bus) in busIndex and str(block) in blockIndex:
+                fixed[busIndex[str(bus)], self.coverDays, blockIndex[str(block)]] = 1
+        return fixed
+
+    def _prepare(self, config):
+        # turns the inputs and config into the arrays shared by the model builders
+        # whether they can be served at all is up to screening.screen
+
+        self.B = len(self.buses)
+        self.R = len(self.routes)
+
+        self.eB_max = config["ebMaxKwh"]
+        self.eB_min = int(self.eB_max * .2)
+        eB_range = self.eB_max - self.eB_min
 
         # charger params
-        numChargers = len(self.chargers)
-        pCB_ub = config["chargerPower"]
+        self.numChargers = len(self.chargers)
+        self.pCB_ub = config["chargerPower"]
 
         # power
-        gridKWH = config['gridMaxPower']
-
-        # time variables
-        D = 3
-        dt = 0.25
-        startTimeNum = time_to_quarter(self.startTime.strftime('%I:%M %p'))
+        self.gridKWH = config['gridMaxPower']
+
+        # model formulation, full or lean (fewer binaries, see _build_matrix)
+        self.formulation = config.get('formulation', 'full')
+        # a bus may run blocks back to back instead of one a day (see chaining.py)
+        self.chaining = config.get('blockChaining', False)
+        # 15 minute slots, or merged where nothing happens (see timegrid.py)
+        self.adaptive = config.get('timeGrid', 'fixed') == 'adaptive'
+        self.coarseSlots = config.get('coarseSlots', 8)
+
+        # time variables, horizonDays days from the midnight before startTime
+        self.D = D = config.get('horizonDays', 3)
+        # the day whose blocks must all be covered: tomorrow, or today on a one-day horizon
+        # (the windows of a daily-linked run cover their first day, see horizon.py)
+        self.coverDay = min(config.get('coverDay', 1), D - 1)
+        # and the days after it that are covered too, e.g. a week of service on a 7 day horizon
+        self.coverDays = np.arange(self.coverDay, min(self.coverDay + config.get('coverDays', 1), D))
+        self.dt = 0.25
+        self.startTimeNum = time_to_quarter(self.startTime.strftime('%I:%M %p'))
         # TODO: Fix time so there is a start time and end time
-        T = D * 96
-        optimized_time = [t for t in range(startTimeNum, T)]
-        # print(T)
-
-        [departure, arrival, eRoute, report] = init_routes(routes, eB_range, pCB_ub);
-        if report != 'All Clear':
-            return None
-
-        # for loop for tDep and tRet
-        tDep = np.zeros((R, D), dtype=int)
-        tRet = np.zeros((R, D), dtype=int)
-        for d in range(D):
-            for r in range(R):
-                # here we subtract one from the departure and arrival times
-                # since the time is one less than the matlab time
-                tDep[r, d] = int(departure[r] - 1 + d * 96)
-                tRet[r, d] = int(arrival[r] - 1 + d * 96)
+        self.T = D * 96
+
+        [departure, arrival, eRoute, _] = init_routes(self.routes, eB_range, self.pCB_ub);
+        self.telemetry.lap('init_routes')
+        self.eRoute = eRoute
+        # energy each (route, day) still takes out of a bus, less for blocks already out on the road (see rolling.py)
+        self.eRouteLeft = np.repeat(eRoute[:, None], D, axis=1).astype(float)
+
+        # here we subtract one from the departure and arrival times
+        # since the time is one less than the matlab time
+        dayOffset = np.arange(D) * 96
+        self.tDep = (departure.astype(int)[:, None] - 1 + dayOffset).astype(int)
+        self.tRet = (arrival.astype(int)[:, None] - 1 + dayOffset).astype(int)
 
         # creating tDay
-        tDay = np.zeros((D, 96))
-        for d in range(D):
-            tDay[d, :] = np.arange(d * 96, (d + 1) * 96)
+        self.tDay = np.arange(self.T).reshape(D, 96)
+
+        # Generate Grid Pricing Profile
+        if self.tariff is not None:
+            gridPowPrice = np.resize(np.asarray(self.tariff, dtype=float), self.T)
+        else:
+            gridPowPrice = np.array(init_grid_pricing(D))
+        self.gridPowPrice = gridPowPrice * config.get('tariffScale', 1.0)
+
+        # remove % and convert to float
+        soc = self.buses.iloc[:, 1].astype(str).str.replace('%', '')
+        self.soc = soc.astype(float).to_numpy() / 100
+        self.socEnd = self.soc if self.endSoc is None else np.asarray(self.endSoc, dtype=float)
+        self.telemetry.lap('inputs')
+
+    def _build_matrix(self, m):
+        # builds the model with one matrix constraint per constraint family
+        # charging variables only exist for the slots a bus can be at the depot (helpers.depot_slots),
+        # battery energy only from startTimeNum on; everything else is a known constant
+        # with timeGrid adaptive a variable covers a cell of several slots (see timegrid.py)
+        # variables are used through their flattened views, which gurobipy turns into constraints
+        # much faster than 2-D slices
+        self.telemetry.mark()
+        B, D, R, T = self.B, self.D, self.R, self.T
+        dt = self.dt
+        eB_max, eB_min = self.eB_max, self.eB_min
+        eB_range = eB_max - eB_min
+        pCB_ub = self.pCB_ub
+        startTimeNum = self.startTimeNum
+        eB_init = eB_max * self.soc
+
+        slots, width, states = time_grid(self, depot_slots(self.tDep, self.tRet, T, B, startTimeNum, self.coverDay),
+                                         self.adaptive, self.coarseSlots)
+        Tc = len(slots)
+        Te = len(states)
+
+        # flat indices into the (B, Tc) charging and (B, Te) energy variables
+        flatC = np.arange(B * Tc).reshape(B, Tc)
+        flatE = np.arange(B * Te).reshape(B, Te)
+
+        # transitions between two consecutive depot slots get change variables,
+        # entering or leaving a run of depot slots is a change of exactly chargerUse
+        inner = np.flatnonzero(slots[1:] == slots[:-1] + width[:-1]) + 1
+        entering = np.setdiff1d(np.flatnonzero(slots > 0), inner)
+        leaving = np.flatnonzero(np.isin(slots + width, slots, invert=True) & (slots + width < T))
+        # energy a slot's power adds and a full-power step, per charging variable
+        slotHours = np.tile(dt * width, B)
+        step = pCB_ub * slotHours
+
+        # Assigned runs: the assignment is a constant, the route coverage constraints become the
+        # depot slots each bus is out on its block, where it can't charge, and buses without a block
+        # have nothing to charge for; the solver's presolve drops the charging variables fixed at 0
+        fixed = self.fixed
+        free = np.ones((B, Tc))
+        if fixed is not None:
+            coverT, coverA = route_coverage_matrices(self.tDep, self.tRet, T)
+            free[(coverT[:, slots].T @ (coverA @ fixed.reshape(B, -1).T)).T > 0] = 0
+            free[~fixed.any(axis=(1, 2))] = 0
 
         #########################################
-        # Input data generation
+        # Defining Decision Vars
         #########################################
-        gridPowAvail = gridKWH
+        # the lean formulation keeps the same charging rules with two binaries per slot
+        # (chargerUse, tracker) instead of six, see the Charging Constraints below
+        lean = self.formulation == 'lean'
 
-        # Generate Grid Pricing Profile
-        gridPowPrice = init_grid_pricing(D)
+        # Buses
+        powerCB = m.addMVar((B, Tc), lb=0, ub=pCB_ub * free, vtype=gp.GRB.CONTINUOUS, name=slot_names("powerCB", B, slots))
+        eB = m.addMVar((B, Te), lb=eB_min, ub=eB_max, vtype=gp.GRB.CONTINUOUS, name=slot_names("eB", B, states))
 
-        params = {
-        "WLSACCESSID": st.secrets['GUROBI_ACCESSID'],
-        "WLSSECRET": st.secrets['GUROBI_SECRET'],
-        "LICENSEID": st.secrets['GUROBI_LICENSE'],
-        }
+        # Charging activities
+        chargerUse = m.addMVar((B, Tc), ub=free, vtype=gp.GRB.BINARY, name=slot_names("chargerUse", B, slots))
+        charging = m.addMVar((B, D), vtype=gp.GRB.BINARY, name="charging")
+        tracker = m.addMVar((B, Tc), vtype=gp.GRB.BINARY, name=slot_names("tracker", B, slots))
+        if fixed is None:
+            assignment = m.addMVar((B, D, R), vtype=gp.GRB.BINARY, name="assignment")
+        else:
+            assignment = fixed
+        if lean:
+            change = m.addMVar((B, len(inner)), lb=0, ub=1, vtype=gp.GRB.CONTINUOUS, name=slot_names("change", B, slots[inner]))
+        else:
+            gridPowToB = m.addMVar((B, Tc), lb=0, ub=self.gridKWH, vtype=gp.GRB.CONTINUOUS, name=slot_names("gridPowToB", B, slots))
+            T1 = m.addMVar((B, len(inner)), vtype=gp.GRB.BINARY, name=slot_names("T1", B, slots[inner]))
+            T2 = m.addMVar((B, len(inner)), vtype=gp.GRB.BINARY, name=slot_names("T2", B, slots[inner]))
+            change = m.addMVar((B, len(inner)), vtype=gp.GRB.BINARY, name=slot_names("change", B, slots[inner]))
+            tracker_b = m.addMVar((B, Tc), vtype=gp.GRB.BINARY, name=slot_names("tracker_b", B, slots))
+        m.update()
+        self.telemetry.lap('variables')
+
+        pCB = powerCB.reshape(-1)
+        e = eB.reshape(-1)
+        use = chargerUse.reshape(-1)
+        chg = change.reshape(-1)
+        trk = tracker.reshape(-1)
+        assign = assignment.reshape(-1)
+
+        # energy variable of every charging slot
+        eSlot = flatE[:, np.searchsorted(states, slots)].ravel()
+
+        #####################################
+        # Charging Constraints
+        #####################################
+        now = flatC[:, inner].ravel()
+        prev = flatC[:, inner - 1].ravel()
+        if lean:
+            # change >= |chargerUse[t] - chargerUse[t-1]|, exact once it is summed and capped below
+            m.addConstr(chg >= use[now] - use[prev], name="change up")
+            m.addConstr(chg >= use[prev] - use[now], name="change down")
+        else:
+            t1 = T1.reshape(-1)
+            t2 = T2.reshape(-1)
+            m.addConstr(chg == t1 + t2, name="change link")
+            m.addConstr(t1 - t2 == use[now] - use[prev], name="t chargeruse link 1")
+            m.addConstr(chg <= use[prev] + use[now], name="t chargeruse link 2")
+            m.addConstr(chg <= 2 - use[prev] - use[now], name="change chargeruse link")
+
+        # (B, B*n) per-bus sums
+        def busSum(n):
+            return sp.kron(sp.identity(B), np.ones((1, n)), format='csr')
+
+        # one charging session (two changes) per bus for every covered day
+        m.addConstr(busSum(len(inner)) @ chg
+                    + busSum(len(entering)) @ use[flatC[:, entering].ravel()]
+                    + busSum(len(leaving)) @ use[flatC[:, leaving].ravel()] <= 2 * len(self.coverDays))
+
+        # (B*D, B*Tc) per-bus-day sums of the slots charged
+        dayOf = sp.csr_matrix((width.astype(float), (slots // 96, np.arange(Tc))), shape=(D, Tc))
+        daySum = sp.kron(sp.identity(B), dayOf, format='csr')
+        m.addConstr(daySum @ use >= 4 * charging.reshape(-1))
+        if lean:
+            # a bus can't charge in more slots than the day has depot slots
+            m.addConstr(daySum @ use <= np.tile(np.asarray(dayOf.sum(axis=1)).ravel(), B) * charging.reshape(-1))
+        else:
+            m.addConstr(daySum @ use <= 96 * charging.reshape(-1))
+
+        m.addConstr(pCB <= pCB_ub * use)
+
+        # full power unless the bus can be topped off within one step (see _build_loop)
+        # tracker = 1 when the room left in the battery is at most one full-power step
+        if lean:
+            # the room left is between 0 and eB_range, so every big-M follows from eB_range and the step
+            room = eB_max - e[eSlot]
+            rest = np.maximum(eB_range - step, 0)
+            m.addConstr(room >= (1 - trk) * step)
+            m.addConstr(room <= (1 - trk) * rest + step)
+            m.addConstr(pCB >= pCB_ub * (use - trk))
+            m.addConstr(pCB * slotHours >= room - (1 - use) * step - (1 - trk) * rest)
+        else:
+            M = 1000
+            trk_b = tracker_b.reshape(-1)
+            # (eB_max - e) * tracker, linear: the room left is at most eB_range, so it is exact for a binary tracker
+            m.addConstr(pCB * slotHours + M * (1 - use) >= eB_max - e[eSlot] - eB_range * (1 - trk))
+            m.addConstr(pCB + M * (1 - use) >= pCB_ub * trk_b)
+            m.addConstr(eB_max - e[eSlot] >= -M * trk + step)
+            m.addConstr(eB_max - e[eSlot] <= M * trk_b + step)
+            m.addConstr(trk + trk_b == 1)
 
-        env = gp.Env(params=params)
+        # limit charging to number of chargers
+        # (Tc, B*Tc) sum over buses
+        slotSum = sp.kron(np.ones((1, B)), sp.identity(Tc), format='csr')
+        m.addConstr(slotSum @ use <= self.numChargers)
+        self.telemetry.lap('charging constraints')
 
-        # env = gp.Env()
+        #####################################
+        # Power Availability
+        #####################################
+        # the lean formulation draws powerCB straight from the grid
+        if lean:
+            grid = pCB
+        else:
+            grid = gridPowToB.reshape(-1)
+            m.addConstr(pCB == grid, name="charger power limit")
+        m.addConstr(slotSum @ grid <= self.gridKWH, name="grid power total")
+        self.telemetry.lap('power constraints')
 
-        env.start()
+        #####################################
+        # Bus Battery operation
+        #####################################
+        # (T, D*R) matrices of the energy a route takes out when it returns / needs when it leaves
+        busBlocks = sp.identity(B, format='csr')
+        depletion = route_event_matrix(self.tRet, self.eRouteLeft, T)
+        requirement = route_event_matrix(self.tDep, self.eRouteLeft, T)
+
+        # energy carried over from the previous state, the first state starts from the current SOC
+        # (slots charged in the cell before, route events since the previous state, see timegrid.py)
+        balance, fromPrev, carried, chargedIn, collect = balance_matrices(states, slots, width, startTimeNum, T)
+        eNow = flatE[:, np.searchsorted(states, balance)].ravel()
+        initial = np.where(fromPrev, 0, 1) * eB_init[:, None]
+        balanceConstr = m.addConstr(e[eNow] == sp.kron(busBlocks, carried, format='csr') @ e + initial.ravel()
+                    + dt * (sp.kron(busBlocks, chargedIn, format='csr') @ pCB)
+                    - sp.kron(busBlocks, collect @ depletion, format='csr') @ assign)
+        requirementConstr = m.addConstr(e >= eB_min + sp.kron(busBlocks, requirement[states], format='csr') @ assign)
+
+        # routes that already returned or left before now only touch the assignment
+        # (screening checks a fixed one)
+        returned = np.unique(depletion[1:startTimeNum].nonzero()[0]) + 1
+        returnedConstr = None
+        if len(returned) > 0 and fixed is None:
+            returnedConstr = m.addConstr(sp.kron(busBlocks, depletion[returned], format='csr') @ assign == 0)
+        departed = np.unique(requirement[:startTimeNum].nonzero()[0])
+        departedConstr = None
+        if len(departed) > 0 and fixed is None:
+            departedConstr = m.addConstr(sp.kron(busBlocks, requirement[departed], format='csr') @ assign
+                                         <= np.repeat(eB_init - eB_min, len(departed)))
+
+        # final state of battery energy
+        finalConstr = m.addConstr(e[flatE[:, Te - 1]] >= eB_max * self.socEnd)
+        self.telemetry.lap('battery constraints')
 
-        # Create a new model
-        m = gp.Model("Charge opt", env=env)
+        #####################################
+        # Route Coverage Constraints
+        #####################################
+        # a fixed assignment is covered by the bounds of chargerUse already
+        if fixed is None and self.chaining:
+            # every bus is one unit of flow from the start of the horizon to its end, through
+            # the blocks it runs and wait arcs in between (see chaining.py); it can only charge
+            # while it is on a wait arc, which covers the blocks it could be out on at once
+            blocks, waits, supply, waitOf = flow_network(self.tDep, self.tRet, T)
+            wait = m.addMVar((B, waits.shape[1]), lb=0, ub=1, vtype=gp.GRB.CONTINUOUS, name="wait")
+            m.addConstr(sp.kron(busBlocks, blocks, format='csr') @ assign
+                        + sp.kron(busBlocks, waits, format='csr') @ wait.reshape(-1) == np.tile(supply, B),
+                        name="block flow")
+            atDepot = sp.csr_matrix((np.ones(Tc), (np.arange(Tc), waitOf[slots])), shape=(Tc, waits.shape[1]))
+            m.addConstr(use <= sp.kron(busBlocks, atDepot, format='csr') @ wait.reshape(-1), name="charge at depot")
+            m.addConstr(assignment[:, self.coverDays, :].sum(axis=0) == 1)
+        elif fixed is None:
+            # (K, T) and (K, D*R) incidence of every on-route slot, kept for depot slots only
+            coverT, coverA = route_coverage_matrices(self.tDep, self.tRet, T)
+            coverT = coverT[:, slots]
+            keep = np.flatnonzero(coverT.getnnz(axis=1))
+            if len(keep) > 0:
+                m.addConstr(sp.kron(busBlocks, coverT[keep], format='csr') @ use
+                            + sp.kron(busBlocks, coverA[keep], format='csr') @ assign <= 1)
+
+            m.addConstr(assignment[:, self.coverDays, :].sum(axis=0) == 1)
+            m.addConstr(assignment.sum(axis=2) <= 1)
+        self.telemetry.lap('coverage constraints')
 
-        # MIP Gap
-        m.setParam('MIPGap', 0.03)
+        ###################################
+        # Objective
+        ###################################
+        m.setObjective(dt * (np.tile(self.gridPowPrice[slots] * width, B) @ grid), gp.GRB.MINIMIZE)
+        self.telemetry.lap('objective')
+
+        # what _update_matrix needs to put new data into the model and _solution to read the plan
+        return {
+            'powerCB': powerCB, 'eB': eB, 'chargerUse': chargerUse, 'assignment': assignment,
+            'assign': assign, 'grid': grid, 'slots': slots, 'width': width, 'states': states,
+            'balance': balanceConstr, 'collect': collect, 'fromPrev': fromPrev,
+            'requirement': requirementConstr, 'final': finalConstr,
+            'departed': departedConstr, 'departedRows': departed,
+            'returned': returnedConstr, 'returnedRows': returned,
+        }
+
+    def _update_matrix(self, m, handles):
+        # puts this run's data into a model _build_matrix built for a run of the same structure:
+        # initial SOC (right-hand sides), route energy (assignment coefficients) and the tariff (objective)
+        self.telemetry.mark()
+        B, T = self.B, self.T
+        eB_init = self.eB_max * self.soc
+        busBlocks = sp.identity(B, format='csr')
+        depletion = route_event_matrix(self.tRet, self.eRouteLeft, T)
+        requirement = route_event_matrix(self.tDep, self.eRouteLeft, T)
+
+        # initial SOC
+        handles['balance'].RHS = (np.where(handles['fromPrev'], 0, 1) * eB_init[:, None]).ravel()
+        handles['final'].RHS = self.eB_max * self.socEnd
+
+        # route energy, on the left-hand side: e - ... + depletion @ assign == initial, e - requirement @ assign >= eB_min
+        assign = handles['assign'].tolist()
+        updates = [(handles['balance'], sp.kron(busBlocks, handles['collect'] @ depletion, format='coo')),
+                   (handles['requirement'], -sp.kron(busBlocks, requirement[handles['states']], format='coo'))]
+        if handles['departed'] is not None:
+            handles['departed'].RHS = np.repeat(eB_init - self.eB_min, len(handles['departedRows']))
+            updates.append((handles['departed'], sp.kron(busBlocks, requirement[handles['departedRows']], format='coo')))
+        if handles['returned'] is not None:
+            updates.append((handles['returned'], sp.kron(busBlocks, depletion[handles['returnedRows']], format='coo')))
+        for constr, coeffs in updates:
+            rows = constr.tolist()
+            for i, j, value in zip(coeffs.row, coeffs.col, coeffs.data):
+                m.chgCoeff(rows[i], assign[j], value)
+
+        # tariff
+        handles['grid'].Obj = self.dt * np.tile(self.gridPowPrice[handles['slots']] * handles['width'], B)
+        m.update()
+        self.telemetry.lap('data update')
+
+    def _build_loop(self, m):
+        # builds the model one constraint at a time
+        self.telemetry.mark()
+        B, D, R, T = self.B, self.D, self.R, self.T
+        dt = self.dt
+        eB_max, eB_min = self.eB_max, self.eB_min
+        pCB_ub = self.pCB_ub
+        gridKWH = self.gridKWH
+        gridPowAvail = gridKWH
+        gridPowPrice = self.gridPowPrice
+        numChargers = self.numChargers
+        startTimeNum = self.startTimeNum
+        optimized_time = [t for t in range(startTimeNum, T)]
+        tDep, tRet, tDay = self.tDep, self.tRet, self.tDay
+        eRouteLeft = self.eRouteLeft
 
         #########################################
         # Defining Decision Vars
@@ -135,7 +841,12 @@ class ChargeOpt:
         tracker = m.addVars(B, T, vtype=gp.GRB.BINARY, name="tracker")
         tracker_b = m.addVars(B, T, vtype=gp.GRB.BINARY, name="tracker_b")
         assignment = m.addVars(B, D, R, vtype=gp.GRB.BINARY, name="assignment")
+        if self.fixed is not None:
+            # Assigned runs, kept as fixed variables here
+            for (b, d, r), var in assignment.items():
+                var.LB = var.UB = self.fixed[b, d, r]
         m.update()
+        self.telemetry.lap('variables')
 
         #####################################
         # Constraints
@@ -161,9 +872,10 @@ class ChargeOpt:
         m.addConstrs((change[b, t] <= 2 - chargerUse[b, t - 1] - chargerUse[b, t] for b in range(B) for t in range(1, T)),
                     "change chargeruse link")
         
-        m.addConstrs(sum(change[b, t] for t in range(T)) <= 2 for b in range(B))
-        m.addConstrs(sum(chargerUse[b, t] for t in tDay[d]) >= 4 * charging[b, d] for b in range(B) for d in range(D))
-        m.addConstrs(sum(chargerUse[b, t] for t in tDay[d]) <= 96 * charging[b, d] for b in range(B) for d in range(D))
+        # one charging session for every covered day
+        m.addConstrs(gp.quicksum(change[b, t] for t in range(T)) <= 2 * len(self.coverDays) for b in range(B))
+        m.addConstrs(gp.quicksum(chargerUse[b, t] for t in tDay[d]) >= 4 * charging[b, d] for b in range(B) for d in range(D))
+        m.addConstrs(gp.quicksum(chargerUse[b, t] for t in tDay[d]) <= 96 * charging[b, d] for b in range(B) for d in range(D))
 
         # add constraints to connect charger use to charger power
         m.addConstrs(powerCB[b, t] <= pCB_ub * chargerUse[b, t] for b in range(B) for t in range(T))
@@ -172,7 +884,8 @@ class ChargeOpt:
         # tracker_b can be 0
         # tracker must be 1
         # energy given to bus (pCB*dt) must be greater than equal to eLeft (though only equal) when charging
-        m.addConstrs(powerCB[b, t]*dt + M*(1-chargerUse[b, t]) >= (eB_max - eB[b,t])*tracker[b, t] for b in range(B) for t in optimized_time)
+        # (eB_max - eB) * tracker, linear since eB_max - eB is at most eB_max - eB_min
+        m.addConstrs(powerCB[b, t]*dt + M*(1-chargerUse[b, t]) >= (eB_max - eB[b,t]) - (eB_max - eB_min)*(1 - tracker[b, t]) for b in range(B) for t in optimized_time)
 
         # if eLeft = 12.25 both can be 0 or 1, no need to have constraint
 
@@ -190,7 +903,8 @@ class ChargeOpt:
         m.addConstrs((tracker[b, t] + tracker_b[b, t] == 1) for b in range(B) for t in range(T))
 
         # limit charging to number of chargers
-        m.addConstrs(sum(chargerUse[b, t] for b in range(B)) <= numChargers for t in range(T))
+        m.addConstrs(gp.quicksum(chargerUse[b, t] for b in range(B)) <= numChargers for t in range(T))
+        self.telemetry.lap('charging constraints')
 
         #####################################
         # Power Availability
@@ -200,6 +914,7 @@ class ChargeOpt:
 
         m.addConstrs((powerCB[b, t] == (gridPowToB[b, t]) for t in range(T) for b in range(B)),
             "charger power limit")
+        self.telemetry.lap('power constraints')
         
         #####################################
         # Bus Battery operation
@@ -213,7 +928,7 @@ class ChargeOpt:
                         t = tDay[d][i]
                         for r in range(R):
                             if t == tRet[r][d]:
-                                routeDepletion += eRoute[r] * assignment[b, d, r]
+                                routeDepletion += eRouteLeft[r, d] * assignment[b, d, r]
                         m.addConstr(eB[b, t] == eB[b, t - 1] + dt * powerCB[b, t - 1] - routeDepletion)
 
         # add constraints for route requirement
@@ -224,19 +939,16 @@ class ChargeOpt:
                     routeRequirement = 0
                     for r in range(R):
                         if t == tDep[r][d]:
-                            routeRequirement += eRoute[r] * assignment[b, d, r]
+                            routeRequirement += eRouteLeft[r, d] * assignment[b, d, r]
                     m.addConstr(eB[b, t] >= eB_min + routeRequirement)
 
         # add constraints for initial and final state of battery energy
         for b in range(B):
-            soc = self.buses.iloc[b, 1]
-            print(soc)
-            # remove % and convert to float
-            soc = soc.replace('%', '')
-            soc = float(soc) / 100
-            m.addConstrs(eB[b, t] == eB_max * soc for t in range(startTimeNum))
-            m.addConstrs(eB[b, t] == eB_max * soc for t in range(startTimeNum))
-            m.addConstr(eB[b, T - 1] >= eB_max * soc)
+            soc = self.soc[b]
+            # (slot 0 has no balance constraint, it starts from the SOC on a plan from midnight too)
+            m.addConstrs(eB[b, t] == eB_max * soc for t in range(max(startTimeNum, 1)))
+            m.addConstr(eB[b, T - 1] >= eB_max * self.socEnd[b])
+        self.telemetry.lap('battery constraints')
 
         #####################################
         # Route Coverage Constraints
@@ -247,22 +959,34 @@ class ChargeOpt:
                     for t in range(tDep[r][d], tRet[r][d] + 1):
                         m.addConstr(chargerUse[b, t] + assignment[b, d, r] <= 1)
 
-        m.addConstrs(assignment.sum('*', d, r) == 1 for r in range(R) for d in range(1, 2))
-        m.addConstrs(assignment.sum(b, d, '*') <= 1 for b in range(B) for d in range(D))
+        m.addConstrs(assignment.sum('*', d, r) == 1 for r in range(R) for d in self.coverDays)
+        if self.chaining:
+            # flow through the blocks a bus runs, see chaining.py
+            blocks, waits, supply, _ = flow_network(tDep, tRet, T)
+            wait = m.addVars(B, waits.shape[1], lb=0, ub=1, vtype=gp.GRB.CONTINUOUS, name="wait")
+            blocks, waits = blocks.tocsr(), waits.tocsr()
+            for b in range(B):
+                for n in range(len(supply)):
+                    row, arcs = blocks.getrow(n), waits.getrow(n)
+                    m.addConstr(gp.quicksum(v * assignment[b, c // R, c % R] for c, v in zip(row.indices, row.data))
+                                + gp.quicksum(v * wait[b, a] for a, v in zip(arcs.indices, arcs.data)) == supply[n])
+        else:
+            m.addConstrs(assignment.sum(b, d, '*') <= 1 for b in range(B) for d in range(D))
                 
         # time shift constrains
         m.addConstrs(powerCB[b, t] == 0 for b in range(B) for t in range(startTimeNum))
         m.addConstrs(gridPowToB[b, t] == 0 for b in range(B) for t in range(startTimeNum))
         m.addConstrs(chargerUse[b, t] == 0 for b in range(B) for t in range(startTimeNum))
+        self.telemetry.lap('coverage constraints')
 
         # make the model static
-        # TODO: fix this so that the assignemnts use the heuristic
+        # the greedy assignments from chargeopt/heuristic.py are passed in as a MIP start (see solve)
         # m.addConstrs(assignment[b, d, b] == 1 for b in range(B) for d in range(D))
 
         # ###################################
         # Setting Objective and Solving
         ###################################
-        sums_over_buses = [sum(gridPowToB[b, t] for b in range(B)) for t in range(T)]
+        sums_over_buses = [gp.quicksum(gridPowToB[b, t] for b in range(B)) for t in range(T)]
         # check size
         assert len(sums_over_buses) == T
 
@@ -272,148 +996,7 @@ class ChargeOpt:
         # Create a LinExpr object from the array using the quicksum method
         obj_expr = 0.25 * gp.quicksum(obj_vals)
         m.setObjective(obj_expr, gp.GRB.MINIMIZE)
+        self.telemetry.lap('objective')
 
-        # Solve the model
-        m.optimize()
-
-        #####################################
-        # Exporting Results
-        #####################################
-        
-        # Checking if it is feasible
-        if m.status == gp.GRB.OPTIMAL:
-
-            # create a dictionary of variable names and values
-            variable_dict = {var.VarName: var.x for var in m.getVars()}
-
-            # two-dimensional
-            def genDF(varName):
-                df = pd.DataFrame(columns=['time', 'bus', 'value'])
-                data = []
-
-                for t in range(T):
-                    for b in range(B):
-                        value = variable_dict[f'{varName}[{b},{t}]']
-                        data.append({'time': t, 'bus': b, f'{varName}': value})
-
-                df = pd.DataFrame(data)
-                if len(df) > 0:
-                    df = df.set_index(['bus', 'time'])
-                    return df
-
-                else:
-                    return None
-
-
-            powerCB_df = genDF('powerCB')
-            chargerUse_df = genDF('chargerUse')
-            # gridpowtoB_df = genDF('gridPowToB')
-            eB_df = genDF('eB')
-
-            dfs = [powerCB_df,  eB_df, chargerUse_df]
-            twodim_df = pd.concat(dfs, axis=1, join='inner')
-            path = os.path.join(os.getcwd(), "chargeopt", "outputs")
-
-            # Check if the directory exists
-            if not os.path.exists(path):
-                # If not, create it
-                os.makedirs(path)
-
-            # export to csv
-            twodim_df.to_csv(f'{path}/{filename}.csv')
-
-            ## Gen assignments
-            data = []
-            varName = 'assignment'
-            for d in range(D):
-                for b in range(B):
-                    for r in range(R):
-                        value = variable_dict[f'{varName}[{b},{d},{r}]']
-                        data.append({'day': d, 'bus': b, 'route': r, f'{varName}': value})
-
-            assignment_df = pd.DataFrame(data)
-            assignment_df = assignment_df.set_index(['bus', 'day', 'route'])
-            assignment_df.to_csv(f'{path}/assignments_{filename}.csv')
-
-            # create the results DataFrame
-            results_df = pd.DataFrame(columns=["case_name", "numBuses", "ebMaxKwh", "numChargers", "chargerPower", "chargerEff",
-                                            "routes", "gridMaxPower", "obj_val", "sol_time", "date",
-                                            "type"])
-            results_file = f'{path}/results.csv'
-
-            # try to read in the current results file (if it exists)
-            try:
-                current_results = pd.read_csv(results_file)
-                results_df = pd.concat([current_results, results_df], ignore_index=True)
-            except FileNotFoundError:
-                pass
-
-            # get the objective value and solution time
-            obj_val = m.objVal
-            sol_time = m.Runtime
-
-            # get current date in month/day/year format
-            current_date = datetime.now().strftime("%m/%d/%Y")
-
-            # Convert the dictionary to a DataFrame
-            new_row = pd.DataFrame([{
-                "case_name": filename,
-                "numBuses": B,
-                "ebMaxKwh": eB_max,
-                "numChargers": numChargers,
-                "chargerPower": pCB_ub,
-                "routes": str(routes),
-                "gridMaxPower": gridKWH,
-                "obj_val": obj_val,
-                "sol_time": sol_time,
-                "date": current_date,
-                # "type": config['runType']
-            }])
-
-            # Concatenate the new row with the existing DataFrame
-            results_df = pd.concat([results_df, new_row], ignore_index=True)
-            # print charging[b, d]
-            # print(chargerUse[b, t])
-            #  # two-dimensional
-            # def genCharging(varName):
-            #     df = pd.DataFrame(columns=['day', 'bus', 'value'])
-            #     data = []
-
-            #     for d in range(D):
-            #         for b in range(B):
-            #             value = variable_dict[f'{varName}[{b},{d}]']
-            #             data.append({'day': d, 'bus': b, f'{varName}': value})
-
-            #     df = pd.DataFrame(data)
-            #     df = df.set_index(['bus', 'day'])
-
-            # chargeUse = genDF('chargerUse')
-            # chargeUse = chargeUse.sort_values(by=['bus', 'time'])
-            # st.write(chargeUse)
-
-            # chargeDaily = genCharging('charging')
-            # st.write(chargeDaily)
-
-            # change = genDF('change')
-            # st.write(change)
-            
-            # sum of change for each day and bus
-            # a day is 96 time steps
-            # for d in range(D):
-            #     for b in range(B):
-            #         changeSum = change.iloc[b, d*96:(d+1)*96].sum()
-            #         st.write(changeSum)
-            # changeSum = change.groupby(['bus', 'time']).sum()
-            # st.write(changeSum)
-
-            # write the results to the results.csv file
-            results_df.to_csv(results_file, index=False)
-
-        if m.status == gp.GRB.INFEASIBLE:
-           status = "Model is infeasible"
-        elif m.status == gp.GRB.OPTIMAL:
-            status = "Optimal solution found"
-        else:
-            status = "Model Error"
-
-        return status, startTimeNum
\ No newline at end of file
+        # the variables _solution reads the plan from
+        return {'powerCB': powerCB, 'eB': eB, 'chargerUse': chargerUse, 'assignment': assignment}
@@ -0,0 +1,72 @@
+import json
+import os
+import time
+import gurobipy as gp
+import numpy as np
+import pandas as pd
+
+from chargeopt.backends import solve_highs
+from chargeopt.session import gurobi_params
+
+# Model dumps of Optimal solves, for reproducing a run away from the dashboard.
+# A dump directory holds what the solver got and what ChargeOpt got:
+#   model.mps    the model, as built (or updated) for the run
+#   params.prm   the parameters it was solved with (MIPGap, TimeLimit)
+#   start.mst    the MIP starts, when there were any
+#   buses.csv, blocks.csv, chargers.csv, run.json   the inputs, start time, run type, config, tariff
+#                                                   and the assignment of Assigned runs
+# replay re-solves model.mps as it is, rerun solves the inputs again with the current code.
+
+
+def dump_run(path, m, inputs, startTime, runType, config, tariff=None, assigned=None):
+    # writes the dump of a run about to be solved, inputs are its (buses, blocks, chargers)
+    os.makedirs(path, exist_ok=True)
+    m.update()
+    m.write(os.path.join(path, 'model.mps'))
+    m.write(os.path.join(path, 'params.prm'))
+    if m.NumStart > 0:
+        m.write(os.path.join(path, 'start.mst'))
+    for name, frame in zip(['buses', 'blocks', 'chargers'], inputs):
+        frame.to_csv(os.path.join(path, f'{name}.csv'), index=False)
+    run = {
+        'startTime': startTime.isoformat(),
+        'runType': runType,
+        'config': config,
+        'tariff': None if tariff is None else np.asarray(tariff, dtype=float).tolist(),
+        'assigned': assigned or {},
+    }
+    with open(os.path.join(path, 'run.json'), 'w') as f:
+        json.dump(run, f, indent=1, default=str)
+
+
+def replay(path, backend='gurobi', timeLimit=None, env=None):
+    # re-solves the dumped model, returns {status, objVal, runtime, nodes}
+    # status is the gurobi status code, also for HiGHS
+    env = env or gp.Env(params=gurobi_params())
+    m = gp.read(os.path.join(path, 'model.mps'), env)
+    try:
+        m.read(os.path.join(path, 'params.prm'))
+        if timeLimit is not None:
+            m.setParam('TimeLimit', timeLimit)
+        if backend == 'highs':
+            highs = solve_highs(m)
+            return {'status': highs.status, 'objVal': highs.objVal, 'runtime': highs.runtime, 'nodes': highs.nodes}
+        if os.path.exists(os.path.join(path, 'start.mst')):
+            m.read(os.path.join(path, 'start.mst'))
+        start = time.perf_counter()
+        m.optimize()
+        return {'status': m.status, 'objVal': m.objVal if m.SolCount > 0 else None,
+                'runtime': time.perf_counter() - start, 'nodes': m.NodeCount}
+    finally:
+        m.dispose()
+
+
+def load_inputs(path):
+    # (buses, blocks, chargers, run) of a dump, read back the way opt_form passes them
+    buses = pd.read_csv(os.path.join(path, 'buses.csv'), dtype=str)
+    blocks = pd.read_csv(os.path.join(path, 'blocks.csv'), dtype=str)
+    blocks['Mileage'] = blocks['Mileage'].astype(float)
+    chargers = pd.read_csv(os.path.join(path, 'chargers.csv'), dtype=str)
+    with open(os.path.join(path, 'run.json')) as f:
+        run = json.load(f)
+    return buses, blocks, chargers, run
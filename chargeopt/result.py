@@ -0,0 +1,70 @@
+import os
+from dataclasses import dataclass, field
+from typing import Optional
+import numpy as np
+import pandas as pd
+
+# What ChargeOpt.solve returns.
+# The plan is kept as arrays indexed like the model: (bus, time slot) for powerCB, eB and chargerUse,
+# (bus, day, route) for assignment. Buses and routes are in the order they were passed to ChargeOpt.
+
+SOLVED = ['Optimal solution found', 'Decomposed solution found', 'Heuristic solution found',
+          'Time limit reached, best plan found',
+          # the incumbent of a solve that is still running (see SolveJob.publish)
+          'Best plan so far']
+
+
+@dataclass
+class ChargeResult:
+    status: str
+    runType: str
+    startTimeNum: int = 0
+    caseName: str = ''
+    objVal: Optional[float] = None
+    solTime: Optional[float] = None
+    powerCB: Optional[np.ndarray] = None      # kW drawn by each bus, (B, T)
+    eB: Optional[np.ndarray] = None           # kWh in each battery, (B, T)
+    chargerUse: Optional[np.ndarray] = None   # 1 while a bus is on a charger, (B, T)
+    assignment: Optional[np.ndarray] = None   # 1 if bus b runs route r on day d, (B, D, R)
+    buildTime: Optional[float] = None
+    # id in the run store (see runs.py), set once the run is recorded
+    runId: Optional[str] = None
+    # the run's row of inputs and results (see ChargeOpt._result)
+    summary: dict = field(default_factory=dict)
+    # phase timings, model size and incumbent/bound trace (see telemetry.py)
+    telemetry: dict = field(default_factory=dict)
+    # what pre-solve screening found, one dict per issue (see screening.py)
+    diagnosis: list = field(default_factory=list)
+
+    @property
+    def solved(self):
+        return self.status in SOLVED and self.powerCB is not None
+
+    def schedule_df(self):
+        # one row per bus and time slot: bus, time, powerCB, eB, chargerUse
+        B, T = self.powerCB.shape
+        return pd.DataFrame({
+            'bus': np.repeat(np.arange(B), T),
+            'time': np.tile(np.arange(T), B),
+            'powerCB': self.powerCB.ravel(),
+            'eB': self.eB.ravel(),
+            'chargerUse': self.chargerUse.ravel(),
+        })
+
+    def assignment_df(self):
+        # one row per bus, day and route: bus, day, route, assignment
+        B, D, R = self.assignment.shape
+        bus, day, route = np.indices((B, D, R)).reshape(3, -1)
+        return pd.DataFrame({'bus': bus, 'day': day, 'route': route, 'assignment': self.assignment.ravel()})
+
+    def export(self, path, fmt='csv'):
+        # writes {caseName} and assignments_{caseName} as csv or parquet to path
+        os.makedirs(path, exist_ok=True)
+        schedule = self.schedule_df().set_index(['bus', 'time'])
+        assignments = self.assignment_df().set_index(['bus', 'day', 'route'])
+        if fmt == 'parquet':
+            schedule.to_parquet(os.path.join(path, f'{self.caseName}.parquet'))
+            assignments.to_parquet(os.path.join(path, f'assignments_{self.caseName}.parquet'))
+        else:
+            schedule.to_csv(os.path.join(path, f'{self.caseName}.csv'))
+            assignments.to_csv(os.path.join(path, f'assignments_{self.caseName}.csv'))
@@ -0,0 +1,98 @@
+import numpy as np
+
+# Rolling-horizon re-planning for ChargeOpt.
+# A plan is kept as a snapshot (see snapshot) indexed by the midnight it was planned from.
+# When the same fleet is planned again later, carry_over lines the snapshot up with the new run:
+#   - the time grid moves by a whole day for every midnight passed since the last plan
+#   - slots before now keep what the last plan did, they are shown but not optimized again
+#   - blocks already out on the road stay with the bus they left with, and only the energy
+#     still ahead of them is taken out (the live SOC already has the rest)
+#   - what is left of the last plan becomes a MIP start
+# Buses and blocks are matched on their ids, so selections can change between runs.
+
+
+def snapshot(opt, result):
+    # plan arrays of a ChargeResult, with enough to line the plan up with a later run
+    return {
+        'anchor': opt.startTime.date(),
+        'vehicles': opt.buses.iloc[:, 0].astype(str).tolist(),
+        'blocks': opt.routes.iloc[:, 0].astype(str).tolist(),
+        'assignment': result.assignment,
+        'powerCB': result.powerCB,
+        'chargerUse': result.chargerUse,
+        'eB': result.eB,
+    }
+
+
+def carry_over(opt, previous):
+    # opt is a ChargeOpt after _prepare, previous a snapshot of the last plan
+    # returns None if the plans don't overlap, otherwise
+    #   fixed: assignments of blocks out on the road, fixed in the model
+    #   onRoad: the same as (bus, day, route) indices
+    #   past: the schedule before now of the matched buses, only put into the result (see commit)
+    #   start: the rest of the last plan, {VarName: value} for a MIP start
+    #   eRouteLeft: (R, D) energy still ahead of every block
+    B, D, R, T = opt.B, opt.D, opt.R, opt.T
+    startTimeNum = opt.startTimeNum
+    shift = (opt.startTime.date() - previous['anchor']).days
+    prevD = previous['assignment'].shape[1]
+    if shift < 0 or shift >= prevD:
+        return None
+    offset = shift * 96
+    prevT = previous['powerCB'].shape[1]
+
+    busOf = _match(opt.buses.iloc[:, 0].astype(str), previous['vehicles'])
+    blockOf = _match(opt.routes.iloc[:, 0].astype(str), previous['blocks'])
+    buses = np.flatnonzero(busOf >= 0)
+    blocks = np.flatnonzero(blockOf >= 0)
+
+    pastSlots = np.arange(offset, offset + min(startTimeNum, prevT - offset))
+    past = {name: previous[name][busOf[buses]][:, pastSlots] for name in ['powerCB', 'chargerUse', 'eB']}
+    past['buses'] = buses
+
+    start = {}
+    for b in buses:
+        for t in range(startTimeNum, min(T, prevT - offset)):
+            start[f'chargerUse[{b},{t}]'] = previous['chargerUse'][busOf[b], t + offset]
+
+    fixed = {}
+    onRoad = []
+    eRouteLeft = opt.eRouteLeft.copy()
+    for d in range(min(D, prevD - shift)):
+        for r in blocks:
+            dep, ret = opt.tDep[r, d], opt.tRet[r, d]
+            out = dep < startTimeNum <= ret
+            for b in buses:
+                value = previous['assignment'][busOf[b], d + shift, blockOf[r]]
+                start[f'assignment[{b},{d},{r}]'] = value
+                if out and value > 0.5:
+                    fixed[f'assignment[{b},{d},{r}]'] = 1
+                    onRoad.append((b, d, r))
+                    eRouteLeft[r, d] *= (ret - startTimeNum) / max(ret - dep, 1)
+
+    return {'fixed': fixed, 'onRoad': onRoad, 'past': past, 'start': start, 'eRouteLeft': eRouteLeft}
+
+
+def commit(carried, arrays):
+    # puts what the previous plan committed to into this run's plan arrays
+    past = carried['past']
+    for name in ['powerCB', 'chargerUse', 'eB']:
+        arrays[name][past['buses'], :past[name].shape[1]] = past[name]
+    for b, d, r in carried['onRoad']:
+        arrays['assignment'][b, d, r] = 1
+
+
+def fix_values(m, values):
+    # fixes the model variables named in values, names the model doesn't have are skipped
+    m.update()
+    for name, value in values.items():
+        var = m.getVarByName(name)
+        if var is not None:
+            var.LB = value
+            var.UB = value
+
+
+def _match(ids, previousIds):
+    # position of every id in previousIds, -1 if it isn't there
+    position = {v: i for i, v in enumerate(previousIds)}
+    return np.array([position.get(v, -1) for v in ids], dtype=int)
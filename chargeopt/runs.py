@@ -0,0 +1,159 @@
+import json
+import os
+import sqlite3
+import uuid
+from datetime import datetime
+import numpy as np
+
+from chargeopt.helpers import data_dir
+from chargeopt.result import ChargeResult
+
+# Run store for ChargeOpt, replaces the append-only results.csv.
+# One SQLite row per solved run, indexed by id, date and input hash, with the config, objective,
+# timings, solver telemetry (see telemetry.py) and the file its plan arrays are in (runs/{id}.npz next to
+# the database).
+# Recording a run is one insert, reading one is a lookup by id, whatever the history holds.
+
+ARRAYS = ['powerCB', 'eB', 'chargerUse', 'assignment']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    created TEXT NOT NULL,
+    date TEXT NOT NULL,
+    case_name TEXT,
+    input_hash TEXT,
+    type TEXT,
+    status TEXT,
+    start_slot INTEGER,
+    num_buses INTEGER,
+    eb_max_kwh REAL,
+    num_chargers INTEGER,
+    charger_power REAL,
+    grid_max_power REAL,
+    routes TEXT,
+    config TEXT,
+    obj_val REAL,
+    build_time REAL,
+    solve_time REAL,
+    arrays TEXT,
+    telemetry TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_date ON runs (date);
+CREATE INDEX IF NOT EXISTS runs_input_hash ON runs (input_hash);
+"""
+
+
+class RunStore:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.join(path, 'runs'), exist_ok=True)
+        self.db = os.path.join(path, 'runs.sqlite')
+        with self._connect() as con:
+            con.executescript(SCHEMA)
+            # stores from before telemetry was recorded
+            columns = [row[1] for row in con.execute("PRAGMA table_info(runs)")]
+            if 'telemetry' not in columns:
+                con.execute("ALTER TABLE runs ADD COLUMN telemetry TEXT")
+
+    def _connect(self):
+        # a connection per call, runs are recorded from the solver threads
+        return sqlite3.connect(self.db, timeout=30)
+
+    def record(self, result, inputHash, config):
+        # stores a solved ChargeResult, returns its run id
+        runId = uuid.uuid4().hex
+        arrays = os.path.join('runs', f'{runId}.npz')
+        np.savez_compressed(os.path.join(self.path, arrays), **{name: getattr(result, name) for name in ARRAYS})
+
+        now = datetime.now()
+        summary = result.summary
+        row = {
+            'id': runId,
+            'created': now.isoformat(timespec='seconds'),
+            'date': now.strftime('%Y-%m-%d'),
+            'case_name': result.caseName,
+            'input_hash': inputHash,
+            'type': result.runType,
+            'status': result.status,
+            'start_slot': result.startTimeNum,
+            'num_buses': summary.get('numBuses'),
+            'eb_max_kwh': summary.get('ebMaxKwh'),
+            'num_chargers': summary.get('numChargers'),
+            'charger_power': summary.get('chargerPower'),
+            'grid_max_power': summary.get('gridMaxPower'),
+            'routes': summary.get('routes'),
+            'config': json.dumps(config, sort_keys=True, default=str),
+            'obj_val': result.objVal,
+            'build_time': result.buildTime,
+            'solve_time': result.solTime,
+            'arrays': arrays,
+            'telemetry': json.dumps(result.telemetry, default=_plain),
+        }
+        with self._connect() as con:
+            con.execute(f"INSERT INTO runs ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                        [_plain(value) for value in row.values()])
+        return runId
+
+    def load(self, runId):
+        # the ChargeResult of a recorded run, None if there is no such run
+        with self._connect() as con:
+            con.row_factory = sqlite3.Row
+            row = con.execute("SELECT * FROM runs WHERE id = ?", (runId,)).fetchone()
+        if row is None:
+            return None
+        with np.load(os.path.join(self.path, row['arrays'])) as data:
+            arrays = {name: data[name] for name in ARRAYS}
+        result = ChargeResult(row['status'], row['type'], row['start_slot'], row['case_name'], row['obj_val'],
+                              row['solve_time'], buildTime=row['build_time'], runId=runId, **arrays)
+        result.summary = _summary(row)
+        result.telemetry = json.loads(row['telemetry'] or '{}')
+        return result
+
+    def find(self, date=None, inputHash=None, limit=100):
+        # summaries of the newest runs, optionally on one date ('YYYY-MM-DD') or for one input hash
+        where, args = [], []
+        if date is not None:
+            where.append("date = ?")
+            args.append(date)
+        if inputHash is not None:
+            where.append("input_hash = ?")
+            args.append(inputHash)
+        query = "SELECT * FROM runs"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY created DESC LIMIT ?"
+        with self._connect() as con:
+            con.row_factory = sqlite3.Row
+            rows = con.execute(query, args + [limit]).fetchall()
+        return [_summary(row) for row in rows]
+
+
+def _summary(row):
+    # a stored run with the keys results.csv used to have
+    return {
+        "run_id": row['id'],
+        "case_name": row['case_name'],
+        "numBuses": row['num_buses'],
+        "ebMaxKwh": row['eb_max_kwh'],
+        "numChargers": row['num_chargers'],
+        "chargerPower": row['charger_power'],
+        "routes": row['routes'],
+        "gridMaxPower": row['grid_max_power'],
+        "obj_val": row['obj_val'],
+        "build_time": row['build_time'],
+        "sol_time": row['solve_time'],
+        "date": row['created'],
+        "type": row['type'],
+        "input_hash": row['input_hash'],
+    }
+
+
+def _plain(value):
+    # numpy scalars to python ones for sqlite
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def run_store():
+    # the store under outputs in the data directory (see helpers.data_dir)
+    return RunStore(data_dir('outputs'))
@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import platform
+import sys
+from datetime import datetime, timedelta
+
+import gurobipy as gp
+import numpy as np
+import pandas as pd
+
+from chargeopt.benchmark import run_case
+from chargeopt.helpers import load_config
+from chargeopt.session import gurobi_params
+
+# Scaling benchmark for ChargeOpt on synthetic fleets, run headless from the repo root:
+#   python -m chargeopt.scaling --time-limit 120 --out scaling.json
+#   python -m chargeopt.scaling --save-baseline chargeopt/baselines/scaling.json
+#   python -m chargeopt.scaling --baseline chargeopt/baselines/scaling.json
+# Each sweep varies one dimension of the base case, fleets and blocks come from a fixed seed and
+# gurobi gets the same Seed and TimeLimit, so two reports on the same machine only differ by the code.
+# With --baseline, cases that got slower than the baseline by more than --tolerance (and by more than
+# --min-seconds), changed status or got a bigger model are flagged and the exit code is 1.
+
+# (buses, blocks, chargers, days) every sweep starts from
+BASE = (25, 10, 5, 3)
+SWEEPS = {
+    'buses': [5, 10, 25, 50, 100],
+    'blocks': [10, 25, 50, 100, 150],
+    'chargers': [1, 2, 5, 10],
+    'days': [1, 2, 3, 4, 5, 6, 7],
+}
+# small enough for a size-limited gurobi license with --formulation lean
+QUICK = [(1, 1, 1, 1), (1, 1, 1, 2), (1, 1, 2, 2)]
+
+# a case is identified by these, the rest of a report row is what was measured
+KEY = ['buses', 'blocks', 'chargers', 'days', 'seed']
+
+
+def scaling_cases(suite='full'):
+    # (sweep, buses, blocks, chargers, days), a case two sweeps share is only run once
+    if suite == 'quick':
+        return [('quick', *case) for case in QUICK]
+    cases = {}
+    for sweep, values in SWEEPS.items():
+        for value in values:
+            buses, blocks, chargers, days = BASE
+            if sweep == 'buses':
+                buses, blocks = value, min(value, blocks)
+            elif sweep == 'blocks':
+                # a bus runs at most one block a day, the fleet grows with the blocks
+                buses, blocks = max(buses, value), value
+            elif sweep == 'chargers':
+                chargers = value
+            else:
+                days = value
+            cases.setdefault((buses, blocks, chargers, days), sweep)
+    return [(sweep, *case) for case, sweep in cases.items()]
+
+
+def synthetic_fleet(numBuses, numBlocks, numChargers, seed=0):
+    # buses, blocks and chargers like opt_form passes them to ChargeOpt
+    # buses between 70% and 100% state of charge, blocks pull out between 4 and 10 AM, stay out
+    # 4 to 13 hours at 8 to 11 miles an hour (at most 130 miles) and are back before midnight
+    rng = np.random.default_rng(seed)
+    soc = rng.integers(70, 101, numBuses)
+    buses = pd.DataFrame({'vehicle': [str(7500 + b) for b in range(numBuses)],
+                          'soc': [f'{s}%' for s in soc],
+                          'status': ['Idle'] * numBuses})
+
+    start = rng.integers(16, 41, numBlocks)
+    end = np.minimum(start + rng.integers(16, 53, numBlocks), 95)
+    miles = np.minimum((end - start) / 4 * rng.uniform(8, 11, numBlocks), 130).round(1)
+    midnight = datetime(2000, 1, 1)
+    clock = lambda quarters: [(midnight + timedelta(minutes=15 * int(q))).strftime("%I:%M %p") for q in quarters]
+    blocks = pd.DataFrame({
+        'block_id': [f'S{r + 1}' for r in range(numBlocks)],
+        'block_startTime': clock(start),
+        'block_endTime': clock(end),
+        'Mileage': miles,
+    })
+
+    chargers = pd.DataFrame({'stationName': [f'Station {c + 1}' for c in range(numChargers)]})
+    return buses, blocks, chargers
+
+
+def run_scaling(cases, timeLimit, startTime, seed=0, formulation=None):
+    # report with one row per case, formulation overrides the one in config.yml
+    # the license the app solves with (WLS secrets or GUROBI_* variables, see session.py)
+    env = gp.Env(params=gurobi_params())
+    rows = []
+    for sweep, numBuses, numBlocks, numChargers, days in cases:
+        buses, blocks, chargers = synthetic_fleet(numBuses, numBlocks, numChargers, seed)
+        config = load_config()
+        config['horizonDays'] = days
+        if formulation is not None:
+            config['formulation'] = formulation
+        result = run_case(env, buses, blocks, chargers, config, startTime, timeLimit, seed)
+        rows.append({'sweep': sweep, 'buses': numBuses, 'blocks': numBlocks, 'chargers': numChargers,
+                     'days': days, 'seed': seed, **result})
+        print(rows[-1])
+    report = pd.DataFrame(rows)
+    report['status'] = report['status'].astype(str)
+    return report
+
+
+def compare(report, baseline, tolerance=0.25, minSeconds=0.5):
+    # report rows next to their baseline rows, with the time ratios and a regression flag
+    merged = report.merge(baseline, on=KEY, how='left', suffixes=('', '_baseline'))
+    regression = pd.Series(False, index=merged.index)
+    for column in ['build_time', 'solve_time']:
+        if column not in merged or f'{column}_baseline' not in merged:
+            continue
+        now, before = merged[column], merged[f'{column}_baseline']
+        merged[f'{column}_ratio'] = now / before
+        regression |= (now > before * (1 + tolerance)) & (now - before > minSeconds)
+    if 'numVars_baseline' in merged:
+        regression |= merged['numVars'] > merged['numVars_baseline']
+    known = merged['status_baseline'].notna()
+    regression |= known & (merged['status'] != merged['status_baseline'].astype(str))
+    merged['regression'] = regression
+    return merged
+
+
+def save_report(report, path, meta):
+    # csv, or json with the run's settings next to the rows
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if path.endswith('.csv'):
+        report.to_csv(path, index=False)
+        return
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'cases': json.loads(report.to_json(orient='records'))}, f, indent=1)
+
+
+def load_report(path):
+    if path.endswith('.csv'):
+        report = pd.read_csv(path)
+    else:
+        with open(path) as f:
+            report = pd.DataFrame(json.load(f)['cases'])
+    report['status'] = report['status'].astype(str)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling benchmark for ChargeOpt on synthetic fleets")
+    parser.add_argument('--suite', choices=['full', 'quick'], default='full')
+    parser.add_argument('--time-limit', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--formulation', choices=['full', 'lean'], default=None, help="default: config.yml")
+    parser.add_argument('--start', default='12:00 AM', help="plan start time, e.g. '08:00 PM'")
+    parser.add_argument('--out', default=None, help="optional csv or json report")
+    parser.add_argument('--baseline', default=None, help="report to compare against")
+    parser.add_argument('--save-baseline', default=None, help="also write the report here as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown, 0.25 is 25%%")
+    parser.add_argument('--min-seconds', type=float, default=0.5, help="slowdowns below this are noise")
+    args = parser.parse_args()
+
+    startTime = datetime.strptime(args.start, '%I:%M %p')
+    report = run_scaling(scaling_cases(args.suite), args.time_limit, startTime, args.seed, args.formulation)
+    meta = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'suite': args.suite,
+        'timeLimit': args.time_limit,
+        'seed': args.seed,
+        'start': args.start,
+        'formulation': args.formulation or load_config().get('formulation', 'full'),
+        'gurobi': '.'.join(map(str, gp.gurobi.version())),
+        'machine': platform.platform(),
+        'config': load_config(),
+    }
+    print(report.to_string(index=False))
+    if args.out:
+        save_report(report, args.out, meta)
+    if args.save_baseline:
+        save_report(report, args.save_baseline, meta)
+
+    if args.baseline:
+        merged = compare(report, load_report(args.baseline), args.tolerance, args.min_seconds)
+        columns = KEY + [c for c in ['status', 'status_baseline', 'build_time_ratio', 'solve_time_ratio'] if c in merged]
+        print(merged[columns + ['regression']].to_string(index=False))
+        if merged['regression'].any():
+            print(f"{merged['regression'].sum()} case(s) regressed against {args.baseline}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import time
+from dataclasses import dataclass, field, asdict
+import numpy as np
+
+from chargeopt.helpers import depot_slots
+from chargeopt.chaining import min_fleet
+
+# Pre-solve screening for ChargeOpt.
+# Necessary conditions every plan has to meet, checked in numpy on the arrays _prepare builds, so a
+# request that can't be served is turned down in milliseconds instead of going to the solver:
+#   - every block fits in the usable battery (eB_max - eB_min)
+#   - there are as many buses as blocks on the covered day (with blockChaining, as the fewest chains of
+#     blocks that cover them, see chaining.py), and as many as are out at the same time
+#   - the chargers have enough charger-hours for every bus that runs a block to charge back what its
+#     battery can't spare (at least 4 slots per session, one session per chain of blocks with blockChaining),
+#     and gridMaxPower lets that much energy through
+#   - no bus starts below eB_min once the plan is under way
+#   - in Assigned runs, dispatch's assignment gives every block exactly one known bus that can still run it
+# Blocks that can't be recharged within a day and blocks that pull in after midnight are
+# reported as warnings, the solver decides on those.
+
+
+@dataclass
+class Issue:
+    check: str
+    message: str
+    fatal: bool = True
+    # ids of the blocks or buses concerned
+    items: list = field(default_factory=list)
+
+
+@dataclass
+class Diagnosis:
+    issues: list = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def feasible(self):
+        return not any(issue.fatal for issue in self.issues)
+
+    @property
+    def status(self):
+        # the ChargeResult status of a request that was screened out
+        fatal = [issue.message for issue in self.issues if issue.fatal]
+        return fatal[0] if fatal else "All Clear"
+
+    def as_list(self):
+        return [asdict(issue) for issue in self.issues]
+
+
+def screen(opt):
+    # opt is a ChargeOpt after _prepare (and carry_over for re-plans, see rolling.py)
+    start = time.perf_counter()
+    B, T = opt.B, opt.T
+    dt = opt.dt
+    day = opt.coverDay
+    step = opt.pCB_ub * dt
+    blockIds = opt.routes.iloc[:, 0].astype(str).to_numpy()
+    busIds = opt.buses.iloc[:, 0].astype(str).to_numpy()
+    eRoute = opt.eRouteLeft[:, day]
+    tDep, tRet = opt.tDep[:, day], opt.tRet[:, day]
+    issues = []
+
+    # block energy
+    tooLong = eRoute > opt.eB_max - opt.eB_min
+    if tooLong.any():
+        issues.append(Issue('block energy', f"{tooLong.sum()} block(s) need more than the usable "
+                            f"{opt.eB_max - opt.eB_min:.0f} kWh of a battery", items=blockIds[tooLong].tolist()))
+
+    # recharge time, the check init_routes used to turn requests down with
+    recharge = ((1 / .94) * 60 * eRoute / opt.pCB_ub / 15 + 0.5).astype(int)
+    late = recharge >= tRet - tDep + 96
+    if late.any():
+        issues.append(Issue('recharge time', f"{late.sum()} block(s) can't be charged back within a day",
+                            fatal=False, items=blockIds[late].tolist()))
+
+    overnight = tDep > tRet
+    if overnight.any():
+        issues.append(Issue('overnight blocks', f"{overnight.sum()} block(s) pull in after midnight",
+                            fatal=False, items=blockIds[overnight].tolist()))
+
+    # buses against blocks, a bus runs at most one block a day unless blocks are chained
+    if opt.chaining:
+        fleet, _ = min_fleet(opt)
+        if fleet > B:
+            issues.append(Issue('fleet size', f"{opt.R} blocks need at least {fleet} buses, even run back to back, "
+                                f"but only {B} buses are selected"))
+    elif opt.R > B:
+        issues.append(Issue('fleet size', f"{opt.R} blocks need a bus but only {B} buses are selected"))
+    # blocks out at the same time, from +1/-1 events at pull out and after pull in
+    sameDay = ~overnight
+    events = np.zeros(T + 1, dtype=int)
+    np.add.at(events, tDep[sameDay], 1)
+    np.add.at(events, tRet[sameDay] + 1, -1)
+    out = np.cumsum(events)[:T]
+    if out.max(initial=0) > B:
+        peak = int(np.argmax(out))
+        busy = sameDay & (tDep <= peak) & (tRet >= peak)
+        issues.append(Issue('overlapping blocks', f"{out[peak]} blocks are out at once but only {B} buses are selected",
+                            items=blockIds[busy].tolist()))
+
+    # charging capacity over the slots a bus can be at a charger, energy lands one slot after it is charged
+    slots = depot_slots(opt.tDep, opt.tRet, T, B, opt.startTimeNum, day)
+    slots = slots[slots < T - 1]
+    # what a bus has above the SOC it has to end with pays for a block without charging (none unless a
+    # daily-linked window starts above it, see horizon.py), a block even the most of it can't pay for
+    # takes a session of at least 4 slots for what is missing
+    spare = np.maximum(opt.soc - opt.socEnd, 0) * opt.eB_max
+    missing = np.maximum(eRoute - spare.max(initial=0), 0)
+    # and all of them together what the buses can spare between them
+    energyNeeded = max(eRoute.sum() - spare.sum(), 0)
+    if opt.chaining:
+        # chained blocks share their bus's charging, so a 4 slot minimum per bus the chains need at least
+        # (when no bus can spare anything, each of them has to charge)
+        slotsNeeded = max(np.ceil(energyNeeded / step), 4 * fleet if spare.max(initial=0) == 0 else 0)
+    else:
+        charges = missing > 0
+        slotsNeeded = max(np.maximum(np.ceil(missing[charges] / step), 4).sum(), np.ceil(energyNeeded / step))
+    slotsAvailable = opt.numChargers * len(slots)
+    if slotsNeeded > slotsAvailable:
+        perDay = np.bincount(slots // 96, minlength=opt.D) * opt.numChargers * dt
+        issues.append(Issue('charger hours', f"charging the blocks back takes {slotsNeeded * dt:.0f} charger-hours, "
+                            f"{opt.numChargers} charger(s) have {slotsAvailable * dt:.0f} "
+                            f"({', '.join(f'{h:.0f}' for h in perDay)} per day)"))
+    gridEnergy = opt.gridKWH * dt * len(slots)
+    if energyNeeded > gridEnergy:
+        issues.append(Issue('grid energy', f"charging the blocks back takes {energyNeeded:.0f} kWh, "
+                            f"gridMaxPower lets {gridEnergy:.0f} kWh through"))
+
+    # starting energy, every state from now on stays above eB_min
+    low = opt.eB_max * opt.soc < opt.eB_min
+    if opt.startTimeNum > 0 and low.any():
+        issues.append(Issue('starting energy', f"{low.sum()} bus(es) start below the {opt.eB_min} kWh minimum",
+                            items=busIds[low].tolist()))
+
+    if opt.fixed is not None:
+        issues += assignment_issues(opt, blockIds, busIds)
+
+    return Diagnosis(issues, time.perf_counter() - start)
+
+
+def assignment_issues(opt, blockIds, busIds):
+    # the assignment of an Assigned run against the selected buses and blocks (see ChargeOpt.assigned)
+    issues = []
+    day = opt.coverDay
+    fixed = opt.fixed[:, day, :]
+    unknown = [f"{bus} -> {block}" for bus, block in opt.assigned.items()
+               if block and (str(bus) not in busIds or str(block) not in blockIds)]
+    if unknown:
+        issues.append(Issue('assignment', f"{len(unknown)} assignment(s) name a bus or block that isn't selected",
+                            items=unknown))
+    buses = fixed.sum(axis=0)
+    if (buses == 0).any():
+        issues.append(Issue('assignment', f"{(buses == 0).sum()} block(s) have no bus assigned",
+                            items=blockIds[buses == 0].tolist()))
+    if (buses > 1).any():
+        issues.append(Issue('assignment', f"{(buses > 1).sum()} block(s) have more than one bus assigned",
+                            items=blockIds[buses > 1].tolist()))
+
+    # what the model allows for blocks before the start time: none that already pulled in,
+    # and ones out on the road only on a bus that had the energy for them
+    bus, block = np.nonzero(fixed)
+    returned = (opt.tRet[block, day] < opt.startTimeNum) & (opt.eRouteLeft[block, day] > 0)
+    departed = (opt.tDep[block, day] < opt.startTimeNum) & \
+               (opt.eRouteLeft[block, day] > opt.eB_max * opt.soc[bus] - opt.eB_min)
+    gone = returned | departed
+    if gone.any():
+        issues.append(Issue('assignment', f"{gone.sum()} assigned block(s) already left or pulled in before the "
+                            f"start time", items=blockIds[block[gone]].tolist()))
+    return issues
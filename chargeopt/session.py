@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+import gurobipy as gp
+
+# Long-lived solver session, one per server process.
+# Keeps the gurobi Envs, so the WLS license is only acquired once per Env, and the models built so far,
+# one per model structure (fleet size, blocks and their times, start slot, chargers, config).
+# A run with the same structure only puts its data into the existing model (see
+# ChargeOpt._update_matrix): initial SOC, route energy and the tariff.
+# Gurobi Envs aren't thread-safe, so every solve running at the same time (solveSlots, see jobs.py)
+# builds and optimizes on an Env of its own from a pool, and every Env keeps its own models.
+
+
+class EnvPool:
+    # Envs with the same parameters, one per solve running at the same time
+    def __init__(self, params):
+        self.params = params
+        self.lock = threading.Lock()
+        # the first one up front, so a license that can't be had shows on the first run
+        self.free = [self._start()]
+
+    def _start(self):
+        env = gp.Env(params=self.params)
+        env.start()
+        # structure key -> {'model', 'handles'}, see SolverSession
+        return {'env': env, 'models': OrderedDict()}
+
+    @contextmanager
+    def slot(self):
+        # {'env', 'models'} only this thread uses until the with block ends, a new one when all are busy
+        with self.lock:
+            slot = self.free.pop() if self.free else None
+        if slot is None:
+            slot = self._start()
+        try:
+            yield slot
+        finally:
+            with self.lock:
+                self.free.append(slot)
+
+
+class SolverSession:
+    backend = 'gurobi'
+
+    def __init__(self, params, maxModels=4):
+        self.envs = EnvPool(params)
+        # models kept per Env
+        self.maxModels = maxModels
+
+    @contextmanager
+    def model(self, opt, config, reuse=True):
+        # (model, handles) for a ChargeOpt after _prepare, this run's until the with block ends
+        # handles are what the builder returned, reuse=False builds a model just for this run (e.g. one that gets variables fixed)
+        loop = config.get('builder', 'matrix') == 'loop'
+        with self.envs.slot() as slot:
+            if loop or not reuse:
+                m = gp.Model("Charge opt", env=slot['env'])
+                if loop:
+                    handles = opt._build_loop(m)
+                else:
+                    handles = opt._build_matrix(m)
+                try:
+                    yield m, handles
+                finally:
+                    m.dispose()
+                return
+
+            key = structure_key(opt, config)
+            models = slot['models']
+            if key not in models:
+                models[key] = {'model': None, 'handles': None}
+            models.move_to_end(key)
+            entry = models[key]
+            while len(models) > self.maxModels:
+                _, old = models.popitem(last=False)
+                if old['model'] is not None:
+                    old['model'].dispose()
+
+            if entry['model'] is None:
+                entry['model'] = gp.Model("Charge opt", env=slot['env'])
+                entry['handles'] = opt._build_matrix(entry['model'])
+            else:
+                opt._update_matrix(entry['model'], entry['handles'])
+                # drop the MIP starts of the last run
+                entry['model'].NumStart = 0
+            yield entry['model'], entry['handles']
+
+
+def structure_key(opt, config):
+    # everything that decides which variables and constraints the matrix model has
+    # (the cells of the adaptive time grid are cut where the tariff changes, see timegrid.py)
+    return (opt.B, opt.R, opt.D, opt.startTimeNum, opt.tDep.tobytes(), opt.tRet.tobytes(),
+            opt.numChargers, opt.gridKWH, opt.pCB_ub, opt.eB_max, opt.eB_min,
+            opt.gridPowPrice.tobytes() if opt.adaptive else None,
+            json.dumps(config, sort_keys=True, default=str))
+
+
+def gurobi_params():
+    # WLS license from the streamlit secrets, or from GUROBI_ACCESSID, GUROBI_SECRET and
+    # GUROBI_LICENSE in the environment when running headless; {} leaves it to a local license
+    names = {"WLSACCESSID": 'GUROBI_ACCESSID', "WLSSECRET": 'GUROBI_SECRET', "LICENSEID": 'GUROBI_LICENSE'}
+    try:
+        import streamlit as st
+        return {param: st.secrets[name] for param, name in names.items()}
+    except (ImportError, FileNotFoundError, KeyError):
+        pass
+    if all(name in os.environ for name in names.values()):
+        params = {param: os.environ[name] for param, name in names.items()}
+        params["LICENSEID"] = int(params["LICENSEID"])
+        return params
+    return {}
+
+
+# the first solves can come in on several worker threads at once, lru_cache alone would start a session for each
+SESSION_LOCK = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _solver_session():
+    return SolverSession(gurobi_params())
+
+
+def solver_session():
+    # one per process, raises gp.GurobiError if the license can't be acquired, nothing is cached then
+    with SESSION_LOCK:
+        return _solver_session()
@@ -0,0 +1,79 @@
+import itertools
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+
+from chargeopt.helpers import load_config
+from chargeopt.optimization import ChargeOpt
+
+# Scenario sweeps for capacity planning.
+# A sweep takes the inputs of one ChargeOpt run and a grid of values to try, solves every
+# combination on its own process (sweepWorkers in config.yml, each with its own solver Env)
+# under a time limit, and yields one comparison row per scenario as soon as it is done.
+# What a scenario can change:
+#   numChargers   chargers in service, the first ones of the list (extra ones are added if it's longer)
+#   gridMaxPower  kW the depot can draw
+#   chargerPower  kW per charger
+#   tariffScale   multiplies the grid prices
+#   numBuses      buses in service, the ones with the most charge first
+
+GRID_KEYS = ['numChargers', 'gridMaxPower', 'chargerPower', 'tariffScale', 'numBuses']
+
+
+def scenarios(grid):
+    # every combination of the grid's values, {key: [values]} -> [{key: value}]
+    keys = [key for key in GRID_KEYS if grid.get(key)]
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def apply_scenario(buses, blocks, chargers, scenario):
+    # the inputs and config overrides of one scenario
+    if 'numBuses' in scenario:
+        soc = buses.iloc[:, 1].astype(str).str.replace('%', '').astype(float)
+        buses = buses.loc[soc.sort_values(ascending=False, kind='stable').index[:scenario['numBuses']]]
+    if 'numChargers' in scenario:
+        n = scenario['numChargers']
+        extra = pd.DataFrame({chargers.columns[0]: [f'Extra {c + 1}' for c in range(max(n - len(chargers), 0))]})
+        chargers = pd.concat([chargers.iloc[:n, :1], extra], ignore_index=True)
+    overrides = {key: scenario[key] for key in ['gridMaxPower', 'chargerPower', 'tariffScale'] if key in scenario}
+    return buses, blocks, chargers, overrides
+
+
+def run_sweep(buses, blocks, chargers, grid, startTime=None, runType='Optimal', timeLimit=60, workers=None):
+    # yields a row per scenario in the order they finish
+    workers = workers or load_config().get('sweepWorkers', 2)
+    tasks = [(buses, blocks, chargers, scenario, startTime, runType, timeLimit) for scenario in scenarios(grid)]
+    # fresh processes, a forked one would share the parent's gurobi Env
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        futures = {pool.submit(run_scenario, task): task[3] for task in tasks}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                yield {**futures[future], 'status': f"{type(e).__name__}: {e}", 'feasible': False}
+    finally:
+        # a sweep that is stopped early (e.g. the page reruns) drops the scenarios not started yet
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_scenario(task):
+    # solves one scenario, runs on a worker process
+    buses, blocks, chargers, scenario, startTime, runType, timeLimit = task
+    buses, blocks, chargers, overrides = apply_scenario(buses, blocks, chargers, scenario)
+    opt = ChargeOpt(buses, blocks.copy(), chargers)
+    if startTime is not None:
+        opt.startTime = startTime
+    # scenarios are hypothetical, they stay out of the run history, the solution cache and the exports
+    opt.record = False
+    opt.overrides = {**overrides, 'timeLimit': timeLimit, 'cache': False, 'exportFormat': 'none'}
+
+    start = time.perf_counter()
+    result = opt.solve(runType)
+    row = {**scenario, 'status': result.status, 'feasible': result.solved, 'cost': result.objVal,
+           'peakPower': None, 'seconds': time.perf_counter() - start}
+    if result.solved:
+        row['peakPower'] = float(np.max(result.powerCB[:, result.startTimeNum:].sum(axis=0), initial=0))
+    return row
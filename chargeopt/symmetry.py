@@ -0,0 +1,86 @@
+import numpy as np
+import gurobipy as gp
+
+# Symmetry breaking for interchangeable buses.
+# All buses share ebMaxKwh, the chargers and the depot slots, so two buses that start (and have to
+# end, see ChargeOpt.endSoc) with the same state of charge and status are interchangeable: swapping their blocks and charging gives another
+# plan of the same cost, and branch-and-bound would otherwise explore every such mirror.
+# Within a class of interchangeable buses, consecutive buses b, b' are ordered
+#   - by the block they run on the covered day: sum of (r + 1) * assignment[b, coverDay, r] >= the same for b'
+#   - when one of them runs no block, by how long they charge: sum of chargerUse[b'] <= sum of chargerUse[b]
+# Any plan can be put in that order by swapping buses within a class, so no cost is lost. The
+# coefficients are kept small, ordering buses lexicographically over all their variables takes
+# big ones and made the solves slower instead.
+# Re-plans (variables fixed per bus) and Assigned runs (assignment given) aren't symmetric and skip it.
+
+
+def bus_classes(opt):
+    # lists of bus indices (at least two) that are interchangeable, for a ChargeOpt after _prepare
+    status = opt.buses.iloc[:, 2].astype(str).to_numpy() if opt.buses.shape[1] > 2 else np.full(opt.B, '')
+    keys = {}
+    for b in range(opt.B):
+        keys.setdefault((round(float(opt.soc[b]), 6), round(float(opt.socEnd[b]), 6), status[b]), []).append(b)
+    return [buses for buses in keys.values() if len(buses) > 1]
+
+
+def add_symmetry_breaking(opt, m, handles, classes=None):
+    # the ordering constraints for consecutive buses of each class, returned so a model that is
+    # reused for other data can drop them again
+    classes = bus_classes(opt) if classes is None else classes
+    if not classes:
+        return []
+    day, R = opt.coverDay, opt.R
+    blockWeight = np.arange(1, R + 1, dtype=float)
+    assignment, chargerUse = handles['assignment'], handles['chargerUse']
+
+    if 'slots' in handles:
+        # matrix builder, charging counted in slots (a cell of the adaptive grid is several, see timegrid.py)
+        width = handles['width']
+        slots = width.sum()
+
+        def weight(b):
+            return blockWeight @ assignment[b, day]
+
+        def runs(b):
+            return assignment[b, day].sum()
+
+        def charged(b):
+            return width @ chargerUse[b]
+    else:
+        slots = opt.T
+
+        def weight(b):
+            return gp.quicksum(blockWeight[r] * assignment[b, day, r] for r in range(R))
+
+        def runs(b):
+            return assignment.sum(b, day, '*')
+
+        def charged(b):
+            return chargerUse.sum(b, '*')
+
+    constrs = []
+    for buses in classes:
+        for b, nxt in zip(buses[:-1], buses[1:]):
+            constrs.append(m.addConstr(weight(b) >= weight(nxt), name=f"symmetry block[{b},{nxt}]"))
+            constrs.append(m.addConstr(charged(nxt) - charged(b) <= slots * (runs(b) + runs(nxt)),
+                                       name=f"symmetry charging[{b},{nxt}]"))
+    return constrs
+
+
+def order_plan(opt, plan, classes=None):
+    # the plan with the buses of each class swapped into the order add_symmetry_breaking asks for,
+    # so it still works as a MIP start
+    classes = bus_classes(opt) if classes is None else classes
+    if not classes:
+        return plan
+    weight = plan['assignment'][:, opt.coverDay, :] @ np.arange(1, opt.R + 1, dtype=float)
+    charged = plan['chargerUse'].sum(axis=1)
+
+    order = np.arange(opt.B)
+    for buses in classes:
+        buses = np.asarray(buses)
+        order[buses] = buses[np.lexsort((-charged[buses], -weight[buses]))]
+    ordered = dict(plan)
+    for name in ['assignment', 'chargerUse', 'powerCB', 'eB']:
+        ordered[name] = plan[name][order]
+    return ordered
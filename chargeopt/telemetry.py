@@ -0,0 +1,71 @@
+import time
+import gurobipy as gp
+
+# Where the time of a ChargeOpt run goes.
+# Phases are wall-clock seconds between laps: solve laps config load, init_routes, the plan and the
+# solve itself, the model builders lap variable creation and every constraint family. A model reused
+# from the solver session (see session.py) has a data update instead of the build phases.
+# The gurobi callback keeps a trace of the incumbent and the bound, and when branch-and-bound took over
+# from presolve and the root relaxation.
+# Kept on the ChargeResult and in the run store (see runs.py), shown under the results.
+
+
+class Telemetry:
+    def __init__(self):
+        self.phases = {}
+        self.counts = {}
+        # (seconds into optimize, incumbent, best bound), one point per change
+        self.trace = []
+        self.presolve = None
+        self._last = time.perf_counter()
+
+    def mark(self):
+        # starts the next phase now, what happened since the last lap isn't counted
+        self._last = time.perf_counter()
+
+    def lap(self, name):
+        # adds the time since the last lap or mark to phase name
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + now - self._last
+        self._last = now
+
+    def model_counts(self, m):
+        # size of the model about to be solved
+        m.update()
+        self.counts.update({
+            'variables': m.NumVars,
+            'binaries': m.NumBinVars,
+            'constraints': m.NumConstrs,
+            'nonzeros': m.NumNZs,
+        })
+
+    def solve_counts(self, m):
+        # what the solve took, after optimize
+        self.counts.update({
+            'nodes': int(m.NodeCount),
+            'simplexIterations': int(m.IterCount),
+            'solutions': m.SolCount,
+        })
+        # optimize split where the first branch-and-bound node was seen, all of it if there was none
+        root = m.Runtime if self.presolve is None else min(self.presolve, m.Runtime)
+        self.phases['presolve and root'] = root
+        self.phases['branch and bound'] = m.Runtime - root
+
+    def callback(self, then=None):
+        # gurobi callback recording the trace, then calls then (e.g. the job's callback)
+        def record(model, where):
+            if where == gp.GRB.Callback.MIP:
+                runtime = model.cbGet(gp.GRB.Callback.RUNTIME)
+                incumbent = model.cbGet(gp.GRB.Callback.MIP_OBJBST)
+                incumbent = incumbent if incumbent < gp.GRB.INFINITY else None
+                bound = model.cbGet(gp.GRB.Callback.MIP_OBJBND)
+                if model.cbGet(gp.GRB.Callback.MIP_NODCNT) > 0 and self.presolve is None:
+                    self.presolve = runtime
+                if not self.trace or self.trace[-1][1:] != (incumbent, bound):
+                    self.trace.append((runtime, incumbent, bound))
+            if then is not None:
+                then(model, where)
+        return record
+
+    def as_dict(self):
+        return {'phases': self.phases, 'counts': self.counts, 'trace': self.trace}
@@ -0,0 +1,99 @@
+import numpy as np
+import scipy.sparse as sp
+
+from chargeopt.helpers import route_event_matrix
+
+# Time grid of the matrix model (timeGrid in config.yml).
+# fixed: every 15 minute slot from the start time on is a cell of its own.
+# adaptive: consecutive slots are merged into one cell of up to coarseSlots slots where nothing can
+# change, i.e. cells are cut
+#   - at every pull out and pull in of a block (any day), and FINE slots either side of them
+#   - where the tariff changes, and FINE slots either side
+#   - at midnight (charging is counted per day), at the start time and at the last slot
+#   - where the slots the buses can be at a charger (helpers.depot_slots) start or stop
+# A cell charges at one power for its whole width, so the energy balance adds width * dt * powerCB;
+# the energy states are the first slots of the cells. Long flat off-peak stretches (overnight, midday)
+# become a handful of cells, the slots around departures and returns keep their 15 minutes.
+# The solution is put back onto the 15 minute grid for display and export (see expand).
+
+# slots either side of an event that stay 15 minutes
+FINE = 2
+
+
+def time_grid(opt, slots, adaptive=False, coarseSlots=8):
+    # (cells, width, states) for a ChargeOpt after _prepare and its depot slots
+    #   cells: first slot of every cell a bus can charge in, width: their length in slots
+    #   states: first slot of every cell from the start time on, where the model keeps the battery energy
+    T, start = opt.T, opt.startTimeNum
+    if not adaptive:
+        return slots, np.ones(len(slots), dtype=int), np.arange(start, T)
+
+    cut = np.zeros(T + 1, dtype=bool)
+    cut[[start, T - 1, T]] = True
+    cut[np.arange(0, T, 96)] = True
+    events = np.concatenate([opt.tDep.ravel(), opt.tRet.ravel() + 1,
+                             np.flatnonzero(np.diff(opt.gridPowPrice)) + 1])
+    for offset in range(-FINE, FINE + 1):
+        cut[np.clip(events + offset, 0, T)] = True
+    depot = np.zeros(T + 1, dtype=bool)
+    depot[slots] = True
+    cut[1:] |= depot[1:] != depot[:-1]
+
+    # stretches between cuts, split into cells of at most coarseSlots
+    bounds = np.flatnonzero(cut[start:]) + start
+    first = []
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        first.extend(range(a, b, coarseSlots))
+    states = np.array(first, dtype=int)
+    width = np.diff(np.append(states, T))
+    charging = depot[states]
+    return states[charging], width[charging], states
+
+
+def balance_matrices(states, cells, width, startTimeNum, T):
+    # the energy balance between consecutive states, one row per state:
+    #   rows: the states, fromPrev: whether the row carries the state before it (the first starts from the SOC)
+    #   carried (rows, states): the state before, chargedIn (rows, cells): width of the cell whose energy
+    #   lands in the row, collect (rows, T): the slots whose route events land in the row
+    rows = states
+    fromPrev = rows > startTimeNum
+    position = np.searchsorted(states, rows)
+    Te = len(states)
+    carried = sp.csr_matrix((np.ones(fromPrev.sum()), (np.flatnonzero(fromPrev), position[fromPrev] - 1)),
+                            shape=(len(rows), Te))
+    # energy charged in a cell lands at the state after it, nothing lands after the last slot
+    landing = np.searchsorted(rows, cells + width)
+    landing[cells + width >= T] = len(rows)
+    chargedIn = sp.csr_matrix((width.astype(float), (landing, np.arange(len(cells)))),
+                              shape=(len(rows) + 1, len(cells)))[:-1]
+    # route events of the slots after the state before, up to and including the row's own slot
+    previous = np.where(fromPrev, states[np.maximum(position - 1, 0)] + 1, rows)
+    length = rows - previous + 1
+    collect = sp.csr_matrix((np.ones(length.sum()),
+                             (np.repeat(np.arange(len(rows)), length),
+                              np.concatenate([np.arange(a, b + 1) for a, b in zip(previous, rows)]))),
+                            shape=(len(rows), T))
+    return rows, fromPrev, carried, chargedIn, collect
+
+
+def expand(opt, cells, width, states, powerCB, chargerUse, eStates, assignment):
+    # the plan of an adaptive grid on the 15 minute grid: a cell's power and charger use on each of
+    # its slots, and the energy of every slot from the state before it plus what was charged and
+    # taken out since
+    B, T = opt.B, opt.T
+    slot = np.repeat(cells, width) + np.concatenate([np.arange(w) for w in width])
+    power = np.zeros((B, T))
+    use = np.zeros((B, T))
+    power[:, slot] = np.repeat(powerCB, width, axis=1)
+    use[:, slot] = np.repeat(chargerUse, width, axis=1)
+
+    depletion = (route_event_matrix(opt.tRet, opt.eRouteLeft, T) @ assignment.reshape(B, -1).T).T
+    change = np.zeros((B, T))
+    change[:, 1:] = power[:, :-1] * opt.dt
+    change -= depletion
+    total = np.cumsum(change, axis=1)
+    eB = np.repeat(opt.eB_max * opt.soc[:, None], T, axis=1)
+    since = np.arange(opt.startTimeNum, T)
+    state = states[np.searchsorted(states, since, side='right') - 1]
+    eB[:, since] = eStates[:, np.searchsorted(states, state)] + total[:, since] - total[:, state]
+    return power, use, eB
@@ -0,0 +1,241 @@
+import argparse
+import glob
+import itertools
+import json
+import os
+import platform
+import re
+from datetime import datetime
+from functools import lru_cache
+
+import gurobipy as gp
+import numpy as np
+import pandas as pd
+
+from chargeopt.helpers import PACKAGE_DIR, data_dir
+from chargeopt.session import gurobi_params
+
+# Gurobi parameter tuning for the ChargeOpt model.
+# The corpus is a directory of dumps (see replay.py): recordCorpus in config.yml dumps every
+# Optimal solve of the dashboard into corpus in the data directory (see helpers.data_dir), one per
+# distinct input, and python -m chargeopt solve --dump DIR adds instances by hand. The harness solves every instance
+# with every candidate parameter set (the grid below, and with --tool what gurobi's tuning tool
+# suggests for each instance) and reports the median and p95 solve time of each set against
+# gurobi's defaults:
+#   python -m chargeopt.tuning --time-limit 120 --seeds 2 --out tuning.csv
+#   python -m chargeopt.tuning --tool --write
+# --write saves the best set as the next version in chargeopt/params (gurobi-v<N>.json), which
+# ChargeOpt loads once per process (gurobiParams in config.yml: latest, a file name, or empty).
+# MIPGap and TimeLimit stay with ChargeOpt.solve, so tuned sets only change how the MIP is searched.
+
+PARAMS_DIR = os.path.join(PACKAGE_DIR, 'params')
+
+# candidate values, every combination is a parameter set (a value of None keeps the default)
+GRID = {
+    'MIPFocus': [None, 1, 2],
+    'Heuristics': [None, 0.2],
+    'Cuts': [None, 2],
+    'Presolve': [None, 2],
+    # --threads adds thread counts to try, e.g. for the processes of a scenario sweep
+    'Threads': [None],
+}
+# parameters the harness leaves to ChargeOpt.solve
+KEEP = ['MIPGap', 'TimeLimit', 'OutputFlag', 'LogToConsole', 'LogFile', 'Seed']
+
+
+def corpus(path):
+    # instance directories under path, the ones with a model.mps
+    return sorted(os.path.dirname(model) for model in glob.glob(os.path.join(path, '**', 'model.mps'), recursive=True))
+
+
+def parameter_sets(grid=None):
+    # {name: {param: value}} for every combination of the grid, 'default' is gurobi's defaults
+    grid = GRID if grid is None else grid
+    sets = {}
+    for values in itertools.product(*grid.values()):
+        params = {param: value for param, value in zip(grid, values) if value is not None}
+        name = ','.join(f'{param}={value}' for param, value in params.items()) or 'default'
+        sets[name] = params
+    return sets
+
+
+def solve_instance(env, path, params, timeLimit, seed=0):
+    # solves the dumped model of path with params on top of its own parameters and MIP starts
+    m = gp.read(os.path.join(path, 'model.mps'), env)
+    try:
+        m.read(os.path.join(path, 'params.prm'))
+        if os.path.exists(os.path.join(path, 'start.mst')):
+            m.read(os.path.join(path, 'start.mst'))
+        for name, value in params.items():
+            m.setParam(name, value)
+        m.setParam('TimeLimit', timeLimit)
+        m.setParam('Seed', seed)
+        m.optimize()
+        return {
+            'status': m.Status,
+            'solve_time': m.Runtime,
+            'obj_val': m.ObjVal if m.SolCount > 0 else None,
+            'gap': m.MIPGap if m.SolCount > 0 else None,
+            'nodes': m.NodeCount,
+        }
+    except gp.GurobiError as e:
+        return {'status': f'solver error: {e}'}
+    finally:
+        m.dispose()
+
+
+def tool_sets(env, instances, timeLimit):
+    # parameter sets gurobi's tuning tool finds, one tuning run per instance
+    sets = {}
+    for path in instances:
+        m = gp.read(os.path.join(path, 'model.mps'), env)
+        try:
+            m.read(os.path.join(path, 'params.prm'))
+            m.setParam('TuneTimeLimit', timeLimit)
+            m.setParam('TuneResults', 1)
+            m.tune()
+            for i in range(m.TuneResultCount):
+                m.getTuneResult(i)
+                params = changed_params(m)
+                if params:
+                    name = 'tool:' + ','.join(f'{param}={value}' for param, value in params.items())
+                    sets[name] = params
+        except gp.GurobiError as e:
+            print(f"tuning {path} failed: {e}")
+        finally:
+            m.dispose()
+    return sets
+
+
+def changed_params(m):
+    # the parameters of m that aren't at their defaults, apart from the ones ChargeOpt sets itself
+    params = {}
+    for name in dir(gp.GRB.Param):
+        if name.startswith('_') or name.startswith('Tune') or name in KEEP:
+            continue
+        try:
+            _, _, value, _, _, default = m.getParamInfo(name)
+        except gp.GurobiError:
+            continue
+        if isinstance(value, (int, float)) and value != default:
+            params[name] = value
+    return params
+
+
+def run_corpus(env, instances, sets, timeLimit, seeds=1):
+    # one row per instance, parameter set and seed
+    rows = []
+    for path in instances:
+        for name, params in sets.items():
+            for seed in range(seeds):
+                rows.append({'instance': os.path.basename(path), 'set': name, 'seed': seed,
+                             **solve_instance(env, path, params, timeLimit, seed)})
+                print(rows[-1])
+    return pd.DataFrame(rows)
+
+
+def summarize(runs, timeLimit):
+    # median and p95 solve time of every set and their improvement over the defaults,
+    # a run that didn't finish counts as the full time limit
+    runs = runs.copy()
+    if 'solve_time' not in runs:
+        runs['solve_time'] = np.nan
+    finished = runs['status'] == gp.GRB.OPTIMAL
+    runs['time'] = runs['solve_time'].where(finished, timeLimit).fillna(timeLimit)
+    # the mean over seeds per instance first, so every instance counts the same
+    times = runs.groupby(['set', 'instance'])['time'].mean().unstack('instance')
+    summary = pd.DataFrame({
+        'median': times.median(axis=1),
+        'p95': times.quantile(0.95, axis=1),
+        'solved': runs.assign(solved=finished).groupby('set')['solved'].mean(),
+    })
+    if 'default' in summary.index:
+        # per instance, how much faster than the defaults
+        speedup = 1 - times / times.loc['default']
+        summary['median_improvement'] = 1 - summary['median'] / summary.loc['default', 'median']
+        summary['p95_improvement'] = 1 - summary['p95'] / summary.loc['default', 'p95']
+        summary['instances_faster'] = (speedup > 0).mean(axis=1)
+    return summary.sort_values(['solved', 'p95', 'median'], ascending=[False, True, True])
+
+
+def next_version(directory=PARAMS_DIR):
+    versions = [int(v) for v in re.findall(r'gurobi-v(\d+)\.json', ' '.join(os.listdir(directory)))] \
+        if os.path.isdir(directory) else []
+    return max(versions, default=0) + 1
+
+
+def write_params(params, summary, meta, directory=PARAMS_DIR):
+    # saves params as the next version, returns its path
+    os.makedirs(directory, exist_ok=True)
+    version = next_version(directory)
+    path = os.path.join(directory, f'gurobi-v{version}.json')
+    with open(path, 'w') as f:
+        json.dump({'version': version, **meta, 'params': params,
+                   'summary': json.loads(summary.to_json(orient='index'))}, f, indent=1)
+    return path
+
+
+@lru_cache(maxsize=None)
+def tuned_params(name='latest', directory=PARAMS_DIR):
+    # the parameter set ChargeOpt solves with, read once per process: the newest version with 'latest',
+    # a file in chargeopt/params by name, {} when name is empty or there is no file yet
+    if not name:
+        return {}
+    if name == 'latest':
+        version = next_version(directory) - 1
+        if version == 0:
+            return {}
+        name = f'gurobi-v{version}.json'
+    with open(os.path.join(directory, name)) as f:
+        return json.load(f)['params']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune gurobi parameters on a corpus of recorded ChargeOpt instances")
+    parser.add_argument('--corpus', default=None, help="default: corpus in the data directory (see recordCorpus in config.yml)")
+    parser.add_argument('--time-limit', type=float, default=120, help="seconds per solve")
+    parser.add_argument('--seeds', type=int, default=1, help="solves per instance and set, with different seeds")
+    parser.add_argument('--tool', action='store_true', help="also try the sets gurobi's tuning tool finds")
+    parser.add_argument('--tune-time', type=float, default=600, help="seconds of tuning per instance with --tool")
+    parser.add_argument('--no-grid', action='store_true', help="only the defaults and the tool's sets")
+    parser.add_argument('--threads', default='', help="thread counts to add to the grid, e.g. 1,2,4")
+    parser.add_argument('--out', default=None, help="optional csv of every solve")
+    parser.add_argument('--write', action='store_true', help="save the best set as the next chargeopt/params version")
+    args = parser.parse_args()
+
+    instances = corpus(args.corpus or data_dir('corpus'))
+    if not instances:
+        print("no instances in the corpus, turn on recordCorpus or use python -m chargeopt solve --dump")
+        return
+    env = gp.Env(params={**gurobi_params(), 'OutputFlag': 0})
+
+    grid = dict(GRID)
+    grid['Threads'] = grid['Threads'] + [int(t) for t in args.threads.split(',') if t]
+    sets = {'default': {}} if args.no_grid else parameter_sets(grid)
+    if args.tool:
+        sets.update(tool_sets(env, instances, args.tune_time))
+    runs = run_corpus(env, instances, sets, args.time_limit, args.seeds)
+    if args.out:
+        runs.to_csv(args.out, index=False)
+    summary = summarize(runs, args.time_limit)
+    print(summary.to_string())
+
+    best = summary.index[0]
+    if args.write:
+        if best == 'default':
+            print("the defaults are still the best, nothing written")
+            return
+        meta = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'set': best,
+            'instances': len(instances),
+            'timeLimit': args.time_limit,
+            'seeds': args.seeds,
+            'gurobi': '.'.join(map(str, gp.gurobi.version())),
+            'machine': platform.platform(),
+        }
+        print(f"wrote {write_params(sets[best], summary, meta)}")
+
+
+if __name__ == "__main__":
+    main()
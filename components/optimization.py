@@ -5,7 +5,12 @@ from calls.supa_select import supabase_blocks
 from calls.chargepoint import chargepoint_stations
 import data
 import pandas as pd
+from chargeopt.helpers import load_config
 from chargeopt.optimization import ChargeOpt
+from chargeopt.jobs import start_job, get_job
+from chargeopt.result import ChargeResult
+from chargeopt.runs import run_store
+from components.scenarios import scenario_sweep
 import os
 import plotly.graph_objects as go
 
@@ -13,7 +18,7 @@ import altair as alt
 import numpy as np
 def opt_form():
 
-    keys = ['buses', 'blocks', 'chargers', 'results', 'startTimeNum']
+    keys = ['buses', 'blocks', 'chargers', 'results', 'plan', 'job']
     for key in keys:
         if key not in st.session_state:
             st.session_state[key] = None
@@ -132,22 +137,36 @@ def opt_form():
                                                 )},
                                             column_order=['Select', 'stationName', 'networkStatus'])
 
+        # Heuristic skips the solver and uses the greedy plan from chargeopt/heuristic.py,
+        # Decomposed prices bus/block pairs and solves the assignment (chargeopt/decomposition.py),
+        # Assigned takes the assignment from dispatch below and only plans the charging
+        run_type = st.radio("Route Assignment", options=['Optimal', 'Decomposed', 'Heuristic', 'Assigned'],
+                            horizontal=True)
+
+        # seconds the solve may take, it then ends with the best plan found so far (0 for no limit)
+        time_budget = st.number_input("Time Budget (s)", min_value=0, value=int(load_config().get('timeLimit') or 0),
+                                      help="The best plan found so far is shown while the solver runs")
+
+        with st.expander("Provide Assignments"):
+            st.caption("The block each bus runs tomorrow, used when Route Assignment is Assigned.")
+            assignments_df = pd.DataFrame({'vehicle': edited_buses_df['vehicle'].astype(str), 'block_id': None})
+            edited_assignments_df = st.data_editor(assignments_df, hide_index=True, use_container_width=True,
+                                                   column_config={
+                                                       "vehicle": st.column_config.TextColumn("Bus", disabled=True),
+                                                       "block_id": st.column_config.SelectboxColumn(
+                                                           "Block", options=blocks['block_id'].tolist())},
+                                                   key="assignments")
+
+        # re-plan keeps what the last plan already committed to (past charging, blocks out on the road)
+        # and solves the rest again from the latest state of charge, starting from the last plan
+        replan = st.checkbox("Re-plan from the last plan", value=False,
+                             disabled=st.session_state['plan'] is None)
+
         submit = st.form_submit_button("Submit")
 
 
 
-        
-    # with options:
-    #     # st.info("Route Assignment Options Coming Soon")
-    #     # run_type = st.radio("Route Assignment", options=['Heuristic', 'Optimal'])
-    #     st.info("Optimization Options Coming Soon")
-        # if run_type == 'Provide Assignments':
-        #     st.dataframe(pd.DataFrame({'bus': [1, 2, 3, 4, 5], 'day': [1, 1, 1, 1, 1], 'route': [np.nan, np.nan, np.nan, np.nan, np.nan]}))
-        #     st.info("Not legit for now, need to add dataframe editor")
-        # elif run_type == 'Heuristic':
-        #     st.info("Heuristic Coming Soon")
-            
-            
+
         # display current config options from chargeopt/config.yml
 
         if submit: 
@@ -170,56 +189,152 @@ def opt_form():
             selected_blocks['block_id'] = selected_blocks['block_id'].astype(str)
             selected_chargers = selected_chargers[['stationName']]
 
-            opt = ChargeOpt(selected_buses, selected_blocks, selected_chargers)
-
-            results, startTimeNum = opt.solve()
+            previous = None
+            if replan:
+                previous = st.session_state['plan']
+                # latest state of charge for the selected buses
+                latest_df = get_overview_df()[4].dropna(subset=['soc'])
+                latest = latest_df.set_index('vehicle')['soc'].astype(int).astype(str) + '%'
+                selected_buses['soc'] = selected_buses['vehicle'].map(latest).fillna(selected_buses['soc'])
 
-            st.toast("Complete")
-            st.toast(results)
-            
-            # save results, selected buses, blocks, and chargers to session state
-            st.session_state['results'] = results
-            st.session_state['startTimeNum'] = startTimeNum
+            opt = ChargeOpt(selected_buses, selected_blocks, selected_chargers)
+            opt.overrides['timeLimit'] = time_budget or None
+            if run_type == 'Assigned':
+                assigned = edited_assignments_df.dropna(subset=['block_id'])
+                assigned = assigned[assigned['vehicle'].isin(selected_buses['vehicle'].astype(str))]
+                opt.assigned = dict(zip(assigned['vehicle'], assigned['block_id'].astype(str)))
+
+            # solve in the background, the session only keeps the job id
+            # (the url has it too, so a refresh picks the job up again)
+            job = start_job(opt, run_type, previous)
+            st.session_state['job'] = job.id
+            st.query_params['job'] = job.id
+
+            # save selected buses, blocks, and chargers to session state, results come with the job
+            st.session_state['results'] = None
             st.session_state['buses'] = selected_buses
             st.session_state['blocks'] = selected_blocks
             st.session_state['chargers'] = selected_chargers
 
-
-
-
+    job_id = st.session_state['job'] or st.query_params.get('job')
+    if job_id is not None:
+        show_progress(job_id)
 
     # get df's from session state
     results = st.session_state['results']
-    startTimeNum = st.session_state['startTimeNum']
     selected_buses = st.session_state['buses']
     selected_blocks = st.session_state['blocks']
     selected_chargers = st.session_state['chargers']
 
-    show_results(selected_buses, selected_blocks, selected_chargers, results, startTimeNum)
+    show_results(selected_buses, selected_blocks, selected_chargers, results)
 
-def show_results(selected_buses, selected_blocks, selected_chargers, results, startTimeNum):
+    # what-if runs on the same inputs
+    scenario_sweep(selected_buses, selected_blocks, selected_chargers)
+
+@st.fragment(run_every=1)
+def show_progress(job_id):
+    # progress of a background solve, reruns on its own every second until the job is done
+    job = get_job(job_id)
+    if job is None or job.done:
+        st.session_state['job'] = None
+        st.query_params.pop('job', None)
+    if job is None:
+        return
+
+    if job.done:
+        # hand the results to the rest of the tab
+        if job.error is not None:
+            results = ChargeResult('Solve failed', job.runType)
+            st.toast(job.error)
+        else:
+            results = job.result
+        for message in job.messages:
+            if message != results.status:
+                st.toast(message)
+        st.toast(results.status)
+
+        # solved runs are fetched back from the run store by the id the run was recorded under
+        st.session_state['results'] = results.runId if results.runId is not None else results
+        st.session_state['buses'], st.session_state['blocks'], st.session_state['chargers'] = job.inputs
+        if job.opt.plan is not None:
+            st.session_state['plan'] = job.opt.plan
+        st.rerun()
+
+    if job.started is None:
+        st.write(f"### {job.runType} solve queued")
+        cols = st.columns(2)
+        cols[0].metric("Queue Position", job.position)
+        cols[1].metric("Waiting", f"{job.waited:.0f} s")
+    else:
+        st.write(f"### {job.runType} solve running")
+        cols = st.columns(4)
+        cols[0].metric("Elapsed", f"{job.elapsed:.0f} s")
+        cols[1].metric("Incumbent", "-" if job.incumbent is None else f"${job.incumbent:.2f}")
+        cols[2].metric("Best Bound", "-" if job.bound is None else f"${job.bound:.2f}")
+        cols[3].metric("Gap", "-" if job.gap is None else f"{job.gap:.1%}")
+    if job.waiters > 1:
+        st.caption(f"Shared with {job.waiters - 1} other identical request(s)")
+    # e.g. a fallback to HiGHS or what screening found
+    for message in list(job.messages):
+        st.info(message)
+
+    # stop waiting for the job, the solve itself stops once nobody else waits for it either
+    cols = st.columns(2)
+    if cols[0].button("Cancel"):
+        job.cancel()
+        st.session_state['job'] = None
+        st.query_params.pop('job', None)
+        st.session_state['results'] = ChargeResult('Solve cancelled', job.runType)
+        st.rerun()
+    latest = job.latest
+    if latest is not None and cols[1].button("Use Best Plan So Far"):
+        job.cancel()
+        st.session_state['job'] = None
+        st.query_params.pop('job', None)
+        st.session_state['results'] = latest
+        st.session_state['buses'], st.session_state['blocks'], st.session_state['chargers'] = job.inputs
+        st.rerun()
+
+    # the best plan so far, replaced as the solver finds better ones
+    if latest is not None:
+        st.caption(f"Best plan so far, found {latest.solTime:.0f} s into the solve")
+        show_results(*job.inputs, latest, show_inputs=False)
+
+
+def show_results(selected_buses, selected_blocks, selected_chargers, results, show_inputs=True):
+    # results is the ChargeResult of the last run (chargeopt/result.py) or its run id (chargeopt/runs.py),
+    # None before the first one
     if selected_blocks is None or selected_chargers is None or selected_buses is None: 
         return
     else:
-        with st.expander("Input Data", expanded=True):
-            col1, col2, col3 = st.columns(3)
+        if show_inputs:
+            with st.expander("Input Data", expanded=True):
+                col1, col2, col3 = st.columns(3)
 
-            col1.write("Buses:")
-            col1.dataframe(selected_buses, hide_index=True, use_container_width=True)
+                col1.write("Buses:")
+                col1.dataframe(selected_buses, hide_index=True, use_container_width=True)
             
-            col2.write("Blocks:")
+                col2.write("Blocks:")
             
-            col2.dataframe(selected_blocks, hide_index=True, use_container_width=True)
-
-            col3.write("Chargers:")
-            col3.dataframe(selected_chargers, hide_index=True, use_container_width=True)
-
-        if results == 'Model is infeasible':
-            st.warning(results)
-        elif results == 'Optimal solution found':
+                col2.dataframe(selected_blocks, hide_index=True, use_container_width=True)
+
+                col3.write("Chargers:")
+                col3.dataframe(selected_chargers, hide_index=True, use_container_width=True)
+
+        if isinstance(results, str):
+            results = run_store().load(results)
+        if results is None:
+            return
+        elif not results.solved:
+            # screened out requests say why in their diagnosis
+            if results.diagnosis:
+                show_diagnosis(results.diagnosis)
+            else:
+                st.warning(results.status)
+        else:
             # st.write(results)
 
-            results_df = pd.read_csv(os.path.join(os.getcwd(), 'chargeopt', 'outputs', 'results.csv')).iloc[-1]
+            results_df = pd.Series(results.summary)
             results_df.dropna(inplace=True)
             #  results_df  
             #     {
@@ -238,8 +353,11 @@ def show_results(selected_buses, selected_blocks, selected_chargers, results, st
             #     },
             with st.expander("Results and Input Details"): 
                 st.dataframe(results_df, use_container_width=True)
-            cost = results_df['obj_val']
-            cost = float(cost)
+            show_diagnosis(results.diagnosis)
+            if results.telemetry:
+                with st.expander("Solver Telemetry"):
+                    show_telemetry(results.telemetry)
+            cost = float(results.objVal)
             st.metric("Cost", f"${cost:.2f}")
             # visualize in altair
 
@@ -255,13 +373,9 @@ def show_results(selected_buses, selected_blocks, selected_chargers, results, st
             # path = os.path.join(os.getcwd(), "chargeopt", "outputs")
             # twodim_df.to_csv(f'{path}/{filename}.csv')
             # visualize in altair
-            # Getting the path to the csv files
-            path = os.path.join(os.getcwd(), "chargeopt", "outputs")
-
-            filename = results_df["case_name"]
 
             # visualize assignments: 'bus', 'day', 'route'
-            assignment_df = pd.read_csv(f'{path}/assignments_{filename}.csv')
+            assignment_df = results.assignment_df()
 
             # map bus to bus number using edited buses_df
             # reset index
@@ -304,8 +418,8 @@ def show_results(selected_buses, selected_blocks, selected_chargers, results, st
 
 
             # visualize twodim df: 'bus', 'time', 'powerCB', 'gridPowToB', 'eB'
-            twodim_df = pd.read_csv(f'{path}/{filename}.csv')
-            twodim_df = twodim_df.iloc[startTimeNum:]
+            twodim_df = results.schedule_df()
+            twodim_df = twodim_df[twodim_df['time'] >= results.startTimeNum]
 
             st.write("### Power CB Distribution")
             cols = st.columns(3)
@@ -372,3 +486,41 @@ def show_results(selected_buses, selected_blocks, selected_chargers, results, st
 
                     # Display the plot
                     st.plotly_chart(fig, use_container_width=True)
+
+
+def show_diagnosis(issues):
+    # what pre-solve screening found (chargeopt/screening.py), blocking issues first
+    for issue in sorted(issues, key=lambda issue: not issue['fatal']):
+        message = issue['message']
+        if issue['items']:
+            message += f": {', '.join(map(str, issue['items']))}"
+        if issue['fatal']:
+            st.error(message)
+        else:
+            st.info(message)
+
+
+def show_telemetry(telemetry):
+    # where the run's time went, the model size and the incumbent/bound trace (chargeopt/telemetry.py)
+    counts = telemetry.get('counts', {})
+    if counts:
+        cols = st.columns(len(counts))
+        for col, (name, value) in zip(cols, counts.items()):
+            col.metric(name, f"{value:,}")
+
+    phases = pd.DataFrame(list(telemetry.get('phases', {}).items()), columns=['phase', 'seconds'])
+    phases['share'] = phases['seconds'] / phases['seconds'].sum()
+    st.dataframe(phases, hide_index=True, use_container_width=True,
+                 column_config={'seconds': st.column_config.NumberColumn(format="%.3f"),
+                                'share': st.column_config.ProgressColumn(min_value=0, max_value=1)})
+
+    trace = telemetry.get('trace', [])
+    if trace:
+        trace_df = pd.DataFrame(trace, columns=['time', 'incumbent', 'bound'])
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=trace_df['time'], y=trace_df['incumbent'], mode='lines', line_shape='hv',
+                                 name='Incumbent', line=dict(color='blue')))
+        fig.add_trace(go.Scatter(x=trace_df['time'], y=trace_df['bound'], mode='lines', line_shape='hv',
+                                 name='Best Bound', line=dict(color='red')))
+        fig.update_layout(title='Incumbent and Bound', xaxis_title='seconds into optimize', yaxis_title='cost')
+        st.plotly_chart(fig, use_container_width=True)
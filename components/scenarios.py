@@ -0,0 +1,69 @@
+import streamlit as st
+import pandas as pd
+from chargeopt.helpers import load_config
+from chargeopt.sweep import run_sweep, scenarios
+
+
+def parse_values(text, cast=float):
+    # "300, 400,500" -> [300.0, 400.0, 500.0], empty -> []
+    return [cast(value) for value in text.replace(' ', '').split(',') if value]
+
+
+def scenario_sweep(selected_buses, selected_blocks, selected_chargers):
+    # what-if runs on the last submitted buses, blocks and chargers (chargeopt/sweep.py)
+    if selected_buses is None or selected_blocks is None or selected_chargers is None:
+        return
+    if 'sweep' not in st.session_state:
+        st.session_state['sweep'] = None
+
+    config = load_config()
+    with st.expander("Scenario Sweep"):
+        with st.form("Scenario Sweep Form"):
+            st.caption("Comma-separated values, every combination is solved. Leave a field empty to keep the current value.")
+            cols = st.columns(3)
+            numChargers = cols[0].text_input("Chargers in service", f"{len(selected_chargers)}")
+            gridMaxPower = cols[1].text_input("Grid max power (kW)", f"{config['gridMaxPower']}")
+            chargerPower = cols[2].text_input("Charger power (kW)", f"{config['chargerPower']}")
+            cols = st.columns(3)
+            tariffScale = cols[0].text_input("Tariff multiplier", "1.0")
+            numBuses = cols[1].text_input("Buses in service", f"{len(selected_buses)}")
+            timeLimit = cols[2].number_input("Time limit per scenario (s)", min_value=5, value=60)
+            run_type = st.radio("Route Assignment", options=['Optimal', 'Decomposed', 'Heuristic'], horizontal=True,
+                                key="sweep_run_type")
+            run = st.form_submit_button("Run Sweep")
+
+        if run:
+            try:
+                grid = {
+                    'numChargers': parse_values(numChargers, int),
+                    'gridMaxPower': parse_values(gridMaxPower),
+                    'chargerPower': parse_values(chargerPower),
+                    'tariffScale': parse_values(tariffScale),
+                    'numBuses': parse_values(numBuses, int),
+                }
+            except ValueError:
+                st.error("Values have to be numbers separated by commas")
+                return
+            total = len(scenarios(grid))
+
+            # rows show up as their scenarios finish
+            progress = st.progress(0.0, text=f"0 of {total} scenarios")
+            table = st.empty()
+            rows = []
+            for row in run_sweep(selected_buses, selected_blocks, selected_chargers, grid,
+                                 runType=run_type, timeLimit=timeLimit):
+                rows.append(row)
+                progress.progress(len(rows) / total, text=f"{len(rows)} of {total} scenarios")
+                table.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+            table.empty()
+            progress.empty()
+            st.session_state['sweep'] = pd.DataFrame(rows)
+
+        if st.session_state['sweep'] is not None:
+            sweep = st.session_state['sweep'].sort_values(['feasible', 'cost'], ascending=[False, True])
+            st.dataframe(sweep, hide_index=True, use_container_width=True,
+                         column_config={
+                             'cost': st.column_config.NumberColumn("Cost", format="$%.2f"),
+                             'peakPower': st.column_config.NumberColumn("Peak Power (kW)", format="%.0f"),
+                             'seconds': st.column_config.NumberColumn("Seconds", format="%.1f"),
+                         })
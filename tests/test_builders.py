@@ -0,0 +1,45 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from chargeopt.optimization import ChargeOpt
+
+# The matrix builder against the loop builder it replaced (builder in config.yml): both describe the
+# same model, so they have to find the same optimum. Solved with HiGHS so no gurobi license is needed,
+# and to a zero gap so both stop at the optimum rather than somewhere within the default 3% of it.
+
+
+def fleet():
+    buses = pd.DataFrame({'vehicle': ['7501', '7502'], 'soc': ['85%', '70%'], 'status': ['Idle', 'Idle']})
+    blocks = pd.DataFrame({'block_id': ['B1'], 'block_startTime': ['06:00 AM'], 'block_endTime': ['10:00 AM'],
+                           'Mileage': [40]})
+    chargers = pd.DataFrame({'stationName': ['Station 1']})
+    return buses, blocks, chargers
+
+
+def solve(builder, formulation):
+    buses, blocks, chargers = fleet()
+    opt = ChargeOpt(buses, blocks, chargers)
+    opt.startTime = datetime(2024, 5, 1, 20, 0)
+    opt.notify = print
+    opt.record = False
+    opt.overrides = {'builder': builder, 'formulation': formulation, 'solverBackend': 'highs',
+                     'horizonDays': 2, 'cache': False, 'exportFormat': 'none', 'timeLimit': 120,
+                     'mipGap': 0}
+    return opt.solve('Optimal')
+
+
+@pytest.fixture(autouse=True)
+def data(tmp_path, monkeypatch):
+    # keep whatever a solve writes out of the package
+    monkeypatch.setenv('CHARGEOPT_DATA', str(tmp_path))
+
+
+def test_matrix_matches_loop():
+    loop = solve('loop', 'full')
+    assert loop.status == "Optimal solution found"
+    for formulation in ['full', 'lean']:
+        matrix = solve('matrix', formulation)
+        assert matrix.status == "Optimal solution found"
+        assert matrix.objVal == pytest.approx(loop.objVal, rel=1e-6)
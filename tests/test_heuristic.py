@@ -0,0 +1,29 @@
+from datetime import datetime
+
+import numpy as np
+
+from chargeopt.heuristic import greedy_plan
+from chargeopt.helpers import load_config
+from chargeopt.optimization import ChargeOpt
+from chargeopt.scaling import synthetic_fleet
+
+# The greedy plan is the MIP start of every Optimal run, a fleet it can't fully place still has to get one.
+
+
+def test_greedy_plan_scales_to_a_fleet_it_cant_fully_place():
+    # 100 buses and 50 blocks on 5 chargers, more than the greedy rules can place but nothing screening turns down
+    buses, blocks, chargers = synthetic_fleet(100, 50, 5, seed=0)
+    opt = ChargeOpt(buses, blocks, chargers)
+    opt.startTime = datetime(2024, 5, 1, 20, 0)
+    opt._prepare(load_config())
+
+    plan = greedy_plan(opt)
+    assert plan is not None
+    assignment = plan['assignment'][:, opt.coverDay, :]
+    assert 0 < len(plan['unassigned']) < opt.R
+    # every placed block has one bus, the others none, and no bus runs two
+    placed = np.setdiff1d(np.arange(opt.R), plan['unassigned'])
+    assert (assignment[:, placed].sum(axis=0) == 1).all()
+    assert (assignment[:, plan['unassigned']] == 0).all()
+    assert (assignment.sum(axis=1) <= 1).all()
+    assert (plan['chargerUse'].sum(axis=0) <= opt.numChargers).all()
@@ -0,0 +1,34 @@
+from datetime import datetime
+
+import pandas as pd
+
+from chargeopt.helpers import load_config
+from chargeopt.optimization import ChargeOpt
+from chargeopt.screening import screen
+
+# Screening has to be a necessary condition: it may only turn down requests no plan can serve.
+
+
+def window(soc, endSoc):
+    # a daily-linked window (see horizon.py) from midnight, one bus and one block, no charger or grid power
+    buses = pd.DataFrame({'vehicle': ['7501'], 'soc': [soc], 'status': ['Idle']})
+    blocks = pd.DataFrame({'block_id': ['B1'], 'block_startTime': ['06:00 AM'], 'block_endTime': ['10:00 AM'],
+                           'Mileage': [40]})
+    chargers = pd.DataFrame({'stationName': ['Station 1']})
+    opt = ChargeOpt(buses, blocks, chargers)
+    opt.startTime = datetime(2024, 5, 2, 0, 0)
+    opt.endSoc = [endSoc]
+    opt._prepare(load_config())
+    opt.numChargers = 0
+    opt.gridKWH = 0
+    return screen(opt)
+
+
+def test_window_above_its_end_soc_runs_the_block_without_charging():
+    diagnosis = window('100%', 0.5)
+    assert diagnosis.feasible, diagnosis.status
+
+
+def test_window_at_its_end_soc_has_to_charge_the_block_back():
+    checks = {issue.check for issue in window('100%', 1.0).issues if issue.fatal}
+    assert {'charger hours', 'grid energy'} <= checks